@@ -0,0 +1,70 @@
+import common
+
+
+########################
+##  Aggregate Engine  ##
+########################
+
+# ---------------------------------------------
+# Alternative to the Coalescer's neighbour-by-neighbour coalescing: every valid subnet of a line is
+# converted to its [network, broadcast] interval, overlapping/contained/adjacent intervals are merged
+# (sort + single pass, O(n log n)), and each merged range is emitted as its minimal set of CIDR prefixes.
+
+# function to get the [network, broadcast] interval of a subnet (host bits are dropped)
+def to_interval(sub: int, cidr: int) -> tuple:
+    network = sub & common.CIDR_TO_MASK[cidr]
+    return (network, network + (1 << (32 - cidr)) - 1)
+
+# function to merge overlapping, contained & adjacent intervals
+#   returns list: [start, end] of each merged range, ascending
+def merge_intervals(intervals) -> list:
+    merged = list()
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+# function to split a range of addresses into the minimal list of CIDR prefixes covering it exactly
+#   returns list: (network, cidr) tuples, ascending
+def range_to_prefixes(start: int, end: int) -> list:
+    prefixes = list()
+    while start <= end:
+        # the largest block aligned on 'start' (its lowest set bit) that still fits in the range
+        size = start & -start if start else 1 << 32
+        while size > end - start + 1:
+            size >>= 1
+        prefixes.append((start, 33 - size.bit_length()))
+        start += size
+    return prefixes
+
+# function to format the (sorted) subnets & masks of a single id as their minimal set of prefixes.
+# Subnets that can't be aggregated (invalid IPv4 format, or an invalid mask) are listed first, as 'addr/mask'.
+#   returns tuple: ([id, formatted subnets] (or [] if there are no subnets), # of prefixes merged away, # of invalid masks)
+def format_subnets(id, subs, masks) -> tuple:
+    invalid = list()
+    intervals = list()
+    num_invalid_masks = 0
+    for sub, mask in zip(subs, masks):
+        valid_mask, cidr = common.is_valid_mask_and_cidr(mask) if isinstance(mask, int) else (False, 'N/A')
+        if isinstance(sub, int) and valid_mask:
+            intervals.append(to_interval(sub, cidr))
+            continue
+        if isinstance(mask, int) and not valid_mask:
+            num_invalid_masks += 1
+        invalid.append(common.format_ipv4(sub) + '/' + common.format_ipv4(mask))
+    prefixes = list()
+    for start, end in merge_intervals(intervals):
+        for network, cidr in range_to_prefixes(start, end):
+            if cidr == 0:
+                prefixes.append('Any')
+            else:
+                prefixes.append(common.int_to_ipv4(network) + common.convert_cidr_to_str(cidr))
+    if not invalid and not prefixes:
+        return ([], 0, num_invalid_masks)
+    return ([id, ';'.join(invalid + prefixes)], len(intervals) - len(prefixes), num_invalid_masks)
+
+
+# ---------------------------------------------
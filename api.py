@@ -0,0 +1,42 @@
+import common
+import dataparser
+import coalescence
+import engines
+
+
+###################
+##  Library API  ##
+###################
+
+# ---------------------------------------------
+# Function-level API for coalescing in-memory data from Python code.
+# Nothing is read from or written to files and nothing is printed; rows are formatted lazily,
+# exactly as the batch CLI formats them ([id, formatted subnets]).
+
+# Generator to coalesce 'id:addr/mask,...' lines (e.g. a list of strings or an open file), one row per line.
+# Rows are yielded in input order; sort the lines by id first to get the output file's order.
+#   yields list: [id, formatted subnets]
+def coalesce_lines(lines, memo_size=coalescence.MEMO_SIZE, subnet_cache=None, mode=coalescence.MODE_COALESCE,
+                   engine=engines.REFERENCE):
+    parsed_rows = (dataparser.parse_line(line.rstrip()) for line in lines)
+    data_coalescer = coalescence.Coalescer(parsed_rows, stream=True, memo_size=memo_size, subnet_cache=subnet_cache, mode=mode,
+                                           engine=engine)
+    yield from data_coalescer.rows()
+
+# function to coalesce the subnets of a single id
+#   pairs: (addr, mask) tuples, as IPv4 strings or as integers
+#   returns list: [id, formatted subnets]
+def coalesce_pairs(id: str, pairs, mode=coalescence.MODE_COALESCE, engine=engines.REFERENCE) -> list:
+    parsed_subnets = [[_to_int(addr), _to_int(mask)] for addr, mask in pairs]
+    # sort sub/mask pairs like the parser does (invalid 'str' pairs first, then the valid 'int' ones)
+    dataparser.sort_pairs(parsed_subnets)
+    return coalescence.Coalescer((), stream=True, memo_size=0, mode=mode, engine=engine).format_row([id, parsed_subnets])
+
+# valid IPv4 strings are converted to 'int' (invalid ones stay 'str', like the parser leaves them)
+def _to_int(value):
+    if isinstance(value, str):
+        return common.ipv4_to_int(value)
+    return value
+
+
+# ---------------------------------------------
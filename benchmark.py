@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import io
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+# local modules
+import dataparser
+import coalescence
+import common
+import main
+from common import ConstructionError as ctor
+
+
+###########################
+##  Synthetic Input Data  ##
+###########################
+
+# ---------------------------------------------
+## Class for generating synthetic input files in the same 'id:addr/mask,...' format as the input data.
+## The shares are the fraction of lines (0.0 -> 1.0) that get each shape of subnet list.
+class InputGenerator:
+
+    def __init__(self, lines: int, subnets_per_line=5, host_run_share=0.2, contiguous_share=0.2,
+                 duplicate_share=0.2, invalid_mask_share=0.1, invalid_octet_share=0.0, seed=0):
+        # check ctor arg types
+        ctor.check_arg_type("Failed to construct InputGenerator obj (arg1 must be type 'int')", lines, int)
+        ctor.check_arg_type("Failed to construct InputGenerator obj (subnets_per_line must be type 'int')", subnets_per_line, int)
+        self.__lines = lines
+        self.__subnets_per_line = subnets_per_line
+        self.__host_run_share = host_run_share
+        self.__contiguous_share = contiguous_share
+        self.__duplicate_share = duplicate_share
+        self.__invalid_mask_share = invalid_mask_share
+        self.__invalid_octet_share = invalid_octet_share
+        self.__random = random.Random(seed)
+        self.__prior_subnets = None
+
+    @property
+    def lines(self):
+        return self.__lines
+
+    @property
+    def subnets_per_line(self):
+        return self.__subnets_per_line
+
+    # function to build a 'addr/mask' token from integers
+    @staticmethod
+    def __token(addr: int, cidr: int) -> str:
+        return common.int_to_ipv4(addr) + '/' + common.int_to_ipv4(common.CIDR_TO_MASK[cidr])
+
+    # a run of /32 hosts (contiguous addresses, so they coalesce into supernets & ranges)
+    def __host_run(self, count: int) -> list:
+        start = self.__random.randrange(0x0A000000, 0x0AFFFFFF - count)
+        return [self.__token(start + i, 32) for i in range(count)]
+
+    # a run of contiguous networks of the same size
+    def __contiguous_networks(self, count: int) -> list:
+        cidr = self.__random.choice((24, 25, 26, 28, 30))
+        size = 1 << (32 - cidr)
+        start = self.__random.randrange(0x0A000000, 0x0AFFFFFF - count * size) & common.CIDR_TO_MASK[cidr]
+        return [self.__token(start + i * size, cidr) for i in range(count)]
+
+    # random networks spread across the address space (mostly nothing to coalesce)
+    def __scattered_networks(self, count: int) -> list:
+        tokens = list()
+        for _ in range(count):
+            cidr = self.__random.choice((16, 24, 24, 25, 31, 32, 32))
+            addr = self.__random.randrange(0x0A000000, 0xDFFFFFFF)
+            tokens.append(self.__token(addr, cidr))
+        return tokens
+
+    # a single subnet with a non-contiguous mask (like '10.0.0.128/255.0.0.192' in the sample input)
+    def __invalid_mask(self) -> list:
+        addr = common.int_to_ipv4(self.__random.randrange(0x0A000000, 0x0AFFFFFF))
+        return [addr + '/' + self.__random.choice(('255.0.0.192', '255.254.255.252', '255.0.0.255'))]
+
+    # a single subnet with an out-of-range octet (kept as an invalid token & written as-is)
+    def __invalid_octet(self) -> list:
+        return ['10.%d.%d.256/255.255.255.255' % (self.__random.randrange(256), self.__random.randrange(256))]
+
+    # build the subnets of the next line based on the configured shares
+    def __next_subnets(self) -> list:
+        roll = self.__random.random()
+        count = self.subnets_per_line
+        for share, shape in ((self.__invalid_octet_share, self.__invalid_octet),
+                             (self.__invalid_mask_share, self.__invalid_mask),
+                             (self.__duplicate_share, None),
+                             (self.__host_run_share, lambda: self.__host_run(count)),
+                             (self.__contiguous_share, lambda: self.__contiguous_networks(count))):
+            if roll < share:
+                # duplicates repeat the prior line's subnet list under a new id
+                if shape is None:
+                    if self.__prior_subnets is not None:
+                        return self.__prior_subnets
+                    break
+                return shape()
+            roll -= share
+        return self.__scattered_networks(count)
+
+    # Generator to yield one input line at a time
+    def generate(self):
+        for id in range(self.lines):
+            subnets = self.__next_subnets()
+            self.__prior_subnets = subnets
+            shuffled = list(subnets)
+            self.__random.shuffle(shuffled)
+            yield f"{id}:{','.join(shuffled)}"
+
+    # write the synthetic input file
+    def write_file(self, filepath: str):
+        with open(filepath, 'w', newline='') as f:
+            for line in self.generate():
+                f.write(line + '\r\n')
+
+
+# ---------------------------------------------
+#############
+##  Tiers  ##
+#############
+
+# tier name -> InputGenerator args
+TIERS = {
+    '10k': {'lines': 10_000},
+    '1m': {'lines': 1_000_000},
+    '10m': {'lines': 10_000_000},
+    'worst': {'lines': 20, 'subnets_per_line': 12_000, 'host_run_share': 0.5, 'contiguous_share': 0.5,
+              'duplicate_share': 0.0, 'invalid_mask_share': 0.0},
+}
+DEFAULT_TIERS = ['10k', 'worst']
+
+# max relative drop in throughput (or rise in peak memory) before a result is flagged as a regression
+REGRESSION_THRESHOLD = 0.10
+
+
+# function to get the peak resident memory of this process so far (in MB)
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+# function to time the Parser, Coalescer and FileWriter stages separately for one input file.
+# Peak memory is only reported for the whole tier: ru_maxrss is the process's high-water mark, so a later
+# stage's reading would still hold an earlier stage's peak.
+#   returns dict: {'stages': {stage: {seconds, lines_per_sec, subnets_per_sec}}, 'peak_rss_mb': peak_rss_mb}
+def run_stages(input_file: str, output_file: str, compact=False) -> dict:
+    results = dict()
+    # the stages print progress messages; keep them out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        input_parser = dataparser.Parser(input_file, compact=compact)
+        results['parser'] = {'seconds': time.perf_counter() - start}
+
+        start = time.perf_counter()
+        data_coalescer = coalescence.Coalescer(input_parser.parsed_data)
+        results['coalescer'] = {'seconds': time.perf_counter() - start}
+
+        start = time.perf_counter()
+        main.FileWriter(output_file, data_coalescer.datatable).write_file()
+        results['filewriter'] = {'seconds': time.perf_counter() - start}
+
+    if compact:
+        num_lines, num_subnets = len(input_parser.parsed_data), len(input_parser.parsed_data.pairs) // 2
+    else:
+        num_lines = len(input_parser.parsed_data)
+        num_subnets = sum(len(row[1]) for row in input_parser.parsed_data)
+    for stage in results.values():
+        seconds = max(stage['seconds'], 1e-9)
+        stage['seconds'] = round(seconds, 4)
+        stage['lines_per_sec'] = round(num_lines / seconds, 1)
+        stage['subnets_per_sec'] = round(num_subnets / seconds, 1)
+    return {'stages': results, 'peak_rss_mb': peak_rss_mb()}
+
+# function to generate a tier's input and time it in a fresh process (so peak memory is per tier)
+def run_tier(tier: str, workdir: str, compact=False) -> dict:
+    input_file = os.path.join(workdir, f"bench_{tier}.csv")
+    output_file = os.path.join(workdir, f"bench_{tier}_output.csv")
+    InputGenerator(**TIERS[tier]).write_file(input_file)
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-stages', input_file, output_file]
+    if compact:
+        cmd.append('--compact')
+    proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+# function to compare results with the previous baseline
+#   returns list: a message for each stage of each tier whose throughput regressed, & each tier whose peak memory did
+def find_regressions(results: dict, baseline: dict, threshold=REGRESSION_THRESHOLD) -> list:
+    regressions = list()
+    for tier, result in results.items():
+        previous_result = baseline.get(tier, {})
+        for stage, current in result['stages'].items():
+            previous = previous_result.get('stages', {}).get(stage)
+            if previous is None:
+                continue
+            if current['lines_per_sec'] < previous['lines_per_sec'] * (1 - threshold):
+                regressions.append(f"{tier}/{stage}: throughput {previous['lines_per_sec']} -> {current['lines_per_sec']} lines/sec")
+        previous_peak = previous_result.get('peak_rss_mb')
+        if previous_peak is not None and result['peak_rss_mb'] > previous_peak * (1 + threshold):
+            regressions.append(f"{tier}: peak memory {previous_peak} -> {result['peak_rss_mb']} MB")
+    return regressions
+
+
+# ---------------------------------------------
+##################
+##  Entrypoint  ##
+##################
+def parse_args(argv):
+    argparser = argparse.ArgumentParser(prog='benchmark.py', description="Time the Parser, Coalescer & FileWriter on synthetic inputs.")
+    argparser.add_argument('--tiers', nargs='+', default=DEFAULT_TIERS, choices=list(TIERS),
+                           help=f"scale tiers to run (default: {' '.join(DEFAULT_TIERS)})")
+    argparser.add_argument('--baseline', default='benchmark_baseline.json',
+                           help="JSON baseline to compare against (and to update with --save)")
+    argparser.add_argument('--save', action='store_true', help="write the results to the baseline file")
+    argparser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                           help=f"relative change flagged as a regression (default: {REGRESSION_THRESHOLD})")
+    argparser.add_argument('--compact', action='store_true', help="use the compact parser storage mode")
+    argparser.add_argument('--generate', metavar='FILE', help="only write a synthetic input file (use with --lines)")
+    argparser.add_argument('--lines', type=int, default=10_000, help="# of lines for --generate")
+    argparser.add_argument('--run-stages', nargs=2, metavar=('INPUT', 'OUTPUT'), help=argparse.SUPPRESS)
+    return argparser.parse_args(argv)
+
+def run(argv) -> int:
+    args = parse_args(argv)
+    # child process: time the stages of one input file and report them as JSON on stdout
+    if args.run_stages:
+        print(json.dumps(run_stages(*args.run_stages, compact=args.compact)))
+        return 0
+    if args.generate:
+        InputGenerator(args.lines).write_file(args.generate)
+        print(f"...Synthetic input written to '{args.generate}'")
+        return 0
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as workdir:
+        for tier in args.tiers:
+            print(f"...Running tier '{tier}'")
+            results[tier] = run_tier(tier, workdir, compact=args.compact)
+            for stage, result in results[tier]['stages'].items():
+                print(f"   {stage:<10} {result['seconds']:>9.3f}s {result['lines_per_sec']:>13,.0f} lines/s "
+                      f"{result['subnets_per_sec']:>13,.0f} subnets/s")
+            print(f"   {'peak':<10} {results[tier]['peak_rss_mb']:>8.1f} MB")
+
+    regressions = list()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if not regressions:
+            print(f"...No regressions against '{args.baseline}'")
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"...Baseline written to '{args.baseline}'")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import marshal
+import hashlib
+# local modules
+import common
+from common import ConstructionError as ctor
+
+
+########################
+##  Persistent Cache  ##
+########################
+
+# default max # of entries kept in a cache file (the least recently used entries are evicted beyond that)
+MAX_ENTRIES = 1_000_000
+
+# max # of keys per batched lookup query (SQLite's default limit on '?' parameters is 999 in older versions)
+PREFETCH_BATCH = 500
+
+# bytes of the cache file that SQLite may memory-map for lookups
+MMAP_SIZE = 256 * 1024 * 1024
+
+# seconds to wait for another process (e.g. a --workers process) to release its write lock
+LOCK_TIMEOUT = 30
+
+# function to build a cache key from a normalized subnet list (& the name of the format it was rendered in)
+# (marshal version 2 has no back-references, so equal tuples of ints/strs/bytes always serialize the same)
+#   returns bytes: 16 byte digest
+def make_key(kind: str, subnets) -> bytes:
+    return hashlib.blake2b(marshal.dumps((kind, subnets), 2), digest_size=16).digest()
+
+# ---------------------------------------------
+## Class for a persistent (SQLite) cache of formatted output strings, shared across runs & processes.
+## Every entry belongs to the 'version' of the coalescing logic it was made with; opening the cache with
+## another version drops all of the stale entries. Keys can be prefetched in batches (one query per
+## PREFETCH_BATCH keys instead of one per key); new entries & last-used updates are buffered and written
+## in a single transaction by flush()/close().
+class SubnetCache:
+
+    def __init__(self, filepath: str, version: int, max_entries=MAX_ENTRIES):
+        # check ctor arg types
+        ctor.check_arg_type("Failed to construct SubnetCache obj (arg1 must be type 'str')", filepath, str)
+        ctor.check_arg_type("Failed to construct SubnetCache obj (arg2 must be type 'int')", version, int)
+        self.__filepath = filepath
+        self.__version = version
+        self.__max_entries = max_entries
+        self.__pending = dict()
+        self.__used = set()
+        # prefetched entries, and the prefetched keys that aren't in the file
+        self.__prefetched = dict()
+        self.__prefetched_missing = set()
+        dir_path = os.path.dirname(filepath)
+        if dir_path:
+            common.make_dir_if_needed(dir_path)
+        self.__conn = sqlite3.connect(filepath, timeout=LOCK_TIMEOUT)
+        self.__conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self.__generation = self.__open_generation()
+
+    @property
+    def filepath(self):
+        return self.__filepath
+
+    @property
+    def version(self):
+        return self.__version
+
+    @property
+    def max_entries(self):
+        return self.__max_entries
+
+    # create the tables if needed, drop stale entries, and start a new 'generation' (for LRU eviction)
+    #   returns int: the generation # of this run
+    def __open_generation(self) -> int:
+        with self.__conn:
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                                "(key BLOB PRIMARY KEY, value TEXT NOT NULL, last_used INTEGER NOT NULL) WITHOUT ROWID")
+            self.__conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            meta = dict(self.__conn.execute("SELECT name, value FROM meta"))
+            if meta.get('version') != self.version:
+                if 'version' in meta:
+                    print(f"...Cache '{self.filepath}' was made by another coalescing version; dropping its entries.")
+                self.__conn.execute("DELETE FROM entries")
+            generation = meta.get('generation', 0) + 1
+            self.__conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                    (('version', self.version), ('generation', generation)))
+        return generation
+
+    # load the entries of many keys at once (later get() calls for these keys don't query the file)
+    def prefetch(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), PREFETCH_BATCH):
+            batch = keys[start:start + PREFETCH_BATCH]
+            query = f"SELECT key, value FROM entries WHERE key IN ({','.join('?' * len(batch))})"
+            self.__prefetched.update(self.__conn.execute(query, batch))
+        self.__prefetched_missing.update(key for key in keys if key not in self.__prefetched)
+        self.__used.update(self.__prefetched)
+
+    # look up a cached value
+    #   returns str: the value, or None if it isn't cached
+    def get(self, key: bytes):
+        value = self.__pending.get(key)
+        if value is None:
+            value = self.__prefetched.get(key)
+        if value is not None or key in self.__prefetched_missing:
+            return value
+        found = self.__conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if found is None:
+            return None
+        self.__used.add(key)
+        return found[0]
+
+    # add a value (written on the next flush)
+    def put(self, key: bytes, value: str):
+        self.__pending[key] = value
+
+    # get the # of entries in the cache file
+    def __len__(self) -> int:
+        return self.__conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # write the buffered entries & last-used updates
+    def flush(self):
+        with self.__conn:
+            self.__conn.executemany("INSERT OR REPLACE INTO entries (key, value, last_used) VALUES (?, ?, ?)",
+                                    ((key, value, self.__generation) for key, value in self.__pending.items()))
+            self.__conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                    ((self.__generation, key) for key in self.__used))
+        self.__pending.clear()
+        self.__used.clear()
+        self.__prefetched.clear()
+        self.__prefetched_missing.clear()
+
+    # evict the least recently used entries beyond 'max_entries'
+    #   returns int: # of evicted entries
+    def evict(self) -> int:
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return 0
+        with self.__conn:
+            self.__conn.execute("DELETE FROM entries WHERE key IN "
+                                "(SELECT key FROM entries ORDER BY last_used LIMIT ?)", (excess,))
+        print(f"...Evicted {excess} least recently used entries from cache '{self.filepath}'.")
+        return excess
+
+    # flush, evict & close the cache file ('evict=False' for worker processes sharing the parent's cache)
+    def close(self, evict=True):
+        self.flush()
+        if evict:
+            self.evict()
+        self.__conn.close()
+
+
+# ---------------------------------------------
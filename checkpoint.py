@@ -0,0 +1,210 @@
+import os
+import io
+import json
+import time
+# local modules
+import common
+from common import ConstructionError as ctor
+
+
+##################
+##  Checkpoint  ##
+##################
+
+# the rows written so far go to '<output_file>.part', and the checkpoint state to '<output_file>.checkpoint'
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.checkpoint'
+CHECKPOINT_VERSION = 1
+
+# default # of seconds between checkpoints
+CHECKPOINT_INTERVAL = 60
+
+# # of rows written between looks at the clock
+CHECK_EVERY_ROWS = 1024
+
+# # of sorted rows coalesced at a time in a checkpointed batch run (a checkpoint is only saved between rows
+# that were written, so the whole table isn't coalesced before the first one)
+CHUNK_ROWS = 100000
+
+# function to get the checkpoint state filepath for an output file
+def state_path(output_file: str) -> str:
+    return output_file + STATE_SUFFIX
+
+# function to get the part filepath for an output file
+def part_path(output_file: str) -> str:
+    return output_file + PART_SUFFIX
+
+## Binary stream compressed as a series of complete members (gzip members, or bzip2/xz streams), which
+## decompress as a single stream. end_member() finishes the current member, so that everything written so
+## far is a valid compressed file that can be truncated back to; the next write starts a new member.
+class _CompressedMembers(io.RawIOBase):
+
+    def __init__(self, raw, opener):
+        self.__raw = raw
+        self.__opener = opener
+        self.__member = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.__member is None:
+            self.__member = self.__opener(self.__raw, 'wb')
+        return self.__member.write(data)
+
+    def end_member(self):
+        if self.__member is not None:
+            self.__member.close()
+            self.__member = None
+        self.__raw.flush()
+
+    def fileno(self):
+        return self.__raw.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.end_member()
+        finally:
+            self.__raw.close()
+            super().close()
+
+# ---------------------------------------------
+## Class for checkpointing a long run so that it can be resumed after a crash.
+## The output rows are written to a part file, and every 'interval' seconds the part file is synced and
+## a checkpoint is saved atomically (temp file + rename): the # of rows written, the part file's size and
+## the position reached in the input (e.g. the # of input lines consumed). On resume, the part file is
+## truncated back to the last checkpoint & appended to, and the run continues from the saved position;
+## the part file only becomes the output file once the run has finished, so the output is the same as an
+## uninterrupted run's. A checkpoint is only used for the same input file (size & mtime) and run settings.
+## A compressed output file's part file is compressed as it is written too (never held decompressed on
+## disk), one member per checkpoint, so it decompresses to the same rows as an uninterrupted run's output.
+class Checkpoint:
+
+    def __init__(self, output_file: str, input_file: str, settings: dict, interval=CHECKPOINT_INTERVAL, resume=False):
+        # check ctor arg types
+        ctor.check_arg_type("Failed to construct Checkpoint obj (arg1 must be type 'str')", output_file, str)
+        ctor.check_arg_type("Failed to construct Checkpoint obj (arg2 must be type 'str')", input_file, str)
+        if interval <= 0:
+            raise ctor("Failed to construct Checkpoint obj (interval must be > 0)")
+        # verify the input file exists
+        common.check_path_exists(input_file)
+        self.__output_file = output_file
+        self.__interval = interval
+        input_stat = os.stat(input_file)
+        self.__run_key = {'version': CHECKPOINT_VERSION, 'input_file': os.path.abspath(input_file),
+                          'input_bytes': input_stat.st_size, 'input_mtime_ns': input_stat.st_mtime_ns, **settings}
+        self.__part = None
+        self.__members = None
+        self.__next_save = 0.0
+        self.__num_saves = 0
+        # progress of the run (restored from the last checkpoint on resume)
+        self.__rows_done = 0
+        self.__part_bytes = 0
+        self.__position = dict()
+        self.__resumed = resume and self.__load()
+
+    @property
+    def output_file(self):
+        return self.__output_file
+
+    @property
+    def part_file(self):
+        return part_path(self.output_file)
+
+    @property
+    def state_file(self):
+        return state_path(self.output_file)
+
+    @property
+    def interval(self):
+        return self.__interval
+
+    @property
+    def resumed(self):
+        return self.__resumed
+
+    @property
+    def rows_done(self):
+        return self.__rows_done
+
+    # input position reached at the last checkpoint (dict; empty when starting over)
+    @property
+    def position(self):
+        return self.__position
+
+    @property
+    def num_saves(self):
+        return self.__num_saves
+
+    # load the last checkpoint & truncate the part file back to it
+    #   returns bool: whether the run can be resumed
+    def __load(self) -> bool:
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state['run'] == self.__run_key and os.path.getsize(self.part_file) >= state['part_bytes']:
+                os.truncate(self.part_file, state['part_bytes'])
+                self.__rows_done = state['rows']
+                self.__part_bytes = state['part_bytes']
+                self.__position = state['position']
+                print(f"...Resuming from checkpoint: {self.rows_done} rows already written to '{self.part_file}'")
+                return True
+        except (OSError, ValueError, KeyError):
+            pass
+        print(f"...No usable checkpoint for '{self.output_file}'; starting over.")
+        return False
+
+    # open the part file for writing (appended to when resuming), compressed if the output file's extension asks for it
+    def open_part(self, buffer_size=common.IO_BUFFER_SIZE):
+        dir_path = os.path.dirname(self.output_file)
+        if dir_path:
+            common.make_dir_if_needed(dir_path)
+        opener = common.COMPRESSED_EXTS.get(os.path.splitext(self.output_file)[1])
+        if opener is None:
+            self.__part = open(self.part_file, 'a' if self.resumed else 'w', newline='', buffering=buffer_size)
+        else:
+            self.__members = _CompressedMembers(open(self.part_file, 'ab' if self.resumed else 'wb'), opener)
+            self.__part = io.TextIOWrapper(io.BufferedWriter(self.__members, buffer_size), newline='')
+        self.__next_save = time.monotonic() + self.interval
+        return self.__part
+
+    # Generator to count the rows as the part file's writer consumes them & save a checkpoint every 'interval'
+    # seconds. When the writer asks for the next row, every row before it has been written, and (as every
+    # stage is lazy) the input has been read up to the rows written, so 'position' (a function returning
+    # the input position as a dict, if any) is exactly where to resume.
+    def track(self, rows, position=None):
+        for row in rows:
+            yield row
+            self.__rows_done += 1
+            if self.__rows_done % CHECK_EVERY_ROWS == 0 and time.monotonic() >= self.__next_save:
+                self.save(position() if position is not None else {})
+
+    # sync the part file & save a checkpoint of the rows written so far
+    def save(self, position: dict):
+        self.__part.flush()
+        if self.__members is not None:
+            self.__members.end_member()
+        os.fsync(self.__part.fileno())
+        self.__part_bytes = os.fstat(self.__part.fileno()).st_size
+        self.__position = position
+        state = {'run': self.__run_key, 'rows': self.rows_done, 'part_bytes': self.__part_bytes, 'position': position}
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(state))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+        self.__num_saves += 1
+        self.__next_save = time.monotonic() + self.interval
+
+    # close the part file, turn it into the output file, and remove the checkpoint
+    def finish(self):
+        self.__part.close()
+        os.replace(self.part_file, self.output_file)
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+
+# ---------------------------------------------
@@ -1,26 +1,133 @@
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import common
+import cache
+import aggregate
+import engines
+from progress import PROGRESS_EVERY
 from common import ConstructionError as ctor
+from dataparser import CompactData
 
 
 #################
 ##  Coalescer  ##
 #################
 
+# default max # of distinct subnet lists kept in the Coalescer's memo (0 disables memoization)
+MEMO_SIZE = 10000
+
+# version of the formatting/coalescing logic; bump it whenever the output for a subnet list changes,
+# so that entries in persistent caches made by older versions are dropped
+COALESCE_VERSION = 2
+
+# coalescing modes: 'coalesce' (neighbouring subnets, ranges kept as 'a-b') or 'aggregate' (minimal set of prefixes)
+MODE_COALESCE = 'coalesce'
+MODE_AGGREGATE = 'aggregate'
+MODES = (MODE_COALESCE, MODE_AGGREGATE)
+
+# placeholder for the id in memoized entries (the same subnet list can belong to many ids)
+_MEMO_ID = object()
+
 # ---------------------------------------------
 ## Class for additional data validation, data formatting, and coalescing of IP's (if possible)
 class Coalescer:
 
-    def __init__(self, data: list):
-        # check ctor arg type
-        ctor.check_arg_type("Failed to initialize Coalescer obj (arg must be type 'list')", data, list)
+    def __init__(self, data: list, stream=False, workers=1, memo_size=MEMO_SIZE, subnet_cache=None, mode=MODE_COALESCE,
+                 engine=engines.REFERENCE, progress=None):
+        # check ctor arg type (streaming mode accepts any iterable of parsed rows, e.g. Parser.rows())
+        if not stream:
+            ctor.check_arg_type("Failed to initialize Coalescer obj (arg must be type 'list' or 'CompactData')", data, (list, CompactData))
+        if mode not in MODES:
+            raise ctor(f"Failed to initialize Coalescer obj (mode must be one of {MODES})")
+        if engine not in engines.ENGINES:
+            raise ctor(f"Failed to initialize Coalescer obj (engine must be one of {tuple(engines.ENGINES)})")
+        if engine != engines.REFERENCE and mode != MODE_COALESCE:
+            raise ctor(f"Failed to initialize Coalescer obj (engines only apply to the '{MODE_COALESCE}' mode)")
         self.__parsed_data = data
-        self.__candidates_list = list()
+        self.__stream = stream
+        self.__workers = workers
+        self.__mode = mode
+        self.__engine = engine
+        self.__engine_func = engines.get_engine(engine)
+        # run counters (coalesced subnets & invalid mask values, including memoized rows)
+        self.__num_coalesced = 0
+        self.__num_invalid_masks = 0
+        # bounded LRU memo of formatted output per (sorted) subnet list; repeated policies skip coalescing
+        self.__memo = OrderedDict()
+        self.__memo_size = memo_size
+        self.__memo_hits = 0
+        self.__memo_misses = 0
+        # optional persistent cache (cache.SubnetCache) behind the memo, shared across runs
+        self.__subnet_cache = subnet_cache
+        self.__cache_hits = 0
+        self.__cache_misses = 0
         self.__data_table = None
-        self.__format_datatable()
+        # the rows formatted into the datatable are reported to the progress reporter (progress.Progress), if any
+        self.__progress = progress
+        # in streaming mode the rows are formatted lazily via rows(), so nothing is stored here
+        if not self.stream:
+            self.__format_datatable()
 
     @property
     def parsed_data(self):
         return self.__parsed_data
+
+    @property
+    def stream(self):
+        return self.__stream
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def num_coalesced(self):
+        return self.__num_coalesced
+
+    @property
+    def num_invalid_masks(self):
+        return self.__num_invalid_masks
+
+    # get the run counters as a dict
+    @property
+    def counters(self) -> dict:
+        return {'coalesced': self.num_coalesced, 'invalid_masks': self.num_invalid_masks,
+                'memo_hits': self.memo_hits, 'memo_misses': self.memo_misses,
+                'cache_hits': self.cache_hits, 'cache_misses': self.cache_misses}
+
+    @property
+    def memo_size(self):
+        return self.__memo_size
+
+    @property
+    def memo_hits(self):
+        return self.__memo_hits
+
+    @property
+    def memo_misses(self):
+        return self.__memo_misses
+
+    @property
+    def subnet_cache(self):
+        return self.__subnet_cache
+
+    @property
+    def cache_hits(self):
+        return self.__cache_hits
+
+    @property
+    def cache_misses(self):
+        return self.__cache_misses
     
     @property
     def datatable(self):
@@ -37,229 +144,433 @@ class Coalescer:
         return False
 
     # ------------------------
-    # Combine IP's if possible
-    def __coalesce_ips(self, subs_list: list, init_idx=0, prior_submap=None):
-        common.check_arg_type(subs_list, list, "Coalescer.__coalesce_ips() arg1 must be of type 'list'")
-        common.check_arg_type(init_idx, int, "Coalescer.__coalesce_ips() arg2 must be of type 'int'")
-
-        # Define some local methods for subnet coalescence
-        def __track_coalesced(self):
-            sub_datamap['coalesced'] = True
-            self.__num_coalesced += 1
+    # Combine IP's if possible.
+    # Single forward pass from 'start_idx' that compares each subnet with its prior subnet and stops at the
+    # first subnet that can't be part of the current run, then a backward pass that formats the remaining
+    # candidates. Returns the formatted subnets string & the number of pairs consumed from the list.
+    # The run stops before 'end_idx' (default: the end of the list).
+    def __coalesce_ips(self, subs: list, masks: list, start_idx=0, end_idx=None):
+        common.check_arg_type(start_idx, int, "Coalescer.__coalesce_ips() arg3 must be of type 'int'")
 
         def __is_contiguous(sub1: int, sub2: int) -> bool:
             # diff between sub1 and sub2 must equal 1 to be contiguous
             return max(sub1, sub2) - min(sub1, sub2) == 1
 
-        def __get_network_int(subnet, mask) -> int:
-            common.check_arg_type(subnet, int, "get_network_int() arg1 must be of type 'int'")
-            common.check_arg_type(mask, int, "get_network_int() arg2 must be of type 'int'")
-            # bitwise AND of subnet & mask will return the network address (as an integer)
-            return subnet & mask
-
-        def __calculate_supernet() -> int:
-            # use "2 to the N" to calculate supernet mask, where 'N' is the diff of (32 - cidr #)
-            mask = sub_datamap['mask_int'] - (2 ** (32 - sub_datamap['cidr']))
-            network = __get_network_int(sub_datamap['sub_int'], mask)
-            return network
-        
-        def __supernet():
-            # update subnet datamap values with supernet vals
-            sub_datamap['network'] = __calculate_supernet()
-            sub_datamap['mask_int'] = sub_datamap['mask_int'] - (2 ** (32 - sub_datamap['cidr']))
-            sub_datamap['cidr'] -= 1
-            sub_datamap['cidr_str'] = common.convert_cidr_to_str(sub_datamap['cidr'])
-            # update prior sub's datamap to reflect supernet vals
-            prior_submap['mask_int'] = sub_datamap['mask_int']
-            prior_submap['cidr'] = sub_datamap['cidr']
-            prior_submap['cidr_str'] = sub_datamap['cidr_str']
-
-        # Map pertinent data values for current subnet
-        valid_mask, cidr = common.is_valid_mask_and_cidr(subs_list[0][1])
-        sub_datamap = {
-            'sub_idx' : init_idx,
-            'sub_int' : subs_list[0][0],
-            'sub_str' : common.int_to_ipv4(subs_list[0][0]),
-            'mask_int' : subs_list[0][1],
-            'cidr' : cidr,
-            'cidr_str' : common.convert_cidr_to_str(cidr),
-            'network' : __get_network_int(subs_list[0][0], subs_list[0][1]),
-            'network_ips' : 2 ** (32 - cidr),
-            'contiguous' : False,
-            'range' : False,
-            'coalesced': False,
-            'contiguous_network': False
-        }
-        # set the broadcast ip (int & str)
-        sub_datamap['broadcast_ip'] = sub_datamap['network'] + sub_datamap['network_ips'] - 1
-        sub_datamap['broadcast_str'] = common.int_to_ipv4(sub_datamap['broadcast_ip'])
-        # append subnet to candidates list; initialize boolean for tracking recursion criteria
-        self.__candidates_list.append(sub_datamap)
-        recursion_bool = True
-        subnets = ''
-
-        ## Check specific conditions to determine the type of coalescence, if any.
-        # Need at least 2 candidates to compare subnet data.
-        if len(self.__candidates_list) >= 2:
-            # a) Check for duplicate
-            if prior_submap['sub_int'] == sub_datamap['sub_int']:
-                __track_coalesced(self)
-            # b) Check if the subs are contiguous
-            elif __is_contiguous(prior_submap['sub_int'], sub_datamap['sub_int']):
-                sub_datamap['contiguous'] = True
-                # check if contiguous subs are in the same network
-                if prior_submap['network'] == sub_datamap['network']:
-                    __track_coalesced(self)
-                # check if the prior subnet is contiguous (which would make this part of a range)
-                elif prior_submap['contiguous']:
-                    sub_datamap['range'] = True
-                    # check if the next sub is contiguous
-                    if len(subs_list) >= 2:
-                        if __is_contiguous(sub_datamap['sub_int'], subs_list[1][0]):
-                            __track_coalesced(self)
-                # check if supernetting will put the contiguous subs in the same network
-                elif prior_submap['network'] == __calculate_supernet():
-                    __supernet()
-                    __track_coalesced(self)
-                    # check if the next sub is contiguous
-                    if len(subs_list) >= 2:
-                        if __is_contiguous(sub_datamap['sub_int'], subs_list[1][0]):
+        def __track_coalesced(submap):
+            submap.coalesced = True
+            self.__num_coalesced += 1
+
+        candidates = list()
+        prior_submap = None
+        last_idx = (len(subs) if end_idx is None else end_idx) - 1
+        idx = start_idx
+        while True:
+            # Map pertinent data values for current subnet
+            sub_datamap = _Subnet(subs[idx], masks[idx])
+            candidates.append(sub_datamap)
+            has_next = idx < last_idx
+            continue_bool = True
+
+            ## Check specific conditions to determine the type of coalescence, if any.
+            # Need at least 2 candidates to compare subnet data.
+            if prior_submap is not None:
+                # a) Check for duplicate
+                if prior_submap.sub_int == sub_datamap.sub_int:
+                    __track_coalesced(sub_datamap)
+                # b) Check if the subs are contiguous
+                elif __is_contiguous(prior_submap.sub_int, sub_datamap.sub_int):
+                    sub_datamap.contiguous = True
+                    # check if contiguous subs are in the same network
+                    if prior_submap.network == sub_datamap.network:
+                        __track_coalesced(sub_datamap)
+                    # check if the prior subnet is contiguous (which would make this part of a range)
+                    elif prior_submap.contiguous:
+                        sub_datamap.range = True
+                        # check if the next sub is contiguous
+                        if has_next and __is_contiguous(sub_datamap.sub_int, subs[idx + 1]):
+                            __track_coalesced(sub_datamap)
+                    # check if supernetting will put the contiguous subs in the same network
+                    elif prior_submap.network == sub_datamap.supernet_network():
+                        sub_datamap.supernet(prior_submap)
+                        __track_coalesced(sub_datamap)
+                        # check if the next sub is contiguous
+                        if has_next and __is_contiguous(sub_datamap.sub_int, subs[idx + 1]):
                             # these contiguous subs are a multi-network range
-                            sub_datamap['range'] = True
-                            prior_submap['range'] = True
+                            sub_datamap.range = True
+                            prior_submap.range = True
+                    else:
+                        # these contiguous subs are a multi-network range
+                        sub_datamap.range = True
+                        prior_submap.range = True
+                        # check if the next sub is contiguous
+                        if has_next:
+                            if __is_contiguous(sub_datamap.sub_int, subs[idx + 1]):
+                                __track_coalesced(sub_datamap)
+                            else:
+                                # next sub is not contiguous, the run ends here
+                                continue_bool = False
+                # c) Check if supernetting will put the non-contiguous subs in the same network
+                elif prior_submap.network == sub_datamap.supernet_network():
+                    sub_datamap.supernet(prior_submap)
+                    __track_coalesced(sub_datamap)
+                # d) Check to see if the networks are contiguous
+                elif __is_contiguous(prior_submap.broadcast_ip, sub_datamap.network):
+                    prior_submap.range = True
+                    sub_datamap.contiguous_network = True
+                # e) Based on the above criteria, the run ends here
                 else:
-                    # these contiguous subs are a multi-network range
-                    sub_datamap['range'] = True
-                    prior_submap['range'] = True
-                    # check if the next sub is contiguous
-                    if len(subs_list) >= 2:
-                        if __is_contiguous(sub_datamap['sub_int'], subs_list[1][0]):
-                            __track_coalesced(self)
-                        else:
-                            # next sub is not contiguous, no need for recursive call
-                            recursion_bool = False
-            # c) Check if supernetting will put the non-contiguous subs in the same network
-            elif prior_submap['network'] == __calculate_supernet():
-                __supernet()
-                __track_coalesced(self)
-            # d) Check to see if the networks are contiguous
-            elif __is_contiguous(prior_submap['broadcast_ip'], sub_datamap['network']):
-                prior_submap['range'] = True
-                sub_datamap['contiguous_network'] = True
-            # e) Based on the above criteria, there is no need for a recursive call
-            else:
-                recursion_bool = False
-
-        # Criteria has been met that warrants a recursive call...
-        if recursion_bool:
-            # but only if there is a subnet (or more) to be checked
-            if len(subs_list) >= 2:
-                subnets = self.__coalesce_ips(subs_list[1:], (init_idx + 1), sub_datamap)
-        # recursive call not needed; sub not contiguous with prior sub; not a candidate for coalescence
-        elif not sub_datamap['contiguous']:
-            self.__candidates_list.pop()
-
-        # The subnet has been coalesced and can be removed from the candidates list
-        if sub_datamap['coalesced'] is True:
-            del self.__candidates_list[init_idx]
-        # coalesced & non-candidate subnets do not need to be formatted, so return subnet string as-is
-        if sub_datamap not in self.__candidates_list:
-            return subnets
+                    continue_bool = False
+
+            if not continue_bool:
+                # sub not contiguous with prior sub; not a candidate for coalescence (left for the caller)
+                if not sub_datamap.contiguous:
+                    candidates.pop()
+                break
+            # only continue if there is a subnet (or more) to be checked
+            if not has_next:
+                break
+            prior_submap = sub_datamap
+            idx += 1
 
         ## At this point, we have our full list of candidates and coalesced subs, so format the data.
-        # Check to see if 'subnets' string is empty; if it is, we're at the far-right candidate on the list
-        if not subnets:
-            # check to see if this is a contiguous network range
-            if sub_datamap['contiguous_network']:
-                subnets = sub_datamap['broadcast_str']
-                return subnets
+        # Walk the candidates right-to-left (coalesced subs do not need to be formatted); the pieces
+        # are collected in reverse and joined once instead of concatenating to the front of a string.
+        pieces = list()
+        for sub_datamap in reversed(candidates):
+            if sub_datamap.coalesced:
+                continue
+            # check to see if this is the far-right candidate on the list
+            if not pieces:
+                # check to see if this is a contiguous network range
+                if sub_datamap.contiguous_network:
+                    pieces.append(common.int_to_ipv4(sub_datamap.broadcast_ip))
+                else:
+                    pieces.append(common.int_to_ipv4(sub_datamap.sub_int) + common.convert_cidr_to_str(sub_datamap.cidr))
+            # check to see if this is part of a contiguous sub range
+            elif sub_datamap.range:
+                pieces.append(common.int_to_ipv4(sub_datamap.sub_int) + '-')
             else:
-                subnets = sub_datamap['sub_str'] + sub_datamap['cidr_str']
-                return subnets
-        # check to see if this is part of a contiguous sub range
-        elif sub_datamap['range']:
-            # concatenate the current substring to the front of whatever exists & return the full subnets string
-            subnets = sub_datamap['sub_str'] + '-' + subnets
-            return subnets
-        else:
-            # concatenate the current substring to the front of whatever exists & return the full subnets string
-            subnets = sub_datamap['sub_str'] + sub_datamap['cidr_str'] + ';' + subnets
-            return subnets
+                pieces.append(common.int_to_ipv4(sub_datamap.sub_int) + common.convert_cidr_to_str(sub_datamap.cidr) + ';')
+        pieces.reverse()
+        return ''.join(pieces), len(candidates)
 
     # --------------------------------------------
     # Format the parsed data & build the datatable
     def __format_datatable(self) -> list:
         self.datatable = list()
         print("...Formatting parsed data; Coalescing IP's...")
-        # yield 1 row of parsed id data at a time; initialize the entry
-        data_gen = (row for row in self.parsed_data)
-        for row in data_gen:
-            id = row[0]
-            formatted_entry = []
-            # 2 elements per row -> [id, nested subs list]
-            for element in row:
-                if element == id:
+        if self.subnet_cache is not None and self.workers <= 1:
+            self.__prefetch_cached()
+        if self.workers > 1:
+            self.__format_datatable_parallel()
+            return
+        # yield 1 row of parsed id data at a time; add each formatted entry to the data table
+        if self.__progress is not None:
+            self.__format_datatable_progress()
+        else:
+            for formatted_entry in self.rows():
+                self.datatable.append(formatted_entry)
+        self.__print_memo_stats()
+
+    # format the data table, reporting the # of rows formatted every PROGRESS_EVERY rows
+    def __format_datatable_progress(self):
+        self.__progress.start('coalesce', unit='rows', total=len(self.parsed_data))
+        num_rows = 0
+        for num_rows, formatted_entry in enumerate(self.rows(), 1):
+            self.datatable.append(formatted_entry)
+            if not num_rows % PROGRESS_EVERY:
+                self.__progress.update(num_rows)
+        self.__progress.finish(num_rows)
+
+    def __print_memo_stats(self):
+        if self.memo_size:
+            print(f"...Coalescing memo: {self.memo_hits} hits, {self.memo_misses} misses.")
+        if self.subnet_cache is not None:
+            lookups = self.cache_hits + self.cache_misses
+            hit_rate = 100 * self.cache_hits / lookups if lookups else 0
+            print(f"...Persistent cache: {self.cache_hits} hits, {self.cache_misses} misses ({hit_rate:.1f}% hit rate).")
+
+    # Format the parsed data across a pool of worker processes.
+    # Each id line is coalesced independently, so the (sorted) data is split into contiguous batches;
+    # executor.map() returns the batches in order, which keeps the current id-sorted order.
+    def __format_datatable_parallel(self):
+        batches = [self.parsed_data[start:end] for start, end in self.__batch_bounds()]
+        # each worker opens its own connection to the persistent cache (the entries found so far are flushed first)
+        cache_file = None
+        if self.subnet_cache is not None:
+            self.subnet_cache.flush()
+            cache_file = self.subnet_cache.filepath
+        if self.__progress is not None:
+            self.__progress.start('coalesce', unit='rows', total=len(self.parsed_data))
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for formatted_batch, counters in executor.map(_format_batch, batches, repeat(self.memo_size), repeat(cache_file),
+                                                           repeat(self.mode), repeat(self.engine)):
+                self.datatable.extend(formatted_batch)
+                self.__num_coalesced += counters['coalesced']
+                self.__num_invalid_masks += counters['invalid_masks']
+                self.__memo_hits += counters['memo_hits']
+                self.__memo_misses += counters['memo_misses']
+                self.__cache_hits += counters['cache_hits']
+                self.__cache_misses += counters['cache_misses']
+                if self.__progress is not None:
+                    self.__progress.update(len(self.datatable))
+        if self.__progress is not None:
+            self.__progress.finish(len(self.datatable))
+        self.__print_memo_stats()
+
+    # Split the data into batches of roughly equal work (# of subnets, not # of lines), so that a few
+    # huge lines don't stall one worker; a line bigger than a batch becomes a batch of its own.
+    def __batch_bounds(self) -> list:
+        if isinstance(self.parsed_data, CompactData):
+            offsets = self.parsed_data.offsets
+            weights = [offsets[idx + 1] - offsets[idx] + 1 for idx in range(len(self.parsed_data))]
+        else:
+            weights = [len(row[1]) + 1 for row in self.parsed_data]
+        # aim for several batches per worker so the pool stays balanced
+        batch_weight = max(1, sum(weights) // (self.workers * BATCHES_PER_WORKER))
+        bounds = list()
+        start, weight = 0, 0
+        for idx, row_weight in enumerate(weights):
+            weight += row_weight
+            if weight >= batch_weight:
+                bounds.append((start, idx + 1))
+                start, weight = idx + 1, 0
+        if start < len(weights):
+            bounds.append((start, len(weights)))
+        return bounds
+
+    # Generator to format the parsed data one row at a time (nothing is stored)
+    def rows(self):
+        # compact data is consumed directly from its packed buffer (no conversion back to lists)
+        if isinstance(self.parsed_data, CompactData):
+            for id, subs, masks, invalid in self.parsed_data:
+                if not self.memo_size and self.subnet_cache is None:
+                    yield self.__format_compact_row(id, subs, masks, invalid)
                     continue
-                # initialize index tracker, then iterate the sub/mask pairs and validate
-                next_idx = 0
-                for idx, pair in enumerate(element):
-                    if idx < next_idx:
-                        continue
-                    self.__num_coalesced = 0
-                    subnet, mask = pair[0], pair[1]
-                    valid_sub = self.__is_valid_sub(subnet)
-                    valid_mask, cidr = common.is_valid_mask_and_cidr(mask)
-                    # Now determine how to format the entry based on conditions.
-                    # a) Invalid: subnet IPv4 format
-                    if not valid_sub:
-                        # check if entry is empty
-                        if not formatted_entry:
-                            formatted_entry.append(id)
-                            # no ipv4 conversion needed b/c invalid subs were left in 'str' format
-                            formatted_entry.append(subnet + '/' + mask)
-                        else:
-                            formatted_entry.extend(';' + subnet + '/' + mask)
-                    # b) Invalid: mask value
-                    if not valid_mask:
-                        subnet = common.int_to_ipv4(subnet)
-                        mask = common.int_to_ipv4(mask)
-                        # check if entry is empty
-                        if not formatted_entry:
-                            formatted_entry.append(id)
-                            formatted_entry.append(subnet + '/' + mask)
-                        else:
-                            formatted_entry[1] += ';' + subnet + '/' + mask
-                    # c) Valid: subnet string value is '0.0.0.0'
-                    elif subnet == 0:
-                        # 'Any'
-                        if mask == 0:
-                            formatted_entry.append(id)
-                            formatted_entry.append('Any')
-                        else:
-                            subnet = common.int_to_ipv4(subnet)
-                            formatted_entry.append(id)
-                            formatted_entry.append(subnet)
-                    # d) Valid: last pair in sub/mask list for this id
-                    elif len(element[idx:]) == 1:
-                        subnet = common.int_to_ipv4(subnet)
-                        cidr = common.convert_cidr_to_str(cidr)
-                        # check if entry is empty
-                        if not formatted_entry:
-                            formatted_entry.append(id)
-                            formatted_entry.append(subnet + cidr)
-                        else:
-                            formatted_entry[1] += ';' + subnet + cidr
-                    # e) Valid: potential candidate for coalescence
-                    else:
-                        subnets = self.__coalesce_ips(element[idx:])
-                        # set the next index to be checked; clear the candidates list
-                        next_idx = idx + len(self.__candidates_list) + self.__num_coalesced
-                        self.__candidates_list.clear()
-                        # check if entry is empty
-                        if not formatted_entry:
-                            formatted_entry.append(id)
-                            formatted_entry.append(subnets)
-                        else:
-                            formatted_entry[1] += ';' + subnets
-            # add the formatted entry to the data table
-            self.datatable.append(formatted_entry)
\ No newline at end of file
+                memo_key = (subs.tobytes(), masks.tobytes(), tuple(invalid))
+                yield self.__memoize(id, memo_key, self.__format_compact_row, subs, masks, invalid)
+            return
+        for row in self.parsed_data:
+            yield self.format_row(row)
+
+    # Look up the formatted entry for a subnet list in the memo; format & store it on a miss.
+    # The memo holds entries formatted with a placeholder id, which is swapped for the row's id,
+    # along with the row's counter values so that memoized rows are still counted.
+    # Memo misses are looked up in the persistent cache (if any) before formatting.
+    def __memoize(self, id, memo_key, format_func, *args) -> list:
+        memo_value = self.__memo.get(memo_key)
+        if memo_value is not None:
+            self.__memo_hits += 1
+            self.__memo.move_to_end(memo_key)
+        else:
+            self.__memo_misses += 1
+            cache_key, memo_value = self.__load_cached(memo_key, format_func)
+        if memo_value is not None:
+            memo_entry, num_coalesced, num_invalid_masks = memo_value
+            self.__num_coalesced += num_coalesced
+            self.__num_invalid_masks += num_invalid_masks
+        else:
+            num_coalesced, num_invalid_masks = self.__num_coalesced, self.__num_invalid_masks
+            memo_entry = format_func(_MEMO_ID, *args)
+            memo_value = (memo_entry, self.__num_coalesced - num_coalesced,
+                          self.__num_invalid_masks - num_invalid_masks)
+            self.__store_cached(cache_key, memo_value)
+        if self.memo_size and memo_key not in self.__memo:
+            self.__memo[memo_key] = memo_value
+            if len(self.__memo) > self.memo_size:
+                self.__memo.popitem(last=False)
+        return [id if element is _MEMO_ID else element for element in memo_entry]
+
+    # Load the persistent cache entries of every distinct subnet list in one go (batched queries)
+    def __prefetch_cached(self):
+        if isinstance(self.parsed_data, CompactData):
+            memo_keys = ((subs.tobytes(), masks.tobytes(), tuple(invalid)) for _, subs, masks, invalid in self.parsed_data)
+            kind = self.__cache_kind(self.__format_compact_row)
+        else:
+            memo_keys = (tuple(tuple(pair) for pair in row[1]) for row in self.parsed_data)
+            kind = self.__cache_kind(self.__format_pairs)
+        self.subnet_cache.prefetch({cache.make_key(kind, memo_key) for memo_key in set(memo_keys)})
+
+    # the kind of a cache entry: the format function & the mode it was rendered with
+    # (entries of other engines are kept apart, so a faulty engine can't leak into reference runs)
+    def __cache_kind(self, format_func) -> str:
+        kind = self.mode + ':' + format_func.__name__
+        if self.engine != engines.REFERENCE:
+            kind += ':' + self.engine
+        return kind
+
+    # Look up a memo value in the persistent cache (stored as JSON; the placeholder id is stored as null)
+    #   returns tuple: (cache key & memo value: (memo entry, # coalesced, # invalid masks), or None if it isn't cached)
+    def __load_cached(self, memo_key, format_func):
+        if self.subnet_cache is None:
+            return (None, None)
+        cache_key = cache.make_key(self.__cache_kind(format_func), memo_key)
+        cached = self.subnet_cache.get(cache_key)
+        if cached is None:
+            self.__cache_misses += 1
+            return (cache_key, None)
+        self.__cache_hits += 1
+        memo_entry, num_coalesced, num_invalid_masks = json.loads(cached)
+        memo_entry = [_MEMO_ID if element is None else element for element in memo_entry]
+        return (cache_key, (memo_entry, num_coalesced, num_invalid_masks))
+
+    def __store_cached(self, cache_key, memo_value):
+        if self.subnet_cache is None:
+            return
+        memo_entry, num_coalesced, num_invalid_masks = memo_value
+        memo_entry = [None if element is _MEMO_ID else element for element in memo_entry]
+        self.subnet_cache.put(cache_key, json.dumps([memo_entry, num_coalesced, num_invalid_masks]))
+
+    # Format a single parsed row ([id, sorted sub/mask pairs], as parsed by dataparser.parse_line())
+    # -> [id, formatted subnets]. Rows can also be formatted one at a time this way, outside of rows().
+    def format_row(self, row) -> list:
+        # 2 elements per row -> [id, nested subs list]
+        id, element = row[0], row[1]
+        if not self.memo_size and self.subnet_cache is None:
+            return self.__format_pairs(id, element)
+        memo_key = tuple(tuple(pair) for pair in element)
+        return self.__memoize(id, memo_key, self.__format_pairs, element)
+
+    def __format_pairs(self, id, element) -> list:
+        subs = [pair[0] for pair in element]
+        masks = [pair[1] for pair in element]
+        return self.__format_subnets(id, subs, masks)
+
+    # Format a single compact row; invalid tokens (side table, already formatted by the parser) are listed first
+    def __format_compact_row(self, id, subs, masks, invalid) -> list:
+        formatted_entry = self.__format_subnets(id, subs, masks)
+        if invalid:
+            invalid_str = ';'.join(invalid)
+            if not formatted_entry:
+                formatted_entry = [id, invalid_str]
+            else:
+                formatted_entry[1] = invalid_str + ';' + formatted_entry[1]
+        return formatted_entry
+
+    # Format the (sorted) subnets & masks of a single id -> [id, formatted subnets]
+    def __format_subnets(self, id, subs, masks) -> list:
+        if self.mode == MODE_AGGREGATE:
+            formatted_entry, num_coalesced, num_invalid_masks = aggregate.format_subnets(id, subs, masks)
+            self.__num_coalesced += num_coalesced
+            self.__num_invalid_masks += num_invalid_masks
+            return formatted_entry
+        # the selected engine formats the lines it can (see engines.py); the rest are left to the reference below
+        if self.__engine_func is not None:
+            engine_result = self.__engine_func(id, subs, masks)
+            if engine_result is not None:
+                formatted_entry, num_coalesced, num_invalid_masks = engine_result
+                self.__num_coalesced += num_coalesced
+                self.__num_invalid_masks += num_invalid_masks
+                return formatted_entry
+        formatted_entry = []
+
+        def __add_subnets(subnets: str):
+            # check if entry is empty
+            if not formatted_entry:
+                formatted_entry.append(id)
+                formatted_entry.append(subnets)
+            else:
+                formatted_entry[1] += ';' + subnets
+
+        last_idx = len(subs) - 1
+        # a run of coalescence candidates ends before the next invalid pair (found when the first run starts)
+        run_end = None
+        # initialize index tracker, then iterate the sub/mask pairs and validate
+        next_idx = 0
+        for idx in range(len(subs)):
+            if idx < next_idx:
+                continue
+            subnet, mask = subs[idx], masks[idx]
+            valid_sub = self.__is_valid_sub(subnet)
+            # (a mask that isn't IPv4 format was left as 'str' by the parser)
+            valid_mask, cidr = common.is_valid_mask_and_cidr(mask) if isinstance(mask, int) else (False, 'N/A')
+            # Now determine how to format the entry based on conditions.
+            # a) Invalid: subnet IPv4 format
+            if not valid_sub:
+                # no ipv4 conversion needed b/c invalid subs were left in 'str' format
+                __add_subnets(subnet + '/' + common.format_ipv4(mask))
+            # b) Invalid: mask value
+            elif not valid_mask:
+                if isinstance(mask, int):
+                    self.__num_invalid_masks += 1
+                __add_subnets(common.int_to_ipv4(subnet) + '/' + common.format_ipv4(mask))
+            # c) Valid: subnet string value is '0.0.0.0'
+            elif subnet == 0:
+                # 'Any'
+                if mask == 0:
+                    __add_subnets('Any')
+                else:
+                    __add_subnets(common.int_to_ipv4(subnet))
+            # d) Valid: last pair in sub/mask list for this id
+            elif idx == last_idx:
+                __add_subnets(common.int_to_ipv4(subnet) + common.convert_cidr_to_str(cidr))
+            # e) Valid: potential candidate for coalescence
+            else:
+                if run_end is None or run_end <= idx:
+                    run_end = _next_invalid_idx(subs, masks, idx + 1)
+                subnets, num_consumed = self.__coalesce_ips(subs, masks, idx, run_end)
+                # set the next index to be checked
+                next_idx = idx + num_consumed
+                __add_subnets(subnets)
+        return formatted_entry
+
+
+# ---------------------------------------------
+# function to find the next pair (from 'start_idx') with an invalid sub or mask (the end of the list if there is none)
+def _next_invalid_idx(subs, masks, start_idx: int) -> int:
+    for idx in range(start_idx, len(subs)):
+        if not isinstance(subs[idx], int) or masks[idx] not in common.MASK_TO_CIDR:
+            return idx
+    return len(subs)
+
+
+# ---------------------------------------------
+# number of batches per worker process when coalescing in parallel
+BATCHES_PER_WORKER = 8
+
+# Worker process function: format one batch of parsed rows (the rows are picklable lists or CompactData)
+#   returns tuple: (formatted rows, run counters)
+def _format_batch(batch, memo_size=0, cache_file=None, mode=MODE_COALESCE, engine=engines.REFERENCE):
+    subnet_cache = cache.SubnetCache(cache_file, COALESCE_VERSION) if cache_file is not None else None
+    data_coalescer = Coalescer(batch, stream=True, memo_size=memo_size, subnet_cache=subnet_cache, mode=mode, engine=engine)
+    formatted_batch = list(data_coalescer.rows())
+    if subnet_cache is not None:
+        # (eviction is left to the parent process)
+        subnet_cache.close(evict=False)
+    return (formatted_batch, data_coalescer.counters)
+
+
+# ---------------------------------------------
+## Compact record of a single subnet's data values used while coalescing (slots instead of a dict)
+class _Subnet:
+    __slots__ = ('sub_int', 'mask_int', 'cidr', 'network', 'broadcast_ip',
+                 'contiguous', 'range', 'coalesced', 'contiguous_network')
+
+    def __init__(self, sub_int: int, mask_int: int):
+        valid_mask, cidr = common.is_valid_mask_and_cidr(mask_int)
+        self.sub_int = sub_int
+        self.mask_int = mask_int
+        self.cidr = cidr
+        # bitwise AND of subnet & mask will return the network address (as an integer)
+        self.network = sub_int & mask_int
+        # the broadcast ip is set from the original network size (it is not updated by supernetting)
+        self.broadcast_ip = self.network + (2 ** (32 - cidr)) - 1
+        self.contiguous = False
+        self.range = False
+        self.coalesced = False
+        self.contiguous_network = False
+
+    # use "2 to the N" to calculate supernet mask, where 'N' is the diff of (32 - cidr #)
+    def supernet_mask(self) -> int:
+        return self.mask_int - (2 ** (32 - self.cidr))
+
+    def supernet_network(self) -> int:
+        return self.sub_int & self.supernet_mask()
+
+    # update subnet values with supernet vals, and update the prior sub to reflect them as well
+    def supernet(self, prior):
+        self.network = self.supernet_network()
+        self.mask_int = self.supernet_mask()
+        self.cidr -= 1
+        prior.mask_int = self.mask_int
+        prior.cidr = self.cidr
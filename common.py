@@ -1,4 +1,36 @@
+import gc
+import io
 import os
+import stat
+import bz2
+import gzip
+import lzma
+from functools import lru_cache, partial
+from contextlib import contextmanager
+
+
+# input/output filepath arg that means stdin/stdout (for shell pipelines)
+STDIO_PATH = '-'
+
+# default buffer size (bytes) for reading input files & writing output files
+IO_BUFFER_SIZE = 1024 * 1024
+
+# gzip compression level of compressed output (the gzip command's default; 9 is much slower for little gain)
+GZIP_LEVEL = 6
+
+# output file extension -> opener of its compressed (binary) stream
+COMPRESSED_EXTS = {
+    '.gz': partial(gzip.open, compresslevel=GZIP_LEVEL),
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+# leading 'magic' bytes of a compressed input file -> opener of its decompressed (binary) stream
+COMPRESSED_MAGIC = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+)
 
 
 # ---------------------------------------------
@@ -36,6 +68,26 @@ class ConstructionError(RuntimeError):
             raise ConstructionError(self)
 
 
+# ---------------------------------------------
+#####################
+##  Lookup Tables  ##
+#####################
+
+# max # of entries in each of the LRU caches for dotted-quad <-> int conversions
+IPV4_CACHE_SIZE = 4096
+
+# octet int (0-255) -> octet string; canonical octet string (no leading zeros) -> octet int
+OCTET_STR = tuple(str(octet) for octet in range(256))
+STR_OCTET = {octet_str: octet for octet, octet_str in enumerate(OCTET_STR)}
+
+# cidr # (0-32) -> mask int; mask int -> cidr # (the only 33 valid masks)
+CIDR_TO_MASK = tuple((0xFFFFFFFF << (32 - cidr)) & 0xFFFFFFFF for cidr in range(33))
+MASK_TO_CIDR = {mask: cidr for cidr, mask in enumerate(CIDR_TO_MASK)}
+
+# cidr # (0-31) -> cidr string ('/0' ... '/31'; a /32 has no cidr string)
+CIDR_STR = tuple('/' + str(cidr) for cidr in range(32))
+
+
 # ---------------------------------------------
 ########################
 ##  Common Functions  ##
@@ -56,6 +108,77 @@ def make_dir_if_needed(dir_path):
     if not os.path.isdir(dir_path):
         print(f"...File '{dir_path}' exists but is not a directory.")
 
+# # of leading bytes checked for a compressed format's magic bytes
+MAGIC_SIZE = max(len(magic) for magic, _ in COMPRESSED_MAGIC)
+
+# function to get the opener of a compressed stream from its leading bytes (None for a plain stream)
+def _compression_opener(head: bytes):
+    for magic, opener in COMPRESSED_MAGIC:
+        if head.startswith(magic):
+            return opener
+    return None
+
+# function to detect a compressed input file by its leading bytes (whatever its extension)
+#   returns the opener of its decompressed stream, or None for a plain file
+def detect_compression(filepath: str):
+    with open(filepath, 'rb') as f:
+        return _compression_opener(f.read(MAGIC_SIZE))
+
+# function to check if an input file is a regular, uncompressed file (i.e. it can be memory-mapped or split
+# into byte ranges). A pipe or FIFO is never sniffed, since reading its leading bytes would consume them.
+def is_plain_file(filepath: str) -> bool:
+    if filepath == STDIO_PATH:
+        return False
+    try:
+        if not stat.S_ISREG(os.stat(filepath).st_mode):
+            return False
+    except OSError:
+        return False
+    return detect_compression(filepath) is None
+
+## Text stream over a decompressed input: a decompressor given a file object leaves it open, so the file
+## is closed along with the text stream
+class _DecompressedText(io.TextIOWrapper):
+
+    def __init__(self, decompressed, raw, buffer_size):
+        super().__init__(io.BufferedReader(decompressed, buffer_size), newline='')
+        self.__raw = raw
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.__raw.close()
+
+# function to open an input file as text (compressed files are decompressed on the fly, never to disk).
+# The file is opened once & its leading bytes are peeked at, so a pipe or FIFO (e.g. '<(zcat f.gz)') is
+# only read once.
+def open_input(filepath: str, buffer_size=IO_BUFFER_SIZE):
+    raw = open(filepath, 'rb', buffering=buffer_size)
+    opener = _compression_opener(raw.peek(MAGIC_SIZE))
+    if opener is None:
+        return io.TextIOWrapper(raw, newline='')
+    return _DecompressedText(opener(raw, 'rb'), raw, buffer_size)
+
+# function to open an output file as text, compressed if its extension is '.gz', '.bz2' or '.xz'
+def open_output(filepath: str, buffer_size=IO_BUFFER_SIZE):
+    opener = COMPRESSED_EXTS.get(os.path.splitext(filepath)[1])
+    if opener is None:
+        return open(filepath, 'w', newline='', buffering=buffer_size)
+    return io.TextIOWrapper(io.BufferedWriter(opener(filepath, 'wb'), buffer_size), newline='')
+
+# context manager to pause the cyclic garbage collector while building large tables of
+# short-lived lists (every new list triggers a gen0 pass that rescans the whole growing table)
+@contextmanager
+def gc_paused():
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
 # function to set a specific bit to '1'
 def set_bit(num: int, pos: int) -> int:
     # check arg types
@@ -73,11 +196,8 @@ def get_bit_len(num: int, bit_length=0) -> int:
     if not num >= 0:
         raise ValueError("get_bit_len() arg(1) must be a non-negative integer>")
     # https://wiki.python.org/moin/BitManipulation
-    # right-shift one bit at a time, incrementing bit_length each time until num = 0
-    while(num):
-        num >>= 1
-        bit_length += 1
-    return bit_length
+    # same result as right-shifting one bit at a time until num = 0, without the Python loop
+    return num.bit_length() + bit_length
     
 # https://wiki.python.org/moin/BitManipulation#lowestSet.28.29
 # function to get the position of the lowest-set-bit (aka: the right-most 1 )
@@ -120,6 +240,16 @@ def is_valid_ipv4(ipv4) -> bool:
 def is_valid_mask_and_cidr(mask: int):
     # check arg type
     check_arg_type(mask, int, "is_valid_mask_and_cidr() arg must be of type 'int'")
+    # only 33 contiguous masks exist, so a table lookup answers every valid mask
+    cidr = MASK_TO_CIDR.get(mask)
+    if cidr is not None:
+        return (True, cidr)
+    return (False, 'N/A')
+
+# function to validate mask value and check cidr # by inspecting its bits (used to build the lookup tables)
+#   returns tuple: (True & cidr int) or (False & 'N/A')
+def calc_mask_and_cidr(mask: int):
+    check_arg_type(mask, int, "calc_mask_and_cidr() arg must be of type 'int'")
     cidr = 0    
     if mask == 0:
         # 0 bit mask is valid
@@ -150,6 +280,11 @@ def is_valid_mask_and_cidr(mask: int):
 def ipv4_to_int(ipv4: str) -> int:
     # check arg type
     check_arg_type(ipv4, str, "ipv4_to_int() arg must be of type 'str'")
+    return _ipv4_to_int_cached(ipv4)
+
+# bounded LRU cache of recent IPv4 string -> int conversions (the same addresses & masks repeat a lot)
+@lru_cache(maxsize=IPV4_CACHE_SIZE)
+def _ipv4_to_int_cached(ipv4: str) -> int:
     octets = ipv4.split('.')
     # invalid ipv4 fmt --> return the arg unchanged (as original ipv4 string)
     if not is_valid_ipv4(octets):
@@ -163,30 +298,40 @@ def ipv4_to_int(ipv4: str) -> int:
 def int_to_ipv4(num: int) -> str:
     # check arg
     check_arg_type(num, int, "int_to_ipv4() arg must be of type 'int'")
-    num_binstr = bin(num)
-    num_binstr = num_binstr[2:]
     # IPv4 format must be non-negative and between 0 -> 32 bits
-    if not (num >= 0) or not (len(num_binstr) <= 32):
+    if not (0 <= num <= 0xFFFFFFFF):
         raise ValueError(f"{num} is invalid for IPv4 conversion. Must be non-negative and 32bits or less.")
-    # make four 8bit-chunks, bitmasked then shifted right enough to isolate them, stringify each, then join with '.'
-    a = str((num & 0xFF000000) >> 24) # left-most chunk (bit pos 24-31)
-    b = str((num & 0xFF0000) >> 16) # inner-left chunk (bit pos 16-23)
-    c = str((num & 0xFF00) >> 8) # inner-right chunk (bit pos 8-15)
-    d = str(num & 0xFF) # right-most chunk (bit pos 0-7)
-    ipv4 = '.'.join([a,b,c,d])
-    # assertion for sanity check because an error here means bad code (not user error)
-    assert is_valid_ipv4(ipv4)
-    return ipv4
+    return _int_to_ipv4_cached(num)
+
+# bounded LRU cache of recent int -> IPv4 string conversions
+@lru_cache(maxsize=IPV4_CACHE_SIZE)
+def _int_to_ipv4_cached(num: int) -> str:
+    # make four 8bit-chunks, bitmasked then shifted right enough to isolate them, look up each octet's string, then join with '.'
+    return '.'.join((OCTET_STR[(num & 0xFF000000) >> 24], # left-most chunk (bit pos 24-31)
+                     OCTET_STR[(num & 0xFF0000) >> 16], # inner-left chunk (bit pos 16-23)
+                     OCTET_STR[(num & 0xFF00) >> 8], # inner-right chunk (bit pos 8-15)
+                     OCTET_STR[num & 0xFF])) # right-most chunk (bit pos 0-7)
+
+# function to render an address or mask the way it was given (invalid values were left as 'str' by the parser)
+def format_ipv4(value) -> str:
+    if isinstance(value, str):
+        return value
+    return int_to_ipv4(value)
 
 # function to convert cidr# to a str
 def convert_cidr_to_str(cidr: int) -> str:
     # check arg
     check_arg_type(cidr, int, "convert_cidr_to_str() arg must be of type 'int'")
+    if 0 <= cidr < 32:
+        return CIDR_STR[cidr]
     if cidr == 32:
         cidr = ''
     else:
         cidr = '/' + str(cidr)
     return cidr
 
+# sanity check that the precomputed mask table agrees with the bitwise mask validation
+assert all(calc_mask_and_cidr(mask) == (True, cidr) for mask, cidr in MASK_TO_CIDR.items())
 
-# ---------------------------------------------
\ No newline at end of file
+
+# ---------------------------------------------
@@ -0,0 +1,113 @@
+import time
+# local modules
+import coalescence
+import engines
+from common import ConstructionError as ctor
+
+
+###################
+##  Cross-Check  ##
+###################
+
+# max # of mismatching rows printed (all of them are counted)
+MAX_REPORTED_MISMATCHES = 5
+
+# ---------------------------------------------
+## Class for checking an engine against the reference Coalescer on a sample of the parsed lines.
+## Every Nth line (N = 1 / fraction) is formatted by both engines, without memoization or caching so
+## that both really compute every row; the rows are compared and each engine's time is recorded.
+class CrossCheck:
+
+    def __init__(self, engine: str, fraction: float, mode=coalescence.MODE_COALESCE):
+        if engine not in engines.ENGINES:
+            raise ctor(f"Failed to construct CrossCheck obj (engine must be one of {tuple(engines.ENGINES)})")
+        if not 0 < fraction <= 1:
+            raise ctor("Failed to construct CrossCheck obj (fraction must be > 0 and <= 1)")
+        self.__engine = engine
+        self.__fraction = fraction
+        self.__step = max(1, round(1 / fraction))
+        self.__mode = mode
+        # rows sampled by add_rows()
+        self.__sampled_rows = list()
+        # results
+        self.__num_rows = 0
+        self.__mismatches = list()
+        self.__engine_seconds = 0.0
+        self.__reference_seconds = 0.0
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def fraction(self):
+        return self.__fraction
+
+    @property
+    def step(self):
+        return self.__step
+
+    @property
+    def sampled_rows(self):
+        return self.__sampled_rows
+
+    @property
+    def num_rows(self):
+        return self.__num_rows
+
+    # mismatching rows: (engine row, reference row) tuples
+    @property
+    def mismatches(self):
+        return self.__mismatches
+
+    @property
+    def engine_seconds(self):
+        return self.__engine_seconds
+
+    @property
+    def reference_seconds(self):
+        return self.__reference_seconds
+
+    # get the sample of a parsed datatable (list or CompactData): every Nth row
+    def sample(self, parsed_data):
+        return parsed_data[::self.step]
+
+    # Generator to sample parsed rows as they pass through (e.g. on their way to the Coalescer in streaming mode)
+    def add_rows(self, rows):
+        for idx, row in enumerate(rows):
+            if idx % self.step == 0:
+                self.__sampled_rows.append(row)
+            yield row
+
+    # format the sampled rows with both engines & compare them (the results add up over several calls)
+    def check(self, sample):
+        engine_rows, engine_seconds = _timed_rows(sample, self.engine, self.__mode)
+        reference_rows, reference_seconds = _timed_rows(sample, engines.REFERENCE, self.__mode)
+        self.__num_rows += len(reference_rows)
+        self.__engine_seconds += engine_seconds
+        self.__reference_seconds += reference_seconds
+        for engine_row, reference_row in zip(engine_rows, reference_rows):
+            if engine_row != reference_row:
+                self.__mismatches.append((engine_row, reference_row))
+        self.print_report()
+
+    def print_report(self):
+        for engine_row, reference_row in self.mismatches[:MAX_REPORTED_MISMATCHES]:
+            print(f"...Cross-check mismatch: {self.engine} {engine_row} != {engines.REFERENCE} {reference_row}")
+        speedup = self.reference_seconds / self.engine_seconds if self.engine_seconds else 0
+        print(f"...Cross-check of '{self.engine}' on {self.num_rows} lines (1 in {self.step}): "
+              f"{len(self.mismatches)} mismatches; {self.engine} {self.engine_seconds:.3f}s, "
+              f"{engines.REFERENCE} {self.reference_seconds:.3f}s ({speedup:.2f}x)")
+
+
+# ---------------------------------------------
+# function to format rows with an engine (no memo or cache)
+#   returns tuple: (formatted rows, seconds)
+def _timed_rows(sample, engine: str, mode: str):
+    start = time.perf_counter()
+    data_coalescer = coalescence.Coalescer(sample, stream=True, memo_size=0, mode=mode, engine=engine)
+    formatted_rows = list(data_coalescer.rows())
+    return (formatted_rows, time.perf_counter() - start)
+
+
+# ---------------------------------------------
@@ -1,4 +1,16 @@
+import os
+import sys
+import mmap
+import stat
+import locale
+import operator
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, compress, count, islice, repeat
+from functools import lru_cache
 import common
+import vectorized
+from progress import PROGRESS_EVERY
 from common import ConstructionError as ctor
 
 
@@ -6,58 +18,656 @@ from common import ConstructionError as ctor
 ##  Data Parser  ##
 ###################
 
+# max # of entries in the 'addr/mask' bytes token cache
+TOKEN_CACHE_SIZE = 65536
+
+# octet bytes (b'0' ... b'255') -> int
+OCTET_INT = {str(octet).encode(): octet for octet in range(256)}
+
+# encoding used to decode the raw bytes (the same default as open() in text mode)
+INPUT_ENCODING = locale.getpreferredencoding(False)
+
+# smallest byte range worth parsing in its own worker process (smaller files are split into fewer shards)
+MIN_SHARD_SIZE = 1024 * 1024
+
+# ascii chars that str.isspace() treats as whitespace but bytes.isspace() does not
+ASCII_STR_WHITESPACE = b'\x1c\x1d\x1e\x1f'
+
+
 # ---------------------------------------------
 ## Class for reading the input file, parsing each line, and storing the parsed data
 class Parser:
 
-    def __init__(self, filepath: str):        
+    def __init__(self, filepath: str, stream=False, compact=False, vectorized=False, use_mmap=False,
+                 buffer_size=common.IO_BUFFER_SIZE, workers=1, quarantine=None, progress=None):
         # check ctor arg type
         ctor.check_arg_type("Failed to initialize Parser obj (arg must be type 'str')", filepath, str)
-        # verify the file exists
-        common.check_path_exists(filepath)
+        # verify the file exists ('-' reads stdin)
+        if filepath != common.STDIO_PATH:
+            common.check_path_exists(filepath)
         self.__file = filepath
+        self.__stream = stream
+        self.__compact = compact
+        self.__vectorized = vectorized
+        self.__use_mmap = use_mmap
+        self.__buffer_size = buffer_size
+        self.__workers = workers
+        # malformed lines are set aside in the quarantine (quarantine.Quarantine), if any, instead of raising
+        self.__quarantine = quarantine
+        # the lines read are reported to the progress reporter (progress.Progress), if any
+        self.__progress = progress
         self.__parsed_data = None
-        self.__parse_input_file()
+        # run counters (subnets = sub/mask tokens; invalid = not IPv4 format)
+        self.__num_lines = 0
+        self.__num_subnets = 0
+        self.__num_invalid_subnets = 0
+        # # of input lines consumed by rows() so far (parsed or quarantined)
+        self.__lines_read = 0
+        # in streaming mode the data is parsed lazily via rows(), so nothing is stored here
+        if not self.stream:
+            self.__parse_input_file()
 
     @property
     def file(self):
         return self.__file
 
+    @property
+    def stream(self):
+        return self.__stream
+
+    @property
+    def compact(self):
+        return self.__compact
+
+    @property
+    def vectorized(self):
+        return self.__vectorized
+
+    @property
+    def use_mmap(self):
+        return self.__use_mmap
+
+    @property
+    def buffer_size(self):
+        return self.__buffer_size
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    @property
+    def quarantine(self):
+        return self.__quarantine
+
+    @property
+    def progress(self):
+        return self.__progress
+
+    @property
+    def num_lines(self):
+        return self.__num_lines
+
+    @property
+    def lines_read(self):
+        return self.__lines_read
+
+    @property
+    def num_subnets(self):
+        return self.__num_subnets
+
+    @property
+    def num_invalid_subnets(self):
+        return self.__num_invalid_subnets
+
+    # set a line that failed to parse aside (or re-raise its error if there is no quarantine)
+    def __quarantine_line(self, line_number: int, line, err: Exception):
+        if self.quarantine is None:
+            raise err
+        if isinstance(line, bytes):
+            line = line.decode(INPUT_ENCODING, errors='replace')
+        self.quarantine.add(line_number, line, err)
+
+    # update the run counters for a parsed line
+    def __count_line(self, num_subnets: int, num_invalid_subnets: int):
+        self.__num_lines += 1
+        self.__num_subnets += num_subnets
+        self.__num_invalid_subnets += num_invalid_subnets
+
     @property
     def parsed_data(self):
         return self.__parsed_data
     @parsed_data.setter
     def parsed_data(self, content):
-        common.check_arg_type(content, list, "parsed_data.setter -> must be of type 'list'")
+        common.check_arg_type(content, (list, CompactData), "parsed_data.setter -> must be of type 'list' or 'CompactData'")
         self.__parsed_data = content
 
     # Generator to read the input file line by line
     def __file_reader(self, file: str):
-        with open(file, newline='') as f:
+        if file == common.STDIO_PATH:
+            print(f"...Parsing data from stdin...")
+            if self.progress is not None:
+                # (a line at a time: a pipe's lines are passed on as soon as they arrive)
+                yield from self.__progress_lines(map(str.rstrip, sys.stdin), block_size=1)
+                return
+            for row in sys.stdin:
+                yield row.rstrip()
+            return
+        # (gzip/bz2/xz files are decompressed as they are read)
+        with common.open_input(file, self.buffer_size) as f:
             print(f"...Opening input file and parsing data...")
-            for row in f.readlines():
+            if self.progress is not None:
+                # (the file descriptor's position counts the bytes read from disk: for a compressed file, the
+                # compressed bytes, which is what the file's size counts too; a FIFO has no position or size)
+                fd = f.fileno()
+                if not stat.S_ISREG(os.fstat(fd).st_mode):
+                    yield from self.__progress_lines(map(str.rstrip, f))
+                    return
+                yield from self.__progress_lines(map(str.rstrip, f), lambda: os.lseek(fd, 0, os.SEEK_CUR),
+                                                 os.fstat(fd).st_size)
+                return
+            for row in f:
                 yield row.rstrip()
 
+    # Generator to memory-map the input file and yield its raw lines as 'bytes' (without line breaks)
+    def __mmap_reader(self, file: str):
+        with open(file, 'rb') as f:
+            print(f"...Memory-mapping input file and parsing data...")
+            # an empty file can't be memory-mapped (and has no lines)
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if self.progress is not None:
+                    yield from self.__progress_lines(mmap_lines(mm), mm.tell, len(mm))
+                    return
+                yield from mmap_lines(mm)
+
+    # Generator to pass the lines read through, reporting the # of lines & bytes read every 'block_size' lines.
+    # The lines are taken a block at a time, so nothing is counted or checked per line.
+    #   position: function returning the # of bytes read so far (None if unknown, e.g. on stdin)
+    def __progress_lines(self, lines, position=None, total_bytes=None, block_size=PROGRESS_EVERY):
+        self.progress.start('parse', total_bytes=total_bytes)
+        num_lines = 0
+        while True:
+            block = list(islice(lines, block_size))
+            yield from block
+            num_lines += len(block)
+            if len(block) < block_size:
+                break
+            self.progress.update(num_lines, position() if position is not None else None)
+        self.progress.finish(num_lines, position() if position is not None else None)
+
+    # Generator to parse the input file one line at a time (input order, nothing is stored)
+    #   start_line: # of lines to skip unparsed (e.g. those already consumed before a checkpoint)
+    def rows(self, start_line=0):
+        # (stdin, a FIFO and a compressed file are read as streams; none of them can be memory-mapped)
+        if self.use_mmap and common.is_plain_file(self.file):
+            reader, parse = self.__mmap_reader, parse_bytes_line
+        else:
+            reader, parse = self.__file_reader, _parse_line
+        self.__lines_read = start_line
+        for line_number, line in enumerate(islice(reader(self.file), start_line, None), start_line + 1):
+            self.__lines_read = line_number
+            try:
+                row, num_invalid = parse(line)
+            except (IndexError, ValueError) as err:
+                self.__quarantine_line(line_number, line, err)
+                continue
+            self.__count_line(len(row[1]), num_invalid)
+            yield row
+
     # Parser method
     def __parse_input_file(self):
+        # (a regular, uncompressed input file can be split into byte ranges & parsed in parallel)
+        if self.workers > 1 and not self.vectorized and common.is_plain_file(self.file):
+            self.__parse_input_file_sharded()
+            return
+        if self.compact:
+            self.__parse_input_file_compact()
+            return
+        if self.vectorized:
+            if vectorized.is_available():
+                self.__parse_input_file_vectorized()
+                return
+            print("...NumPy is not installed; using the scalar parser.")
         # read in one line at a time from the input file for parsing
+        # (nothing here can form a reference cycle, so the cyclic GC is paused while the table grows)
         self.parsed_data = list()        
-        for line in self.__file_reader(self.file):
+        with common.gc_paused():
+            for row in self.rows():
+                self.__parsed_data.append(row)
+        # finally, sort the completed parsed data table by id #
+        self.parsed_data = sort_rows(self.__parsed_data)
+        print("...Data successfully parsed.")
+
+    # Parser method for the vectorized (NumPy) engine: split every line first, then convert the
+    # whole column of addresses & masks to integers in bulk
+    def __parse_input_file_vectorized(self):
+        ids, counts, addrs, masks = list(), list(), list(), list()
+        for line_number, line in enumerate(self.__file_reader(self.file), 1):
             # split the i.d. from its subnets/masks
-            line_split = line.split(':')
-            id, subnets = line_split[0], line_split[1].split(',')
-            parsed_subnets = list()
-            # split sub address & mask, convert valid ipv4 to 'int', store sub & mask as a pair
-            for subnet in subnets:
-                if '/' not in subnet:
-                    continue
-                addr, mask = subnet.split('/')
-                addr = common.ipv4_to_int(addr)
-                mask = common.ipv4_to_int(mask)
-                parsed_subnets.append([addr, mask])  
-            # sort sub/mask pairs for the current id line; append the parsed line to the datatable
-            parsed_subnets.sort()
+            try:
+                line_split = line.split(':')
+                id, subnets = line_split[0], line_split[1].split(',')
+                pairs = [subnet.split('/') for subnet in subnets if '/' in subnet]
+                line_addrs, line_masks = [addr for addr, _ in pairs], [mask for _, mask in pairs]
+            except (IndexError, ValueError) as err:
+                self.__quarantine_line(line_number, line, err)
+                continue
+            num_pairs = len(pairs)
+            addrs.extend(line_addrs)
+            masks.extend(line_masks)
+            ids.append(id)
+            counts.append(num_pairs)
+        addrs = vectorized.ipv4_to_int_list(addrs)
+        masks = vectorized.ipv4_to_int_list(masks)
+        # rebuild the sorted sub/mask pairs for each id line
+        self.parsed_data = list()
+        start = 0
+        for id, num_pairs in zip(ids, counts):
+            end = start + num_pairs
+            parsed_subnets = [[addr, mask] for addr, mask in zip(addrs[start:end], masks[start:end])]
+            num_invalid = sum(1 for addr, mask in parsed_subnets if isinstance(addr, str) or isinstance(mask, str))
+            self.__count_line(num_pairs, num_invalid)
+            sort_pairs(parsed_subnets, num_invalid)
             self.__parsed_data.append([id, parsed_subnets])
+            start = end
+        # finally, sort the completed parsed data table by id #
+        self.parsed_data = sort_rows(self.__parsed_data)
+        print("...Data successfully parsed.")
+
+    # Parser method for compact storage mode (packed pairs; invalid tokens in a side table)
+    def __parse_input_file_compact(self):
+        compact_data = CompactData()
+        for line_number, line in enumerate(self.__file_reader(self.file), 1):
+            try:
+                id, pairs, invalid = parse_line_compact(line)
+            except (IndexError, ValueError) as err:
+                self.__quarantine_line(line_number, line, err)
+                continue
+            self.__count_line(len(pairs) + len(invalid), len(invalid))
+            compact_data.append(id, pairs, invalid)
+        # finally, sort the completed parsed data table by id #
+        self.parsed_data = compact_data.sorted()
+        print("...Data successfully parsed.")
+
+    # collect the parsed shards (in file order) & report the progress as each one comes back
+    def __progress_shards(self, shard_results, ends: list) -> list:
+        self.progress.start('parse', total_bytes=os.path.getsize(self.file))
+        shards = list()
+        num_lines = 0
+        for shard_result, end in zip(shard_results, ends):
+            shards.append(shard_result)
+            num_lines += len(shard_result[0]) + len(shard_result[4])
+            self.progress.update(num_lines, end)
+        self.progress.finish(num_lines, ends[-1] if ends else 0)
+        return shards
+
+    # Parser method for parallel parsing: the input file is split into newline-aligned byte ranges, each
+    # shard is parsed by a worker process & sent back packed (see _parse_shard()), and the shards are
+    # joined in file order & sorted -- the parsed data is the same as a serial parse's
+    def __parse_input_file_sharded(self):
+        bounds = shard_bounds(self.file, self.workers)
+        print(f"...Parsing input file in {len(bounds)} shard(s) across {self.workers} worker processes...")
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            starts, ends = [start for start, _ in bounds], [end for _, end in bounds]
+            shard_results = executor.map(_parse_shard, repeat(self.file), starts, ends, repeat(self.compact),
+                                         repeat(self.quarantine is not None))
+            if self.progress is None:
+                shards = list(shard_results)
+            else:
+                shards = self.__progress_shards(shard_results, ends)
+        # (quarantined line #'s are numbered within their shard)
+        num_shard_lines = 0
+        for shard, _, num_subnets, num_invalid_subnets, quarantined in shards:
+            for line_number, line, err in quarantined:
+                self.__quarantine_line(num_shard_lines + line_number, line, err)
+            num_shard_lines += len(shard) + len(quarantined)
+            self.__num_lines += len(shard)
+            self.__num_subnets += num_subnets
+            self.__num_invalid_subnets += num_invalid_subnets
         # finally, sort the completed parsed data table by id #
-        self.__parsed_data.sort()
-        print("...Data successfully parsed.")
\ No newline at end of file
+        if self.compact:
+            compact_data = CompactData()
+            for shard, *_ in shards:
+                compact_data.extend(shard)
+            self.parsed_data = compact_data.sorted()
+        else:
+            with common.gc_paused():
+                rows = list(chain.from_iterable(_shard_rows(shard, invalid_rows) for shard, invalid_rows, *_ in shards))
+            self.parsed_data = sort_rows(rows)
+        print("...Data successfully parsed.")
+
+
+# ---------------------------------------------
+# function to split a file into (up to) 'num_shards' byte ranges of about the same size, each one
+# starting at the beginning of a line (just after a b'\n') and no smaller than MIN_SHARD_SIZE
+#   returns list: (start, end) byte offsets of each shard, in file order (empty for an empty file)
+def shard_bounds(filepath: str, num_shards: int) -> list:
+    size = os.path.getsize(filepath)
+    num_shards = max(1, min(num_shards, size // MIN_SHARD_SIZE))
+    bounds = [0]
+    with open(filepath, 'rb') as f:
+        for shard in range(1, num_shards):
+            f.seek(max(shard * size // num_shards, bounds[-1]))
+            # move on to the start of the next line
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+# Generator to yield the raw lines of a memory-mapped file as 'bytes' (without line breaks), from its
+# current position to its end
+def mmap_lines(mm):
+    for raw_line in iter(mm.readline, b''):
+        # drop the line break ('\r\n', '\n' or a final '\r') like text mode does
+        if raw_line.endswith(b'\r\n'):
+            raw_line = raw_line[:-2]
+        elif raw_line.endswith(b'\n') or raw_line.endswith(b'\r'):
+            raw_line = raw_line[:-1]
+        # text mode (newline='') also treats a lone '\r' as a line break
+        if b'\r' in raw_line:
+            yield from raw_line.split(b'\r')
+        else:
+            yield raw_line
+
+# function to parse one byte range of the input file (runs in a worker process).
+# Only the shard's range is memory-mapped. Its rows come back packed in a CompactData (which pickles as a
+# few flat arrays instead of a list & two boxed ints per subnet); in list mode, the (rare) rows with invalid
+# tokens are returned as parsed instead, keyed by row index, since their pairs mix ints & strings.
+# With 'resilient', malformed lines are returned (to be quarantined by the parent) instead of raising.
+#   returns tuple: (CompactData, invalid rows {row index: pairs}, # of subnets, # of invalid subnets,
+#                   malformed lines [(line # within the shard, decoded text, exception), ...])
+def _parse_shard(filepath: str, start: int, end: int, compact: bool, resilient=False):
+    shard = CompactData()
+    invalid_rows = dict()
+    quarantined = list()
+    num_subnets = num_invalid_subnets = 0
+    # (a mapping has to start on an allocation boundary)
+    map_start = start - start % mmap.ALLOCATIONGRANULARITY
+    with open(filepath, 'rb') as f, \
+         mmap.mmap(f.fileno(), end - map_start, access=mmap.ACCESS_READ, offset=map_start) as mm:
+        mm.seek(start - map_start)
+        for line_number, line in enumerate(mmap_lines(mm), 1):
+            try:
+                if compact:
+                    id, pairs, invalid = parse_line_compact(line.decode(INPUT_ENCODING).rstrip())
+                else:
+                    (id, pairs), num_invalid = parse_bytes_line(line)
+            except (IndexError, ValueError) as err:
+                if not resilient:
+                    raise
+                quarantined.append((line_number, line.decode(INPUT_ENCODING, errors='replace'), err))
+                continue
+            if compact:
+                num_subnets += len(pairs) + len(invalid)
+                num_invalid_subnets += len(invalid)
+                shard.append(id, pairs, invalid)
+                continue
+            num_subnets += len(pairs)
+            num_invalid_subnets += num_invalid
+            if num_invalid:
+                invalid_rows[len(shard)] = pairs
+                pairs = ()
+            shard.append(id, pairs)
+    return (shard, invalid_rows, num_subnets, num_invalid_subnets, quarantined)
+
+# function to unpack the rows of a list-mode shard back to [id, [[sub, mask], ...]] rows
+# (all of the pairs are unpacked at once, then each row takes a slice of them)
+def _shard_rows(shard, invalid_rows: dict) -> list:
+    flat_pairs = iter(shard.pairs.tolist())
+    pairs = list(map(list, zip(flat_pairs, flat_pairs)))
+    offsets = shard.offsets.tolist()
+    rows = list(map(lambda id, start, end: [id, pairs[start:end]], shard.ids, offsets, islice(offsets, 1, None)))
+    for idx, row_pairs in invalid_rows.items():
+        rows[idx][1] = row_pairs
+    return rows
+
+
+# ---------------------------------------------
+## Class for storing parsed data compactly.
+## The valid sub/mask pairs of every line are packed into a single file-wide array('I') buffer
+## (sub, mask, sub, mask, ...) with per-line offsets, instead of a list object & two boxed ints per subnet.
+## Invalid tokens (not IPv4 format) are kept in a separate side table, keyed by row index.
+class CompactData:
+
+    def __init__(self):
+        self.__ids = list()
+        # row 'i' owns the pairs between offsets[i] and offsets[i + 1]
+        self.__offsets = array('Q', [0])
+        self.__pairs = array('I')
+        self.__invalid = dict()
+
+    @property
+    def ids(self):
+        return self.__ids
+
+    @property
+    def offsets(self):
+        return self.__offsets
+
+    @property
+    def pairs(self):
+        return self.__pairs
+
+    @property
+    def invalid(self):
+        return self.__invalid
+
+    def __len__(self):
+        return len(self.__ids)
+
+    # add a parsed line; 'pairs' is a sorted sequence of valid (sub, mask) int pairs
+    def append(self, id: str, pairs, invalid=None):
+        if invalid:
+            self.__invalid[len(self.__ids)] = list(invalid)
+        self.__ids.append(id)
+        for sub, mask in pairs:
+            self.__pairs.append(sub)
+            self.__pairs.append(mask)
+        self.__offsets.append(len(self.__pairs) // 2)
+
+    # add all of the rows of another CompactData (e.g. the shards of a parallel parse, in file order)
+    def extend(self, other):
+        num_rows, num_pairs = len(self.__ids), len(self.__pairs) // 2
+        for idx, invalid in other.__invalid.items():
+            self.__invalid[num_rows + idx] = invalid
+        self.__ids.extend(other.__ids)
+        self.__pairs.extend(other.__pairs)
+        self.__offsets.extend(offset + num_pairs for offset in islice(other.__offsets, 1, None))
+
+    # get a row as (id, subs, masks, invalid tokens); subs & masks are zero-copy views of the packed buffer.
+    # a slice returns a new CompactData holding those rows (e.g. a batch for a worker process)
+    def __getitem__(self, idx: int):
+        if isinstance(idx, slice):
+            return self.__subset(range(len(self))[idx])
+        pairs_view = memoryview(self.__pairs)
+        start, end = self.__offsets[idx] * 2, self.__offsets[idx + 1] * 2
+        return (self.__ids[idx], pairs_view[start:end:2], pairs_view[start + 1:end:2], self.__invalid.get(idx, []))
+
+    # Generator to yield one row at a time
+    def __iter__(self):
+        pairs_view = memoryview(self.__pairs)
+        offsets = self.__offsets
+        for idx, id in enumerate(self.__ids):
+            start, end = offsets[idx] * 2, offsets[idx + 1] * 2
+            yield (id, pairs_view[start:end:2], pairs_view[start + 1:end:2], self.__invalid.get(idx, []))
+
+    # get a copy of the data sorted by id # (ties are ordered by their pairs, like the list-based datatable)
+    def sorted(self):
+        offsets, pairs = self.__offsets, self.__pairs
+        def __pairs_key(idx):
+            return (pairs[offsets[idx] * 2:offsets[idx + 1] * 2], self.__invalid.get(idx, []))
+        # rebuild the packed buffers in sorted order
+        return self.__subset(id_order(self.__ids, __pairs_key))
+
+    # get a new CompactData holding the given rows (in the given order)
+    def __subset(self, row_indexes):
+        ids, offsets, pairs = self.__ids, self.__offsets, self.__pairs
+        subset = CompactData()
+        for idx in row_indexes:
+            start, end = offsets[idx] * 2, offsets[idx + 1] * 2
+            subset.__ids.append(ids[idx])
+            subset.__pairs.extend(pairs[start:end])
+            subset.__offsets.append(len(subset.__pairs) // 2)
+            if idx in self.__invalid:
+                subset.__invalid[len(subset.__ids) - 1] = self.__invalid[idx]
+        return subset
+
+
+# ---------------------------------------------
+# function to get the output order of rows (sorted by id, as strings) as an index array.
+# Only the indexes are sorted, keyed by the id strings themselves (no rows are compared or moved, and
+# no keys are built); runs of duplicate ids are then ordered by 'tie_key' (their pairs).
+#   returns list: row indexes in sorted order
+def id_order(ids: list, tie_key) -> list:
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    # positions holding the same id as the previous position (found without a Python-level loop)
+    sorted_ids = list(map(ids.__getitem__, order))
+    duplicate_positions = compress(count(1), map(operator.eq, sorted_ids, islice(sorted_ids, 1, None)))
+    run_start = run_end = -2
+    for pos in chain(duplicate_positions, (-1,)):
+        if pos != run_end + 1:
+            if run_end >= 0:
+                order[run_start:run_end + 1] = sorted(order[run_start:run_end + 1], key=tie_key)
+            run_start = pos - 1
+        run_end = pos
+    return order
+
+# function to sort parsed rows ([id, sorted pairs]) by id -> a new list, in the same order as sorted(rows)
+# (rows of the same id holding invalid pairs are ordered by pairs_key(), like CompactData.sorted()).
+# Rows that are nearly in order already (e.g. numeric ids in numeric order) need no special case: Timsort
+# finds the long runs of their ids and merges them in close to linear time.
+def sort_rows(rows: list) -> list:
+    ids = [row[0] for row in rows]
+    return [rows[idx] for idx in id_order(ids, lambda idx: pairs_key(rows[idx][1]))]
+
+# function to get the key ordering the rows of the same id by their pairs, the way CompactData.sorted() orders
+# them: (valid pairs, 'addr/mask' text of the invalid pairs) -- 'str' & 'int' values are never compared
+def pairs_key(pairs: list) -> tuple:
+    valid = [pair for pair in pairs if not (isinstance(pair[0], str) or isinstance(pair[1], str))]
+    if len(valid) == len(pairs):
+        return (pairs, [])
+    invalid = [common.format_ipv4(sub) + '/' + common.format_ipv4(mask) for sub, mask in pairs
+               if isinstance(sub, str) or isinstance(mask, str)]
+    return (valid, invalid)
+
+
+# ---------------------------------------------
+# function to sort the [sub, mask] pairs of a line (in place). Pairs holding an invalid address or mask
+# ('str') are listed first (in input order), the way the compact parser lists its invalid tokens, and the
+# valid pairs are sorted after them. 'num_invalid' is the # of invalid pairs, if the caller counted them.
+def sort_pairs(pairs: list, num_invalid=None):
+    if num_invalid is None:
+        num_invalid = sum(1 for sub, mask in pairs if isinstance(sub, str) or isinstance(mask, str))
+    if not num_invalid:
+        pairs.sort()
+        return
+    invalid = [pair for pair in pairs if isinstance(pair[0], str) or isinstance(pair[1], str)]
+    valid = sorted(pair for pair in pairs if not (isinstance(pair[0], str) or isinstance(pair[1], str)))
+    pairs[:] = invalid + valid
+
+## Function for parsing a single line of input data -> [id, [[sub, mask], ...]]
+def parse_line(line: str) -> list:
+    return _parse_line(line)[0]
+
+# parse a single line of input data
+#   returns tuple: (parsed row & # of invalid subnets, i.e. not IPv4 format)
+def _parse_line(line: str):
+    # split the i.d. from its subnets/masks
+    line_split = line.split(':')
+    id, subnets = line_split[0], line_split[1].split(',')
+    parsed_subnets = list()
+    num_invalid = 0
+    # split sub address & mask, convert valid ipv4 to 'int', store sub & mask as a pair
+    for subnet in subnets:
+        if '/' not in subnet:
+            continue
+        addr, mask = subnet.split('/')
+        addr = common.ipv4_to_int(addr)
+        mask = common.ipv4_to_int(mask)
+        if isinstance(addr, str) or isinstance(mask, str):
+            num_invalid += 1
+        parsed_subnets.append([addr, mask])  
+    # sort sub/mask pairs for the current id line
+    sort_pairs(parsed_subnets, num_invalid)
+    return ([id, parsed_subnets], num_invalid)
+
+
+## Function for parsing a single line of input data in compact form -> (id, sorted valid pairs, invalid tokens)
+def parse_line_compact(line: str):
+    # split the i.d. from its subnets/masks
+    line_split = line.split(':')
+    id, subnets = line_split[0], line_split[1].split(',')
+    parsed_subnets = list()
+    invalid_subnets = list()
+    # split sub address & mask, convert valid ipv4 to 'int'; tokens that aren't IPv4 format go to the side table,
+    # formatted the way the list-based Coalescer writes them (a valid half in its canonical form)
+    for subnet in subnets:
+        if '/' not in subnet:
+            continue
+        addr, mask = subnet.split('/')
+        addr = common.ipv4_to_int(addr)
+        mask = common.ipv4_to_int(mask)
+        if isinstance(addr, str) or isinstance(mask, str):
+            invalid_subnets.append(common.format_ipv4(addr) + '/' + common.format_ipv4(mask))
+        else:
+            parsed_subnets.append((addr, mask))
+    # sort sub/mask pairs for the current id line
+    parsed_subnets.sort()
+    return (id, parsed_subnets, invalid_subnets)
+
+
+## Function for parsing a single raw line ('bytes', as read from the memory-mapped file; no line break).
+## Valid tokens are tokenized & converted to integers without decoding them to strings; only the id and
+## invalid tokens (which have to be echoed back to the output) are decoded. Returns exactly what _parse_line()
+## returns for the decoded text line -- a non-ascii line is decoded & parsed as text.
+#   returns tuple: (parsed row & # of invalid subnets)
+def parse_bytes_line(line: bytes):
+    if not line.isascii():
+        return _parse_line(line.decode(INPUT_ENCODING).rstrip())
+    line = line.rstrip()
+    # str.rstrip() also strips these ascii control chars (bytes.rstrip() doesn't)
+    while line and line[-1] in ASCII_STR_WHITESPACE:
+        line = line[:-1].rstrip()
+    # split the i.d. from its subnets/masks
+    line_split = line.split(b':')
+    id, subnets = line_split[0].decode(INPUT_ENCODING), line_split[1].split(b',')
+    parsed_subnets = list()
+    num_invalid = 0
+    # convert each sub/mask token to an int pair (tokens repeat a lot, so whole tokens are cached)
+    for subnet in subnets:
+        if b'/' not in subnet:
+            continue
+        addr, mask, invalid = bytes_subnet_to_pair(subnet)
+        num_invalid += invalid
+        parsed_subnets.append([addr, mask])
+    # sort sub/mask pairs for the current id line
+    sort_pairs(parsed_subnets, num_invalid)
+    return ([id, parsed_subnets], num_invalid)
+
+# function to convert a 'addr/mask' bytes token to integers like common.ipv4_to_int()
+#   returns tuple: (addr, mask, 1 if either one is invalid ipv4 fmt (left as its decoded string) else 0)
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def bytes_subnet_to_pair(subnet: bytes):
+    addr, mask = subnet.split(b'/')
+    addr, mask = bytes_ipv4_to_int(addr), bytes_ipv4_to_int(mask)
+    return (addr, mask, int(isinstance(addr, str) or isinstance(mask, str)))
+
+# function to convert an IPv4 'bytes' token to an integer like common.ipv4_to_int()
+#   (invalid ipv4 fmt --> return the token decoded to its original string)
+def bytes_ipv4_to_int(ipv4: bytes):
+    octets = ipv4.split(b'.')
+    if len(octets) == 4:
+        a, b, c, d = octets
+        # fast path: plain octets are a table lookup (validates & converts in one step)
+        if a in OCTET_INT and b in OCTET_INT and c in OCTET_INT and d in OCTET_INT:
+            return OCTET_INT[a] << 24 | OCTET_INT[b] << 16 | OCTET_INT[c] << 8 | OCTET_INT[d]
+        # octets with leading zeros are still valid; bytes.isdigit() is ascii-only, which matches
+        # str.isdecimal() for an ascii token
+        if a.isdigit() and b.isdigit() and c.isdigit() and d.isdigit():
+            a, b, c, d = int(a), int(b), int(c), int(d)
+            if a <= 255 and b <= 255 and c <= 255 and d <= 255:
+                return a << 24 | b << 16 | c << 8 | d
+    return ipv4.decode(INPUT_ENCODING)
@@ -0,0 +1,217 @@
+import os
+import csv
+import json
+import hashlib
+# local modules
+import dataparser
+import coalescence
+import engines
+import common
+from common import ConstructionError as ctor
+
+
+##################
+##  Delta Mode  ##
+##################
+
+# the per-id hash state is kept next to the output file ('<output_file>.delta.json')
+STATE_SUFFIX = '.delta.json'
+STATE_VERSION = 1
+
+# function to get the delta state filepath for an output file
+def state_path(output_file: str) -> str:
+    return output_file + STATE_SUFFIX
+
+# function to hash all input lines of one id (order-independent, like the sorted output)
+def hash_lines(lines: list) -> str:
+    text = lines[0] if len(lines) == 1 else '\n'.join(sorted(lines))
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+# ---------------------------------------------
+## Class for re-running the coalescer on a changed input file.
+## Only ids whose input lines were added or changed since the previous run are parsed & coalesced; the
+## rows of unchanged ids are copied from the previous output file as-is, and removed ids are dropped.
+## The output is identical to a full run. If there is no usable state (first run, or the output file was
+## changed since), every id is treated as changed.
+class DeltaRun:
+
+    def __init__(self, input_file: str, output_file: str, workers=1, memo_size=coalescence.MEMO_SIZE, subnet_cache=None,
+                 mode=coalescence.MODE_COALESCE, engine=engines.REFERENCE, buffer_size=common.IO_BUFFER_SIZE):
+        # check ctor arg types
+        ctor.check_arg_type("Failed to construct DeltaRun obj (arg1 must be type 'str')", input_file, str)
+        ctor.check_arg_type("Failed to construct DeltaRun obj (arg2 must be type 'str')", output_file, str)
+        # verify the input file exists
+        common.check_path_exists(input_file)
+        self.__input_file = input_file
+        self.__output_file = output_file
+        self.__workers = workers
+        self.__memo_size = memo_size
+        self.__subnet_cache = subnet_cache
+        self.__mode = mode
+        self.__engine = engine
+        self.__buffer_size = buffer_size
+        self.__coalescer = None
+        # run counters
+        self.__num_lines = 0
+        self.__num_ids = 0
+        self.__num_changed = 0
+        self.__num_removed = 0
+        self.__bytes_written = 0
+
+    @property
+    def input_file(self):
+        return self.__input_file
+
+    @property
+    def output_file(self):
+        return self.__output_file
+
+    @property
+    def state_file(self):
+        return state_path(self.output_file)
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    @property
+    def engine(self):
+        return self.__engine
+
+    @property
+    def coalescer(self):
+        return self.__coalescer
+
+    @property
+    def num_lines(self):
+        return self.__num_lines
+
+    @property
+    def num_ids(self):
+        return self.__num_ids
+
+    @property
+    def num_changed(self):
+        return self.__num_changed
+
+    @property
+    def num_removed(self):
+        return self.__num_removed
+
+    @property
+    def bytes_written(self):
+        return self.__bytes_written
+
+    # read the input file & group its lines by id
+    def __read_input(self) -> dict:
+        lines_by_id = dict()
+        with common.open_input(self.input_file, self.__buffer_size) as f:
+            print(f"...Opening input file and hashing id lines...")
+            for line in f:
+                line = line.rstrip()
+                lines_by_id.setdefault(line.partition(':')[0], list()).append(line)
+                self.__num_lines += 1
+        return lines_by_id
+
+    # load the previous run's state: {id: (hash, first output row, # of output rows)}
+    # (no usable state --> empty dict, i.e. a full run)
+    def __load_state(self) -> dict:
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            # (rows coalesced in another --mode can't be reused)
+            if (state.get('version') == STATE_VERSION and state.get('mode', coalescence.MODE_COALESCE) == self.mode
+                    and state.get('output_bytes') == os.path.getsize(self.output_file)):
+                previous = dict()
+                start = 0
+                for id, hash, num_rows in zip(state['ids'], state['hashes'], state['rows']):
+                    previous[id] = (hash, start, num_rows)
+                    start += num_rows
+                return previous
+        except (OSError, ValueError, KeyError):
+            pass
+        print(f"...No usable delta state for '{self.output_file}'; coalescing every id.")
+        return dict()
+
+    # parse & coalesce the lines of the changed ids (same row order as a full run)
+    #   returns dict: id -> list of formatted rows
+    def __coalesce_changed(self, lines_by_id: dict, changed: list) -> dict:
+        parsed_data = dataparser.sort_rows([dataparser.parse_line(line) for id in changed for line in lines_by_id[id]])
+        self.__coalescer = coalescence.Coalescer(parsed_data, workers=self.__workers, memo_size=self.__memo_size,
+                                                 subnet_cache=self.__subnet_cache, mode=self.mode, engine=self.engine)
+        rows_by_id = dict()
+        for row, formatted_entry in zip(parsed_data, self.coalescer.datatable):
+            rows_by_id.setdefault(row[0], list()).append(formatted_entry)
+        return rows_by_id
+
+    # write the new output: copy the unchanged rows from the previous output & write the changed ones
+    def __write_output(self, ids: list, changed: set, previous: dict, rows_by_id: dict):
+        old_rows = list()
+        if len(changed) < len(ids):
+            with common.open_input(self.output_file, self.__buffer_size) as f:
+                old_rows = f.readlines()
+        # (the temp file keeps the output's extension, so a compressed output stays compressed)
+        root, ext = os.path.splitext(self.output_file)
+        tmp_file = root + '.tmp' + ext
+        with common.open_output(tmp_file, self.__buffer_size) as f:
+            print(f"...Writing output file to '{self.output_file}'")
+            filewriter = csv.writer(f)
+            # consecutive unchanged ids are copied as one slice of the previous output
+            copy_start = copy_end = 0
+            for id in ids:
+                if id in changed:
+                    f.writelines(old_rows[copy_start:copy_end])
+                    copy_start = copy_end = 0
+                    filewriter.writerows(rows_by_id[id])
+                    continue
+                _, start, num_rows = previous[id]
+                if start != copy_end:
+                    f.writelines(old_rows[copy_start:copy_end])
+                    copy_start = start
+                copy_end = start + num_rows
+            f.writelines(old_rows[copy_start:copy_end])
+        os.replace(tmp_file, self.output_file)
+        self.__bytes_written = os.path.getsize(self.output_file)
+
+    # save the state for the next run (flat lists, which are much faster to encode & decode than a list of entries)
+    def __save_state(self, ids: list, hashes: dict, lines_by_id: dict):
+        state = {
+            'version': STATE_VERSION,
+            'mode': self.mode,
+            'output_bytes': self.bytes_written,
+            'ids': ids,
+            'hashes': [hashes[id] for id in ids],
+            'rows': [len(lines_by_id[id]) for id in ids],
+        }
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            # (json.dumps() uses the C encoder; json.dump() streams through the pure-Python one)
+            f.write(json.dumps(state))
+        os.replace(tmp_file, self.state_file)
+
+    def run(self):
+        # (like the Parser, the tables built here hold no reference cycles)
+        with common.gc_paused():
+            self.__run()
+
+    def __run(self):
+        lines_by_id = self.__read_input()
+        hashes = {id: hash_lines(lines) for id, lines in lines_by_id.items()}
+        previous = self.__load_state()
+        # the output is sorted by id, so ids are kept in sorted order throughout
+        ids = sorted(hashes)
+        changed = [id for id in ids if id not in previous or previous[id][0] != hashes[id]]
+        self.__num_ids = len(ids)
+        self.__num_changed = len(changed)
+        self.__num_removed = len(previous.keys() - hashes.keys())
+        print(f"...Delta: {self.num_changed} of {self.num_ids} ids new or changed, {self.num_removed} removed.")
+
+        rows_by_id = self.__coalesce_changed(lines_by_id, changed)
+        dir_path = os.path.dirname(self.output_file)
+        if dir_path:
+            common.make_dir_if_needed(dir_path)
+        self.__write_output(ids, set(changed), previous, rows_by_id)
+        self.__save_state(ids, hashes, lines_by_id)
+
+
+# ---------------------------------------------
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import json
+import bisect
+import argparse
+# local modules
+import common
+import aggregate
+import records
+
+
+############################
+##  Reverse Lookup Index  ##
+############################
+
+INDEX_VERSION = 1
+
+# function to get the [start, end] address interval of one formatted subnet token (see records.parse_token())
+#   returns tuple: (start, end), or None for invalid subnets & masks (they cover no addresses)
+def token_interval(token: str):
+    parsed = records.parse_token(token)
+    kind = parsed[0]
+    if kind == records.KIND_PREFIX:
+        return (parsed[1] & parsed[2], parsed[3])
+    if kind in (records.KIND_RANGE, records.KIND_ANY):
+        return (parsed[1], parsed[3])
+    return None
+
+# ---------------------------------------------
+## Class for a reverse lookup index of coalesced rows: which ids cover a given IPv4 address.
+## Every subnet of a row is stored as CIDR prefixes (ranges are split into their minimal prefixes) in
+## one hash table per prefix length, keyed by network address. A lookup masks the address once per
+## prefix length in use and gathers the ids of the matching networks (at most 33 dict lookups).
+class IPIndex:
+
+    def __init__(self, rows=()):
+        # cidr # -> {network int: list of ids}
+        self.__tables = dict()
+        self.__num_rows = 0
+        self.__num_prefixes = 0
+        for row in rows:
+            self.add(row)
+
+    @property
+    def num_rows(self):
+        return self.__num_rows
+
+    @property
+    def num_prefixes(self):
+        return self.__num_prefixes
+
+    # index one formatted row ([id, formatted subnets], as written to the output file)
+    def add(self, row):
+        # (a line with no subnets, e.g. '5:', is written as an empty row, which covers no address)
+        if not row:
+            return
+        id, subnets = row[0], row[1]
+        self.__num_rows += 1
+        for token in subnets.split(';'):
+            interval = token_interval(token)
+            if interval is None:
+                continue
+            for network, cidr in aggregate.range_to_prefixes(*interval):
+                ids = self.__tables.setdefault(cidr, dict()).setdefault(network, list())
+                # id lists are kept sorted & unique (the output is sorted by id, so this is nearly always an append)
+                if not ids or ids[-1] < id:
+                    ids.append(id)
+                elif id not in ids:
+                    bisect.insort(ids, id)
+                else:
+                    continue
+                self.__num_prefixes += 1
+
+    # Generator to index rows as they pass through (e.g. on their way to the FileWriter in streaming mode)
+    def add_rows(self, rows):
+        for row in rows:
+            self.add(row)
+            yield row
+
+    # look up the ids covering an address (IPv4 string or int)
+    #   returns list: sorted ids (empty if no id covers it)
+    def lookup(self, addr) -> list:
+        if isinstance(addr, str):
+            addr = common.ipv4_to_int(addr)
+        if not isinstance(addr, int):
+            raise ValueError(f"'{addr}' is not a valid IPv4 address.")
+        found = list()
+        for cidr, table in self.__tables.items():
+            ids = table.get(addr & common.CIDR_TO_MASK[cidr])
+            if ids is not None:
+                found.append(ids)
+        # a single matching network needs no merging (its id list is already sorted & unique)
+        if len(found) == 1:
+            return list(found[0])
+        return sorted(set().union(*found))
+
+    # look up a batch of addresses
+    #   returns list: sorted ids for each address
+    def lookup_many(self, addrs) -> list:
+        return [self.lookup(addr) for addr in addrs]
+
+    # write the index to a JSON file (flat lists per prefix length; replaced atomically)
+    def save(self, filepath: str):
+        dir_path = os.path.dirname(filepath)
+        if dir_path:
+            common.make_dir_if_needed(dir_path)
+        tables = {cidr: [list(table), list(table.values())] for cidr, table in self.__tables.items()}
+        state = {'version': INDEX_VERSION, 'rows': self.num_rows, 'prefixes': self.num_prefixes, 'tables': tables}
+        tmp_file = filepath + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(json.dumps(state))
+        os.replace(tmp_file, filepath)
+        print(f"...Wrote lookup index of {self.num_prefixes} prefixes to '{filepath}'")
+
+    # load an index written by save()
+    @classmethod
+    def load(cls, filepath: str):
+        common.check_path_exists(filepath)
+        with open(filepath) as f:
+            state = json.load(f)
+        if state.get('version') != INDEX_VERSION:
+            raise ValueError(f"'{filepath}' was written by another index version; rebuild it.")
+        ip_index = cls()
+        ip_index.__num_rows = state['rows']
+        ip_index.__num_prefixes = state['prefixes']
+        ip_index.__tables = {int(cidr): dict(zip(networks, ids)) for cidr, (networks, ids) in state['tables'].items()}
+        return ip_index
+
+    # build an index from an existing (possibly compressed) output file (no coalescing)
+    @classmethod
+    def from_csv(cls, filepath: str):
+        common.check_path_exists(filepath)
+        with common.open_input(filepath) as f:
+            return cls(csv.reader(f))
+
+
+# ---------------------------------------------
+##################
+##  Entrypoint  ##
+##################
+def parse_args(argv):
+    argparser = argparse.ArgumentParser(prog='index.py', description="Build or query a reverse lookup index (which ids cover an address).")
+    commands = argparser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="index an existing output file (see also main.py --index)")
+    build.add_argument('output_file', help="coalesced output filepath")
+    build.add_argument('index_file', help="index filepath to write")
+    query = commands.add_parser('query', help="print 'addr,id;id;...' for each address")
+    query.add_argument('index_file', help="index filepath")
+    query.add_argument('addrs', nargs='*', metavar='ADDR', help="IPv4 addresses (default: one per line from stdin)")
+    return argparser.parse_args(argv)
+
+def run(args):
+    if args.command == 'build':
+        IPIndex.from_csv(args.output_file).save(args.index_file)
+        return
+    ip_index = IPIndex.load(args.index_file)
+    writer = csv.writer(sys.stdout)
+    for addr in args.addrs or (line.strip() for line in sys.stdin):
+        if not addr:
+            continue
+        try:
+            writer.writerow([addr, ';'.join(ip_index.lookup(addr))])
+        except ValueError as err:
+            print(err, file=sys.stderr)
+
+if __name__ == "__main__":
+    run(parse_args(sys.argv[1:]))
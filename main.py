@@ -3,10 +3,22 @@
 import sys
 import os
 import csv
+import argparse
+import contextlib
 # local modules
 import dataparser
 import coalescence
 import common
+import metrics
+import delta
+import cache
+import index
+import records
+import engines
+import crosscheck
+import quarantine
+import checkpoint
+import progress
 from common import ConstructionError as ctor
 
 
@@ -18,16 +30,25 @@ from common import ConstructionError as ctor
 ## Class for writing the coalesced data to the output file
 class FileWriter:
         
-    def __init__(self, filepath: str, data: list):
-        # check ctor arg types
+    def __init__(self, filepath: str, data: list, stream=False, stdout=None, buffer_size=common.IO_BUFFER_SIZE,
+                 checkpoint=None):
+        # check ctor arg types (streaming mode accepts any iterable of rows, e.g. Coalescer.rows())
         ctor.check_arg_type("Failed to construct FileWriter obj (arg1 must be type 'str')", filepath, str)
-        ctor.check_arg_type("Failed to construct FileWriter obj (arg2 must be type 'list')", data, list)
+        if not stream:
+            ctor.check_arg_type("Failed to construct FileWriter obj (arg2 must be type 'list')", data, list)
         # check that a file name exists in the 'filepath' arg
         if filepath.endswith('/'):
             raise ctor(f"File name is missing from the output filepath arg: '{filepath}'")
         self.__outfile = filepath
         self.__output_data = data
-        self.__check_dir()
+        self.__bytes_written = 0
+        self.__buffer_size = buffer_size
+        # with a checkpoint (checkpoint.Checkpoint), the rows are written to its part file first
+        self.__checkpoint = checkpoint
+        # '-' writes to stdout (the one given, else the current sys.stdout)
+        self.__stdout = stdout if stdout is not None else sys.stdout
+        if filepath != common.STDIO_PATH:
+            self.__check_dir()
 
     @property
     def outfile(self):
@@ -37,6 +58,14 @@ class FileWriter:
     def output_data(self):
         return self.__output_data
 
+    @property
+    def bytes_written(self):
+        return self.__bytes_written
+
+    @property
+    def buffer_size(self):
+        return self.__buffer_size
+
     # check if output directory exists; create the directory if needed
     def __check_dir(self):
         if '/' not in self.outfile:
@@ -47,17 +76,42 @@ class FileWriter:
             print(f"...Checking if '{dir_path}' directory exists.")
             common.make_dir_if_needed(dir_path)
 
-    # write the output file
+    # write the output file (csv.writer.writerows() consumes the data lazily, one row at a time, into a
+    # large write buffer; a '.gz', '.bz2' or '.xz' output file is compressed as it is written)
     def write_file(self):
+        if self.outfile == common.STDIO_PATH:
+            self.__write_stdout()
+            return
         try:
-            with open(self.outfile, 'w', newline='') as f:
+            if self.__checkpoint is not None:
+                self.__write_checkpointed()
+                return
+            with common.open_output(self.outfile, self.buffer_size) as f:
                 print(f"...Writing output file to '{self.outfile}'")
                 filewriter = csv.writer(f)
                 filewriter.writerows(self.output_data)
+            self.__bytes_written = os.path.getsize(self.outfile)
         except PermissionError:
             print("Permission Denied: Try running the script as root or sudo.")
             # TODO: try to change permissions
 
+    # write the rows to the checkpoint's part file, which becomes the output file once they are all written
+    def __write_checkpointed(self):
+        with self.__checkpoint.open_part(self.buffer_size) as f:
+            print(f"...Writing output file to '{self.outfile}' (via '{self.__checkpoint.part_file}')")
+            filewriter = csv.writer(f)
+            filewriter.writerows(self.output_data)
+        self.__checkpoint.finish()
+        self.__bytes_written = os.path.getsize(self.outfile)
+
+    # write the rows to stdout, flushing each one so that a downstream consumer gets it right away
+    def __write_stdout(self):
+        filewriter = csv.writer(self.__stdout)
+        for row in self.output_data:
+            # (writerow() returns the # of characters written)
+            self.__bytes_written += filewriter.writerow(row)
+            self.__stdout.flush()
+
 
 # ---------------------------------------------
 ############
@@ -66,8 +120,27 @@ class FileWriter:
 class Main:
 
     def __init__(self, argv):
-        self.__input_file = argv[0]
-        self.__output_file = argv[1]
+        args = self.__parse_args(argv)
+        self.__args = args
+        self.__input_file = args.input_file
+        self.__output_file = args.output_file
+        # stdout output is always streamed, so each row is written as soon as it is coalesced
+        self.__stream = args.stream or args.output_file == common.STDIO_PATH
+        self.__compact = args.compact
+        self.__vectorized = args.vectorized
+        self.__workers = args.workers
+        self.__memo_size = args.memo_size
+        # persistent cache (--cache) & quarantine file (--quarantine), opened for the duration of run()
+        self.__subnet_cache = None
+        self.__quarantine = None
+        # progress reporter (--progress)
+        self.__progress = progress.Progress(args.progress, args.progress_interval) if args.progress else None
+        # stdout for the '-' output (progress messages are redirected while running)
+        self.__stdout = sys.stdout
+
+    @property
+    def args(self):
+        return self.__args
 
     @property
     def input_file(self):
@@ -77,17 +150,355 @@ class Main:
     def output_file(self):
         return self.__output_file
 
+    @property
+    def stream(self):
+        return self.__stream
+
+    @property
+    def compact(self):
+        return self.__compact
+
+    @property
+    def vectorized(self):
+        return self.__vectorized
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    @property
+    def memo_size(self):
+        return self.__memo_size
+
+    # parse the command line args (input & output filepaths, plus optional flags)
+    @staticmethod
+    def __parse_args(argv):
+        argparser = argparse.ArgumentParser(prog='main.py', description="Coalesce the subnets of each id in the input file.")
+        argparser.add_argument('input_file', help="input data filepath ('-' reads stdin)")
+        argparser.add_argument('output_file', help="output solution filepath ('-' writes to stdout, streamed)")
+        argparser.add_argument('--stream', action='store_true',
+                               help="stream rows through parse -> coalesce -> write with bounded memory (output follows input order)")
+        argparser.add_argument('--compact', action='store_true',
+                               help="store the parsed data in packed arrays instead of nested lists (lower memory)")
+        argparser.add_argument('--vectorized', action='store_true',
+                               help="convert addresses & masks in bulk with NumPy (falls back to the scalar parser if NumPy is missing)")
+        argparser.add_argument('--mmap', action='store_true',
+                               help="memory-map the input file and parse its raw bytes (not used by --compact/--vectorized)")
+        argparser.add_argument('--delta', action='store_true',
+                               help=f"only re-coalesce ids whose input lines changed since the previous --delta run (state: OUTPUT{delta.STATE_SUFFIX})")
+        argparser.add_argument('--mode', choices=coalescence.MODES, default=coalescence.MODE_COALESCE,
+                               help="'coalesce' merges neighbouring subnets (ranges as 'a-b'); 'aggregate' merges overlapping, "
+                                    "contained & adjacent subnets into their minimal set of CIDR prefixes (default: coalesce)")
+        argparser.add_argument('--engine', choices=tuple(engines.ENGINES), default=engines.REFERENCE,
+                               help="implementation used to coalesce the lines it can handle faster; the rest use the reference "
+                                    f"Coalescer (default: {engines.REFERENCE}; see engines.py)")
+        argparser.add_argument('--cross-check', type=float, metavar='FRACTION',
+                               help="also format this fraction of the lines (e.g. 0.01) with both --engine & the reference engine, "
+                                    "and report mismatches & the time of each")
+        argparser.add_argument('--buffer-size', type=int, default=common.IO_BUFFER_SIZE, metavar='BYTES',
+                               help=f"read & write buffer size (default: {common.IO_BUFFER_SIZE})")
+        argparser.add_argument('--workers', type=int, default=1, metavar='N',
+                               help="parse shards of the input file & coalesce batches of id lines across N worker processes (default: 1)")
+        argparser.add_argument('--memo-size', type=int, default=coalescence.MEMO_SIZE, metavar='N',
+                               help=f"max # of distinct subnet lists whose output is memoized (default: {coalescence.MEMO_SIZE}; 0 disables)")
+        argparser.add_argument('--cache', metavar='PATH',
+                               help="persistent SQLite cache of formatted output per subnet list, shared across runs (e.g. output/coalesce_cache.sqlite)")
+        argparser.add_argument('--cache-size', type=int, default=cache.MAX_ENTRIES, metavar='N',
+                               help=f"max # of entries kept in the --cache file (default: {cache.MAX_ENTRIES}; least recently used are evicted)")
+        argparser.add_argument('--index', metavar='FILE',
+                               help="also write a reverse lookup index of the output (which ids cover an address; query it with index.py)")
+        argparser.add_argument('--binary', metavar='FILE',
+                               help="also write the output as packed binary records of integers (see records.py)")
+        argparser.add_argument('--quarantine', metavar='FILE',
+                               help="write malformed input lines to FILE (line #, reason, text) and keep going, instead of aborting the run")
+        argparser.add_argument('--error-budget', type=int, metavar='N',
+                               help="with --quarantine, abort the run once more than N lines have been quarantined (default: no limit)")
+        argparser.add_argument('--checkpoint', type=float, metavar='SECONDS',
+                               help=f"write the output via OUTPUT{checkpoint.PART_SUFFIX} and save a checkpoint every SECONDS seconds "
+                                    f"(state: OUTPUT{checkpoint.STATE_SUFFIX}), so that an interrupted run can be continued with --resume")
+        argparser.add_argument('--resume', action='store_true',
+                               help="continue an interrupted --checkpoint run from its last checkpoint (starts over if there is none; "
+                                    f"implies --checkpoint {checkpoint.CHECKPOINT_INTERVAL} unless given)")
+        argparser.add_argument('--progress', nargs='?', const=progress.FORMAT_TEXT, choices=progress.FORMATS, metavar='FORMAT',
+                               help="report the lines & bytes read, lines/sec, ETA & current RSS of each stage to stderr "
+                                    "(FORMAT 'text' (default) or 'json': one JSON object per line, for schedulers to scrape)")
+        argparser.add_argument('--progress-interval', type=float, default=progress.PROGRESS_INTERVAL, metavar='SECONDS',
+                               help=f"seconds between --progress reports (default: {progress.PROGRESS_INTERVAL})")
+        argparser.add_argument('--metrics', metavar='FILE',
+                               help="write per-stage timings & run counters to a JSON metrics file")
+        argparser.add_argument('--profile', metavar='DIR',
+                               help="run each stage under cProfile and dump its stats to DIR")
+        args = argparser.parse_args(argv)
+        if args.delta and (args.stream or common.STDIO_PATH in (args.input_file, args.output_file)):
+            argparser.error("--delta splices the sorted output of the previous run, so it can't be combined with --stream or '-'")
+        if args.engine != engines.REFERENCE and args.mode != coalescence.MODE_COALESCE:
+            argparser.error(f"--engine only applies to --mode {coalescence.MODE_COALESCE}")
+        if args.error_budget is not None and (args.quarantine is None or args.error_budget < 0):
+            argparser.error("--error-budget N needs --quarantine, and N must be >= 0")
+        if args.quarantine and args.delta:
+            argparser.error("--quarantine isn't supported with --delta")
+        if args.cross_check is not None and not 0 < args.cross_check <= 1:
+            argparser.error("--cross-check FRACTION must be > 0 and <= 1")
+        if args.progress_interval <= 0:
+            argparser.error("--progress-interval SECONDS must be > 0")
+        if args.resume and args.checkpoint is None:
+            args.checkpoint = checkpoint.CHECKPOINT_INTERVAL
+        if args.checkpoint is not None:
+            if args.checkpoint <= 0:
+                argparser.error("--checkpoint SECONDS must be > 0")
+            if args.delta or common.STDIO_PATH in (args.input_file, args.output_file):
+                argparser.error("--checkpoint/--resume can't be combined with --delta or '-'")
+            # (a resumed stream truncates the quarantine file back to the checkpoint, which a compressed file can't be)
+            if (args.stream and args.quarantine
+                    and os.path.splitext(args.quarantine)[1] in common.COMPRESSED_EXTS):
+                argparser.error("--checkpoint/--resume with --stream needs an uncompressed --quarantine file")
+        return args
+
     def run(self):
+        # with the output on stdout, the progress messages go to stderr
+        self.__stdout = sys.stdout
+        messages = sys.stderr if self.output_file == common.STDIO_PATH else sys.stdout
+        with contextlib.redirect_stdout(messages):
+            self.__run()
+
+    def __run(self):
+        run_metrics = metrics.Metrics(profile_dir=self.args.profile)
+        if self.args.cache:
+            self.__subnet_cache = cache.SubnetCache(self.args.cache, coalescence.COALESCE_VERSION, self.args.cache_size)
+        run_checkpoint = None
+        if self.args.checkpoint:
+            run_checkpoint = checkpoint.Checkpoint(self.output_file, self.input_file, {'mode': self.args.mode, 'stream': self.stream},
+                                                   self.args.checkpoint, resume=self.args.resume)
+        if self.args.quarantine:
+            # (a resumed stream keeps the lines quarantined before its checkpoint; a batch run parses the whole input again)
+            resume_at = None
+            if run_checkpoint is not None and run_checkpoint.resumed and self.stream:
+                resume_at = run_checkpoint.position.get('quarantine')
+            self.__quarantine = quarantine.Quarantine(self.args.quarantine, self.args.error_budget, self.args.buffer_size,
+                                                      resume_at=resume_at)
+        try:
+            if self.args.delta:
+                self.__run_delta(run_metrics)
+            elif run_checkpoint is not None:
+                self.__run_checkpointed(run_metrics, run_checkpoint)
+            elif self.stream:
+                self.__run_stream(run_metrics)
+            else:
+                self.__run_batch(run_metrics)
+        finally:
+            if self.__subnet_cache is not None:
+                self.__subnet_cache.close()
+            if self.__quarantine is not None:
+                self.__quarantine.close()
+                run_metrics.count('quarantined', self.__quarantine.num_lines)
+        if self.args.metrics:
+            run_metrics.write_json(self.args.metrics)
+
+    def __run_batch(self, run_metrics):
         # Use the Parser to parse & store input data, and validate IPv4 format
-        input_parser = dataparser.Parser(self.input_file)
+        with run_metrics.stage('parse'):
+            input_parser = dataparser.Parser(self.input_file, compact=self.compact, vectorized=self.vectorized,
+                                             use_mmap=self.args.mmap, buffer_size=self.args.buffer_size,
+                                             workers=self.workers, quarantine=self.__quarantine, progress=self.__progress)
         
         # Validate the parsed data, format it, and coalesce IP's if possible
-        data_coalescer = coalescence.Coalescer(input_parser.parsed_data)
+        with run_metrics.stage('coalesce'):
+            data_coalescer = coalescence.Coalescer(input_parser.parsed_data, workers=self.workers, memo_size=self.memo_size,
+                                                   subnet_cache=self.__subnet_cache, mode=self.args.mode, engine=self.args.engine,
+                                                   progress=self.__progress)
 
         # Write the coalesced data to the output file
-        filewriter = FileWriter(self.output_file, data_coalescer.datatable)
-        filewriter.write_file()
+        with run_metrics.stage('write'):
+            filewriter = FileWriter(self.output_file, data_coalescer.datatable, stdout=self.__stdout,
+                                    buffer_size=self.args.buffer_size)
+            filewriter.write_file()
+        print(f"...Coalesced data successfully written to output file.")
+        self.__count_run(run_metrics, input_parser, data_coalescer.counters, filewriter)
+
+        if self.args.cross_check:
+            with run_metrics.stage('cross_check'):
+                cross_check = self.__cross_check()
+                cross_check.check(cross_check.sample(input_parser.parsed_data))
+            self.__count_cross_check(run_metrics, cross_check)
+        if self.args.index:
+            with run_metrics.stage('index'):
+                self.__save_index(run_metrics, index.IPIndex(data_coalescer.datatable))
+        if self.args.binary:
+            with run_metrics.stage('binary'):
+                record_writer = records.RecordWriter.write(self.args.binary, data_coalescer.datatable, self.args.buffer_size)
+            run_metrics.count('binary_records', record_writer.num_records)
+
+    # Streaming pipeline: each row flows through the generator stages (read -> parse -> coalesce -> write)
+    # one line at a time, so peak memory stays flat regardless of the input file size.
+    # (the stages are interleaved, so they are timed as a single 'pipeline' stage)
+    def __run_stream(self, run_metrics):
+        with run_metrics.stage('pipeline'):
+            input_parser = dataparser.Parser(self.input_file, stream=True, use_mmap=self.args.mmap,
+                                             buffer_size=self.args.buffer_size, quarantine=self.__quarantine,
+                                             progress=self.__progress)
+            # (the cross-check sample is taken from the parsed rows as they pass, and checked after the run)
+            parsed_rows = input_parser.rows()
+            cross_check = None
+            if self.args.cross_check:
+                cross_check = self.__cross_check()
+                parsed_rows = cross_check.add_rows(parsed_rows)
+            data_coalescer = coalescence.Coalescer(parsed_rows, stream=True, memo_size=self.memo_size,
+                                                   subnet_cache=self.__subnet_cache, mode=self.args.mode, engine=self.args.engine)
+            rows = data_coalescer.rows()
+            # the index & binary records (if any) are built from the rows on their way to the writer
+            ip_index = record_writer = None
+            if self.args.index:
+                ip_index = index.IPIndex()
+                rows = ip_index.add_rows(rows)
+            if self.args.binary:
+                record_writer = records.RecordWriter(self.args.binary, self.args.buffer_size)
+                rows = record_writer.add_rows(rows)
+            filewriter = FileWriter(self.output_file, rows, stream=True, stdout=self.__stdout,
+                                    buffer_size=self.args.buffer_size)
+            filewriter.write_file()
+        print(f"...Coalesced data successfully written to output file.")
+        self.__count_run(run_metrics, input_parser, data_coalescer.counters, filewriter)
+        if cross_check is not None:
+            with run_metrics.stage('cross_check'):
+                cross_check.check(cross_check.sampled_rows)
+            self.__count_cross_check(run_metrics, cross_check)
+        if ip_index is not None:
+            self.__save_index(run_metrics, ip_index)
+        if record_writer is not None:
+            record_writer.close()
+            run_metrics.count('binary_records', record_writer.num_records)
+
+    # Checkpointed pipeline: the rows are written to a part file and a checkpoint is saved every --checkpoint
+    # seconds (see checkpoint.py); --resume continues from the last one. A streaming run skips the input lines
+    # consumed before the checkpoint; a batch run parses the whole input again (the sorted table is the same)
+    # and skips the rows already written, coalescing the rest a chunk at a time.
+    def __run_checkpointed(self, run_metrics, run_checkpoint):
+        rows_resumed = run_checkpoint.rows_done
+        cross_check = None
+        if self.stream:
+            input_parser = dataparser.Parser(self.input_file, stream=True, use_mmap=self.args.mmap,
+                                             buffer_size=self.args.buffer_size, quarantine=self.__quarantine,
+                                             progress=self.__progress)
+            parsed_rows = input_parser.rows(start_line=run_checkpoint.position.get('lines', 0))
+            if self.args.cross_check:
+                cross_check = self.__cross_check()
+                parsed_rows = cross_check.add_rows(parsed_rows)
+            data_coalescer = coalescence.Coalescer(parsed_rows, stream=True, memo_size=self.memo_size,
+                                                   subnet_cache=self.__subnet_cache, mode=self.args.mode, engine=self.args.engine)
+            rows = run_checkpoint.track(data_coalescer.rows(), lambda: self.__stream_position(input_parser))
+        else:
+            with run_metrics.stage('parse'):
+                input_parser = dataparser.Parser(self.input_file, compact=self.compact, vectorized=self.vectorized,
+                                                 use_mmap=self.args.mmap, buffer_size=self.args.buffer_size,
+                                                 workers=self.workers, quarantine=self.__quarantine, progress=self.__progress)
+            counters = dict()
+            rows = run_checkpoint.track(self.__coalesce_chunks(input_parser.parsed_data, rows_resumed, counters))
+
+        # (the stages are interleaved, so they are timed as a single 'pipeline' stage)
+        with run_metrics.stage('pipeline'):
+            filewriter = FileWriter(self.output_file, rows, stream=True, buffer_size=self.args.buffer_size,
+                                    checkpoint=run_checkpoint)
+            filewriter.write_file()
+        print(f"...Coalesced data successfully written to output file.")
+        if self.stream:
+            counters = data_coalescer.counters
+        self.__count_run(run_metrics, input_parser, counters, filewriter)
+        run_metrics.count('checkpoints', run_checkpoint.num_saves)
+        run_metrics.count('rows_resumed', rows_resumed)
+
+        if self.args.cross_check:
+            with run_metrics.stage('cross_check'):
+                if cross_check is None:
+                    cross_check = self.__cross_check()
+                    cross_check.check(cross_check.sample(input_parser.parsed_data))
+                else:
+                    cross_check.check(cross_check.sampled_rows)
+            self.__count_cross_check(run_metrics, cross_check)
+
+        # (the rows written before the checkpoint came from the previous run, so the index & binary records are
+        # built from the whole output file)
+        if self.args.index:
+            with run_metrics.stage('index'):
+                self.__save_index(run_metrics, index.IPIndex.from_csv(self.output_file))
+        if self.args.binary:
+            with run_metrics.stage('binary'):
+                record_writer = records.RecordWriter.from_csv(self.args.binary, self.output_file, self.args.buffer_size)
+            run_metrics.count('binary_records', record_writer.num_records)
+
+    # input position of a checkpointed stream: the # of input lines consumed & the quarantine's state
+    def __stream_position(self, input_parser) -> dict:
+        position = {'lines': input_parser.lines_read}
+        if self.__quarantine is not None:
+            position['quarantine'] = self.__quarantine.position()
+        return position
+
+    # Generator to coalesce the sorted parsed data from row 'start' on, checkpoint.CHUNK_ROWS rows at a time,
+    # adding up the counters of each chunk in 'counters'
+    def __coalesce_chunks(self, parsed_data, start: int, counters: dict):
+        for chunk_start in range(start, len(parsed_data), checkpoint.CHUNK_ROWS):
+            data_coalescer = coalescence.Coalescer(parsed_data[chunk_start:chunk_start + checkpoint.CHUNK_ROWS],
+                                                   workers=self.workers, memo_size=self.memo_size,
+                                                   subnet_cache=self.__subnet_cache, mode=self.args.mode, engine=self.args.engine)
+            for name, value in data_coalescer.counters.items():
+                counters[name] = counters.get(name, 0) + value
+            yield from data_coalescer.datatable
+
+    # Delta pipeline: only new or changed ids are parsed & coalesced; unchanged rows are copied from
+    # the previous output file
+    def __run_delta(self, run_metrics):
+        with run_metrics.stage('delta'):
+            delta_run = delta.DeltaRun(self.input_file, self.output_file, workers=self.workers, memo_size=self.memo_size,
+                                       subnet_cache=self.__subnet_cache, mode=self.args.mode, engine=self.args.engine,
+                                       buffer_size=self.args.buffer_size)
+            delta_run.run()
         print(f"...Coalesced data successfully written to output file.")
+        run_metrics.count('lines', delta_run.num_lines)
+        run_metrics.count('ids', delta_run.num_ids)
+        run_metrics.count('ids_changed', delta_run.num_changed)
+        run_metrics.count('ids_removed', delta_run.num_removed)
+        for name, value in delta_run.coalescer.counters.items():
+            run_metrics.count(name, value)
+        run_metrics.count('output_bytes', delta_run.bytes_written)
+
+        # (only the changed ids were parsed, so they are the lines sampled)
+        if self.args.cross_check:
+            with run_metrics.stage('cross_check'):
+                cross_check = self.__cross_check()
+                cross_check.check(cross_check.sample(delta_run.coalescer.parsed_data))
+            self.__count_cross_check(run_metrics, cross_check)
+
+        # (only the changed rows were coalesced, so the index & binary records are built from the whole output file)
+        if self.args.index:
+            with run_metrics.stage('index'):
+                self.__save_index(run_metrics, index.IPIndex.from_csv(self.output_file))
+        if self.args.binary:
+            with run_metrics.stage('binary'):
+                record_writer = records.RecordWriter.from_csv(self.args.binary, self.output_file, self.args.buffer_size)
+            run_metrics.count('binary_records', record_writer.num_records)
+
+    def __cross_check(self):
+        return crosscheck.CrossCheck(self.args.engine, self.args.cross_check, self.args.mode)
+
+    @staticmethod
+    def __count_cross_check(run_metrics, cross_check):
+        run_metrics.count('cross_check_lines', cross_check.num_rows)
+        run_metrics.count('cross_check_mismatches', len(cross_check.mismatches))
+        run_metrics.count('cross_check_engine_ms', round(cross_check.engine_seconds * 1000))
+        run_metrics.count('cross_check_reference_ms', round(cross_check.reference_seconds * 1000))
+
+    def __save_index(self, run_metrics, ip_index):
+        ip_index.save(self.args.index)
+        run_metrics.count('index_prefixes', ip_index.num_prefixes)
+
+    # record the run counters of each stage
+    @staticmethod
+    def __count_run(run_metrics, input_parser, counters: dict, filewriter):
+        run_metrics.count('lines', input_parser.num_lines)
+        run_metrics.count('subnets_parsed', input_parser.num_subnets)
+        run_metrics.count('invalid_subnets', input_parser.num_invalid_subnets)
+        for name, value in counters.items():
+            run_metrics.count(name, value)
+        run_metrics.count('output_bytes', filewriter.bytes_written)
 
 
 # ---------------------------------------------
@@ -97,4 +508,7 @@ class Main:
 if __name__ == "__main__":
     argv = sys.argv[1:]
     main = Main(argv)
-    main.run()
\ No newline at end of file
+    try:
+        main.run()
+    except quarantine.ErrorBudgetExceeded as err:
+        sys.exit(f"...Aborted: {err}")
\ No newline at end of file
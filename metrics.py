@@ -0,0 +1,97 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+from contextlib import contextmanager
+# local modules
+import common
+
+
+#######################
+##  Instrumentation  ##
+#######################
+
+# number of functions listed in each stage's profile summary
+PROFILE_TOP_FUNCTIONS = 30
+
+# ---------------------------------------------
+## Class for recording per-stage timings & run counters, emitted as a JSON metrics file.
+## If a profile directory is given, each stage is also run under cProfile and its stats are dumped there
+## ('<stage>.prof' for pstats/snakeviz, plus '<stage>.txt' with the top functions by cumulative time).
+class Metrics:
+
+    def __init__(self, profile_dir=None):
+        self.__profile_dir = profile_dir
+        self.__stages = dict()
+        self.__counters = dict()
+        if profile_dir is not None:
+            common.make_dir_if_needed(profile_dir)
+
+    @property
+    def profile_dir(self):
+        return self.__profile_dir
+
+    @property
+    def stages(self):
+        return self.__stages
+
+    @property
+    def counters(self):
+        return self.__counters
+
+    # context manager to time a stage (wall & cpu time), profiling it if requested
+    @contextmanager
+    def stage(self, name: str):
+        profiler = cProfile.Profile() if self.profile_dir is not None else None
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.__stages[name] = {
+                'wall_seconds': round(time.perf_counter() - wall_start, 6),
+                'cpu_seconds': round(time.process_time() - cpu_start, 6),
+            }
+            if profiler is not None:
+                self.__dump_profile(name, profiler)
+
+    # set (or add to) a counter
+    def count(self, name: str, value: int):
+        self.__counters[name] = self.__counters.get(name, 0) + value
+
+    # write the stage's profile stats
+    def __dump_profile(self, name: str, profiler):
+        prof_path = os.path.join(self.profile_dir, f"{name}.prof")
+        profiler.dump_stats(prof_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        with open(os.path.join(self.profile_dir, f"{name}.txt"), 'w') as f:
+            f.write(summary.getvalue())
+        print(f"...Profile for stage '{name}' written to '{prof_path}'")
+
+    # get all metrics as a dict (lines/sec is derived from the 'lines' counter & total wall time)
+    def to_dict(self) -> dict:
+        total_wall = sum(stage['wall_seconds'] for stage in self.stages.values())
+        metrics = {
+            'stages': self.stages,
+            'total_wall_seconds': round(total_wall, 6),
+            'total_cpu_seconds': round(sum(stage['cpu_seconds'] for stage in self.stages.values()), 6),
+        }
+        metrics.update(self.counters)
+        if 'lines' in self.counters and total_wall > 0:
+            metrics['lines_per_sec'] = round(self.counters['lines'] / total_wall, 1)
+        return metrics
+
+    # write the metrics JSON file
+    def write_json(self, filepath: str):
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"...Metrics written to '{filepath}'")
+
+
+# ---------------------------------------------
@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import time
+import resource
+# local modules
+from common import ConstructionError as ctor
+
+
+################
+##  Progress  ##
+################
+
+# report formats: human-readable lines, or one JSON object per line (for schedulers to scrape)
+FORMAT_TEXT = 'text'
+FORMAT_JSON = 'json'
+FORMATS = (FORMAT_TEXT, FORMAT_JSON)
+
+# default # of seconds between reports
+PROGRESS_INTERVAL = 1.0
+
+# # of lines (or rows) between the callers' calls to update(), so that the clock is only read once per batch
+# of lines and reporting costs next to nothing per line
+PROGRESS_EVERY = 4096
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+MIB = 1024 * 1024
+
+# function to get the current resident set size in bytes
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # (no /proc: the peak RSS instead; ru_maxrss is in KB on Linux & in bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+# function to format a # of seconds as h:mm:ss
+def format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+# ---------------------------------------------
+## Class for reporting the progress of a long run to stderr, at most once every 'interval' seconds.
+## A run goes through phases (e.g. 'parse', then 'coalesce'); each one is started with its total -- the
+## input file's size in bytes, or a # of rows -- and the callers update it with the # of lines done (and
+## bytes read) every PROGRESS_EVERY lines. A report holds the lines done, bytes read, lines/sec, the ETA of
+## the phase and the current RSS; the last report of each phase is always written.
+class Progress:
+
+    def __init__(self, report_format=FORMAT_TEXT, interval=PROGRESS_INTERVAL, output=None):
+        if report_format not in FORMATS:
+            raise ctor(f"Failed to construct Progress obj (format must be one of {FORMATS})")
+        if interval < 0:
+            raise ctor("Failed to construct Progress obj (interval must be >= 0)")
+        self.__format = report_format
+        self.__interval = interval
+        # (resolved when reporting, so that a redirected sys.stderr is used)
+        self.__output = output
+        self.__phase = None
+        self.__unit = 'lines'
+        self.__total = None
+        self.__total_bytes = None
+        self.__start = 0.0
+        self.__next_report = 0.0
+        self.__num_reports = 0
+
+    @property
+    def format(self):
+        return self.__format
+
+    @property
+    def interval(self):
+        return self.__interval
+
+    @property
+    def phase(self):
+        return self.__phase
+
+    @property
+    def num_reports(self):
+        return self.__num_reports
+
+    # start a phase: its progress is measured in bytes read out of 'total_bytes' (if known), else in
+    # 'unit's done out of 'total' (if known; without either, there is no ETA)
+    def start(self, phase: str, unit='lines', total=None, total_bytes=None):
+        self.__phase = phase
+        self.__unit = unit
+        self.__total = total
+        self.__total_bytes = total_bytes
+        self.__start = time.monotonic()
+        self.__next_report = self.__start + self.interval
+
+    # report the progress if the last report is older than 'interval'
+    def update(self, count: int, bytes_read=None):
+        now = time.monotonic()
+        if now >= self.__next_report:
+            self.report(count, bytes_read, now)
+
+    # report the end of the phase
+    def finish(self, count: int, bytes_read=None):
+        self.report(count, bytes_read, final=True)
+
+    def report(self, count: int, bytes_read=None, now=None, final=False):
+        now = time.monotonic() if now is None else now
+        self.__next_report = now + self.interval
+        self.__num_reports += 1
+        elapsed = now - self.__start
+        rate = count / elapsed if elapsed > 0 else 0.0
+        fraction = None
+        if self.__total_bytes and bytes_read is not None:
+            fraction = min(1.0, bytes_read / self.__total_bytes)
+        elif self.__total:
+            fraction = min(1.0, count / self.__total)
+        eta = elapsed * (1 - fraction) / fraction if fraction else None
+        if final:
+            eta = 0.0
+        output = self.__output if self.__output is not None else sys.stderr
+        if self.format == FORMAT_JSON:
+            report = {'event': 'progress', 'phase': self.phase, 'elapsed_seconds': round(elapsed, 3), self.__unit: count,
+                      'total': self.__total, 'bytes': bytes_read, 'total_bytes': self.__total_bytes,
+                      f'{self.__unit}_per_sec': round(rate, 1),
+                      'percent': round(100 * fraction, 2) if fraction is not None else None,
+                      'eta_seconds': round(eta, 1) if eta is not None else None, 'rss_bytes': current_rss(), 'final': final}
+            output.write(json.dumps(report) + '\n')
+        else:
+            output.write(self.__text_report(count, bytes_read, rate, fraction, eta) + '\n')
+        output.flush()
+
+    def __text_report(self, count, bytes_read, rate, fraction, eta) -> str:
+        parts = [f"{count} {self.__unit}" + (f" of {self.__total}" if self.__total else "")]
+        if bytes_read is not None:
+            parts.append(f"{bytes_read / MIB:.1f}" + (f" of {self.__total_bytes / MIB:.1f}" if self.__total_bytes else "") + " MiB")
+        if fraction is not None:
+            parts[-1] += f" ({100 * fraction:.1f}%)"
+        parts.append(f"{rate:.0f} {self.__unit}/s")
+        if eta is not None:
+            parts.append(f"ETA {format_seconds(eta)}")
+        parts.append(f"RSS {current_rss() / MIB:.1f} MiB")
+        return f"...Progress [{self.phase}]: " + ', '.join(parts)
+
+
+# ---------------------------------------------
@@ -0,0 +1,102 @@
+import csv
+import os
+# local modules
+import common
+from common import ConstructionError as ctor
+
+
+##################
+##  Quarantine  ##
+##################
+
+# header row of the quarantine file
+QUARANTINE_HEADER = ['line', 'reason', 'text']
+
+# ---------------------------------------------
+## Exception raised when more lines were quarantined than the error budget allows
+class ErrorBudgetExceeded(RuntimeError):
+
+    def __init__(self, num_lines: int, error_budget: int, filepath: str):
+        super().__init__(f"{num_lines} malformed lines exceed the error budget of {error_budget} (see '{filepath}')")
+        self.num_lines = num_lines
+        self.error_budget = error_budget
+
+# ---------------------------------------------
+## Class for setting malformed input lines aside instead of aborting the run.
+## Each line the parser can't split into an id & 'addr/mask' tokens is written to a CSV file as
+## (line #, reason, text) and skipped; the run only aborts once more lines than the error budget
+## (if any) have been quarantined.
+## A run resumed from a checkpoint passes the quarantine's state at the checkpoint (see position()) as
+## 'resume_at': the (uncompressed) file is truncated back to it & appended to.
+class Quarantine:
+
+    def __init__(self, filepath: str, error_budget=None, buffer_size=common.IO_BUFFER_SIZE, resume_at=None):
+        # check ctor arg type
+        ctor.check_arg_type("Failed to construct Quarantine obj (arg must be type 'str')", filepath, str)
+        if error_budget is not None and error_budget < 0:
+            raise ctor("Failed to construct Quarantine obj (error budget must be >= 0)")
+        self.__filepath = filepath
+        self.__error_budget = error_budget
+        dir_path = os.path.dirname(filepath)
+        if dir_path:
+            common.make_dir_if_needed(dir_path)
+        if resume_at is not None:
+            num_bytes, self.__num_lines = resume_at
+            os.truncate(filepath, num_bytes)
+            self.__file = open(filepath, 'a', newline='', buffering=buffer_size)
+            self.__writer = csv.writer(self.__file)
+            return
+        self.__file = common.open_output(filepath, buffer_size)
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(QUARANTINE_HEADER)
+        self.__num_lines = 0
+
+    @property
+    def filepath(self):
+        return self.__filepath
+
+    @property
+    def error_budget(self):
+        return self.__error_budget
+
+    @property
+    def num_lines(self):
+        return self.__num_lines
+
+    # quarantine one line that failed to parse with 'err'
+    def add(self, line_number: int, line: str, err: Exception):
+        self.__writer.writerow([line_number, malformed_reason(line, err), line])
+        self.__num_lines += 1
+        if self.error_budget is not None and self.num_lines > self.error_budget:
+            raise ErrorBudgetExceeded(self.num_lines, self.error_budget, self.filepath)
+
+    # flush the file (e.g. for a checkpoint)
+    #   returns tuple: (file size in bytes, # of lines quarantined) -- the 'resume_at' of a resumed run
+    def position(self) -> tuple:
+        self.__file.flush()
+        return (os.fstat(self.__file.fileno()).st_size, self.num_lines)
+
+    def close(self):
+        self.__file.close()
+        if self.num_lines:
+            print(f"...Quarantined {self.num_lines} malformed lines to '{self.filepath}'")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ---------------------------------------------
+# function to describe why a line couldn't be parsed
+def malformed_reason(line: str, err: Exception) -> str:
+    if ':' not in line:
+        return "no ':' after the id"
+    for subnet in line.split(':')[1].split(','):
+        if subnet.count('/') > 1:
+            return f"malformed subnet '{subnet}'"
+    return f"{type(err).__name__}: {err}"
+
+
+# ---------------------------------------------
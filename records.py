@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import csv
+import mmap
+import struct
+from array import array
+# local modules
+import common
+from common import ConstructionError as ctor
+
+
+##########################
+##  Binary Record File  ##
+##########################
+
+# ---------------------------------------------
+# A packed binary copy of the output, for downstream jobs that want integers instead of CSV strings.
+# Layout (native byte order, recorded in the header; every field is a uint32):
+#   header:   MAGIC, version, byte order (1 = little), # of records, # of strings, # of string bytes
+#   records:  (id string #, kind, addr/start, mask, end) per subnet entry, in output order
+#   strings:  # of strings + 1 offsets into the string bytes, then the UTF-8 string bytes
+# Strings are the ids, plus the text of KIND_INVALID_TEXT entries (their string # is in the 'addr' field).
+
+MAGIC = b'COALBIN\0'
+RECORDS_VERSION = 1
+HEADER = struct.Struct('=8s5I')
+FIELDS_PER_RECORD = 5
+
+# entry kinds
+KIND_PREFIX = 0         # addr/mask (as written: the address may have host bits), end = broadcast ip
+KIND_RANGE = 1          # addr = first address, end = last address (mask = 0)
+KIND_INVALID = 2        # valid IPv4 address with an invalid mask value (end = 0)
+KIND_ANY = 3            # 0.0.0.0/0
+KIND_INVALID_TEXT = 4   # not IPv4 format; 'addr' = string # of the original text
+
+# uint32 arrays must be 4 bytes per item for the file layout (& for memoryview.cast('I'))
+assert array('I').itemsize == 4
+
+# function to parse one formatted subnet token back to integers
+# ('Any', 'a.b.c.d', 'a.b.c.d/cidr', 'a.b.c.d/m.m.m.m', or a range 'a.b.c.d-...-w.x.y.z[/cidr]' as written by the Coalescer)
+#   returns tuple: (kind, addr, mask, end), or (KIND_INVALID_TEXT, token) if it isn't IPv4 format
+def parse_token(token: str) -> tuple:
+    if token == 'Any':
+        return (KIND_ANY, 0, 0, 0xFFFFFFFF)
+    first, _, last = token.partition('-')
+    parsed = _parse_subnet(first)
+    if parsed is None:
+        return (KIND_INVALID_TEXT, token)
+    if not last:
+        return parsed
+    # a range ends at its last sub (or at the broadcast ip of its last network)
+    end = _parse_subnet(last.rpartition('-')[2])
+    if end is None or end[0] != KIND_PREFIX:
+        return (KIND_INVALID_TEXT, token)
+    return (KIND_RANGE, parsed[1], 0, end[3])
+
+# function to convert a dotted-quad written by the Coalescer (canonical octets) to an integer; other
+# strings go through common.ipv4_to_int() (its LRU cache is too small for a whole file of distinct addresses)
+def _ipv4_to_int(ipv4: str):
+    try:
+        a, b, c, d = map(common.STR_OCTET.__getitem__, ipv4.split('.'))
+    except (KeyError, ValueError):
+        return common.ipv4_to_int(ipv4)
+    return a << 24 | b << 16 | c << 8 | d
+
+# returns tuple: (KIND_PREFIX or KIND_INVALID, addr, mask, end), or None if it isn't IPv4 format
+def _parse_subnet(subnet: str):
+    addr, _, mask = subnet.partition('/')
+    addr = _ipv4_to_int(addr)
+    if not isinstance(addr, int):
+        return None
+    if not mask:
+        return (KIND_PREFIX, addr, 0xFFFFFFFF, addr)
+    if mask.isdecimal():
+        if int(mask) > 32:
+            return None
+        mask = common.CIDR_TO_MASK[int(mask)]
+    else:
+        mask = _ipv4_to_int(mask)
+        if not isinstance(mask, int):
+            return None
+        if mask not in common.MASK_TO_CIDR:
+            return (KIND_INVALID, addr, mask, 0)
+    return (KIND_PREFIX, addr, mask, (addr & mask) | (~mask & 0xFFFFFFFF))
+
+# ---------------------------------------------
+## Class for writing a record file from formatted rows ([id, formatted subnets]).
+## Records are written as they come (nothing but the string table is held in memory); the string
+## table & the final counts are written by close().
+class RecordWriter:
+
+    def __init__(self, filepath: str, buffer_size=common.IO_BUFFER_SIZE):
+        # check ctor arg type
+        ctor.check_arg_type("Failed to construct RecordWriter obj (arg must be type 'str')", filepath, str)
+        self.__filepath = filepath
+        dir_path = os.path.dirname(filepath)
+        if dir_path:
+            common.make_dir_if_needed(dir_path)
+        self.__file = open(filepath, 'wb', buffering=buffer_size)
+        # (the header is rewritten with the counts on close)
+        self.__file.write(HEADER.pack(MAGIC, RECORDS_VERSION, 0, 0, 0, 0))
+        self.__strings = dict()
+        self.__num_records = 0
+
+    @property
+    def filepath(self):
+        return self.__filepath
+
+    @property
+    def num_records(self):
+        return self.__num_records
+
+    # get the string # of a string (added to the string table if it's new)
+    def __string_num(self, string: str) -> int:
+        num = self.__strings.get(string)
+        if num is None:
+            num = self.__strings[string] = len(self.__strings)
+        return num
+
+    # write the records of one formatted row
+    def add(self, row):
+        # (a line with no subnets, e.g. '5:', is written as an empty row, which has no records)
+        if not row:
+            return
+        id_num = self.__string_num(row[0])
+        fields = array('I')
+        for token in row[1].split(';'):
+            parsed = parse_token(token)
+            if parsed[0] == KIND_INVALID_TEXT:
+                fields.extend((id_num, KIND_INVALID_TEXT, self.__string_num(token), 0, 0))
+            else:
+                fields.append(id_num)
+                fields.extend(parsed)
+        self.__file.write(fields)
+        self.__num_records += len(fields) // FIELDS_PER_RECORD
+
+    # Generator to write rows as they pass through (e.g. on their way to the FileWriter in streaming mode)
+    def add_rows(self, rows):
+        for row in rows:
+            self.add(row)
+            yield row
+
+    # write the string table & the header, and close the file
+    def close(self):
+        encoded = [string.encode() for string in self.__strings]
+        offsets = array('I', [0])
+        for string_bytes in encoded:
+            offsets.append(offsets[-1] + len(string_bytes))
+        self.__file.write(offsets)
+        self.__file.write(b''.join(encoded))
+        self.__file.seek(0)
+        self.__file.write(HEADER.pack(MAGIC, RECORDS_VERSION, sys.byteorder == 'little', self.num_records,
+                                      len(encoded), offsets[-1]))
+        self.__file.close()
+        print(f"...Wrote {self.num_records} binary records to '{self.filepath}'")
+
+    # write a whole datatable (or any iterable of rows)
+    @classmethod
+    def write(cls, filepath: str, rows, buffer_size=common.IO_BUFFER_SIZE):
+        record_writer = cls(filepath, buffer_size)
+        for row in rows:
+            record_writer.add(row)
+        record_writer.close()
+        return record_writer
+
+    # write the records of an existing (possibly compressed) output file
+    @classmethod
+    def from_csv(cls, filepath: str, csv_file: str, buffer_size=common.IO_BUFFER_SIZE):
+        common.check_path_exists(csv_file)
+        with common.open_input(csv_file, buffer_size) as f:
+            return cls.write(filepath, csv.reader(f), buffer_size)
+
+# ---------------------------------------------
+## Class for reading a record file by memory-mapping it: 'records' is a flat uint32 memoryview of the
+## record fields (no copies; record i is records[5*i : 5*i + 5]), and strings are decoded on access.
+class RecordFile:
+
+    def __init__(self, filepath: str):
+        # check ctor arg type & that the file exists
+        ctor.check_arg_type("Failed to construct RecordFile obj (arg must be type 'str')", filepath, str)
+        common.check_path_exists(filepath)
+        self.__filepath = filepath
+        with open(filepath, 'rb') as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, little, num_records, num_strings, num_bytes = HEADER.unpack_from(self.__mmap)
+        if magic != MAGIC or version != RECORDS_VERSION:
+            self.__mmap.close()
+            raise ValueError(f"'{filepath}' is not a version {RECORDS_VERSION} record file.")
+        if bool(little) != (sys.byteorder == 'little'):
+            self.__mmap.close()
+            raise ValueError(f"'{filepath}' was written with another byte order.")
+        view = memoryview(self.__mmap)
+        start = HEADER.size
+        end = start + 4 * FIELDS_PER_RECORD * num_records
+        self.__records = view[start:end].cast('I')
+        start, end = end, end + 4 * (num_strings + 1)
+        self.__offsets = view[start:end].cast('I')
+        self.__string_bytes = view[end:end + num_bytes]
+        self.__view = view
+        self.__num_records = num_records
+
+    @property
+    def filepath(self):
+        return self.__filepath
+
+    @property
+    def records(self):
+        return self.__records
+
+    def __len__(self) -> int:
+        return self.__num_records
+
+    # get a string from the string table (an id, or the text of an invalid entry)
+    def string(self, num: int) -> str:
+        return str(self.__string_bytes[self.__offsets[num]:self.__offsets[num + 1]], 'utf-8')
+
+    # get one record
+    #   returns tuple: (id, kind, addr, mask, end)
+    def record(self, idx: int) -> tuple:
+        id_num, kind, addr, mask, end = self.__records[FIELDS_PER_RECORD * idx:FIELDS_PER_RECORD * (idx + 1)]
+        return (self.string(id_num), kind, addr, mask, end)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.record(idx)
+
+    # release the views & unmap the file
+    def close(self):
+        for view in (self.__records, self.__offsets, self.__string_bytes, self.__view):
+            view.release()
+        self.__mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ---------------------------------------------
+##################
+##  Entrypoint  ##
+##################
+# print a record file as 'id,kind,addr,mask,end' lines (for inspection)
+if __name__ == "__main__":
+    with RecordFile(sys.argv[1]) as record_file:
+        for id, kind, addr, mask, end in record_file:
+            if kind == KIND_INVALID_TEXT:
+                print(f"{id},{kind},{record_file.string(addr)},,")
+            else:
+                print(f"{id},{kind},{common.int_to_ipv4(addr)},{common.int_to_ipv4(mask)},{common.int_to_ipv4(end)}")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import sys
+import io
+import csv
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+# local modules
+import dataparser
+import coalescence
+import engines
+import cache
+
+
+##########################
+##  Coalescing Service  ##
+##########################
+
+# max # of requests formatted together in one batch
+BATCH_SIZE = 256
+
+# seconds the first request of a batch waits for concurrent requests to join it; with 0, a batch is
+# whatever queued up while the previous batch was formatted (no added latency for a lone request)
+BATCH_WAIT = 0.0
+
+# # of most recent request latencies kept for the latency percentiles
+LATENCY_WINDOW = 10000
+
+# a request line with this command (instead of an 'id:subnets' line) is answered with a JSON line of stats
+STATS_COMMAND = 'STATS'
+
+# function to get the 'pct' percentile (0 -> 100) of a list of values (nearest-rank)
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+# function to format a row like the output file does (a csv row, without the line break)
+def format_reply(formatted_entry: list) -> str:
+    reply = io.StringIO()
+    csv.writer(reply, lineterminator='').writerow(formatted_entry)
+    return reply.getvalue()
+
+# function to format the reply to a request that failed
+def format_error(err: Exception) -> str:
+    return f"ERROR {type(err).__name__}: {err}"
+
+# ---------------------------------------------
+## Class for a long-running coalescing service.
+## Clients send 'id:addr/mask,...' lines over a local TCP or Unix socket and get one reply line per request:
+## the formatted row, exactly as the batch CLI writes it to the output file (or 'ERROR <message>').
+## Concurrent requests (from all connections) are queued & formatted in micro-batches by one long-lived
+## Coalescer, so its memo (and the persistent cache, if any) stays warm between requests.
+class CoalescingService:
+
+    def __init__(self, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT, memo_size=coalescence.MEMO_SIZE, subnet_cache=None,
+                 mode=coalescence.MODE_COALESCE, engine=engines.REFERENCE):
+        self.__batch_size = batch_size
+        self.__batch_wait = batch_wait
+        self.__subnet_cache = subnet_cache
+        # the Coalescer formats the requests one row at a time (no data of its own)
+        self.__coalescer = coalescence.Coalescer((), stream=True, memo_size=memo_size, subnet_cache=subnet_cache, mode=mode,
+                                                 engine=engine)
+        self.__queue = None
+        self.__batcher_task = None
+        self.__server = None
+        self.__clients = set()
+        # stats
+        self.__latencies = deque(maxlen=LATENCY_WINDOW)
+        self.__num_requests = 0
+        self.__num_batches = 0
+        self.__num_errors = 0
+
+    @property
+    def batch_size(self):
+        return self.__batch_size
+
+    @property
+    def batch_wait(self):
+        return self.__batch_wait
+
+    @property
+    def coalescer(self):
+        return self.__coalescer
+
+    @property
+    def server(self):
+        return self.__server
+
+    @property
+    def queue_depth(self) -> int:
+        return self.__queue.qsize() if self.__queue is not None else 0
+
+    @property
+    def num_requests(self):
+        return self.__num_requests
+
+    @property
+    def num_batches(self):
+        return self.__num_batches
+
+    # get the service stats as a dict (latencies in milliseconds, over the last LATENCY_WINDOW requests)
+    @property
+    def stats(self) -> dict:
+        latencies = list(self.__latencies)
+        stats = {
+            'queue_depth': self.queue_depth,
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'errors': self.__num_errors,
+            'mean_batch_size': round(self.num_requests / self.num_batches, 2) if self.num_batches else 0.0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+        stats.update(self.coalescer.counters)
+        return stats
+
+    # format a batch of request lines
+    #   returns list: reply line for each request
+    def __format_batch(self, lines: list) -> list:
+        replies = list()
+        for line in lines:
+            try:
+                replies.append(format_reply(self.coalescer.format_row(dataparser.parse_line(line))))
+            except Exception as err:
+                self.__num_errors += 1
+                replies.append(format_error(err))
+        if self.__subnet_cache is not None:
+            self.__subnet_cache.flush()
+        return replies
+
+    # Coroutine to take the queued requests in batches, format them & resolve their futures
+    async def __batcher(self):
+        while True:
+            batch = [await self.__queue.get()]
+            # give concurrent requests a moment to join the batch
+            if self.batch_wait and self.__queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.batch_wait)
+            while len(batch) < self.batch_size and not self.__queue.empty():
+                batch.append(self.__queue.get_nowait())
+            replies = self.__format_batch([line for line, _, _ in batch])
+            done = time.perf_counter()
+            for (_, future, start), reply in zip(batch, replies):
+                self.__latencies.append(done - start)
+                if not future.done():
+                    future.set_result(reply)
+            self.__num_requests += len(batch)
+            self.__num_batches += 1
+
+    # coalesce a single 'id:subnets' line (queued with the concurrent requests)
+    #   returns str: the reply line
+    async def coalesce(self, line: str) -> str:
+        if self.__queue is None:
+            self.__start_batcher()
+        future = asyncio.get_running_loop().create_future()
+        await self.__queue.put((line.rstrip(), future, time.perf_counter()))
+        return await future
+
+    def __start_batcher(self):
+        self.__queue = asyncio.Queue()
+        self.__batcher_task = asyncio.create_task(self.__batcher())
+
+    # Coroutine to serve one client connection; requests are pipelined, replies are written in request order
+    async def __handle_client(self, reader, writer):
+        replies = asyncio.Queue()
+
+        async def write_replies():
+            while True:
+                reply = await replies.get()
+                if reply is None:
+                    break
+                # stats are taken once all of the connection's earlier requests are answered
+                reply = json.dumps(self.stats) if reply is STATS_COMMAND else await reply
+                writer.write((reply + '\n').encode())
+                await writer.drain()
+
+        writer_task = asyncio.create_task(write_replies())
+        self.__clients.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    line = line.decode().rstrip()
+                except UnicodeDecodeError as err:
+                    # (answered in request order like any malformed request; the connection keeps being served)
+                    self.__num_errors += 1
+                    error_reply = asyncio.get_running_loop().create_future()
+                    error_reply.set_result(format_error(err))
+                    await replies.put(error_reply)
+                    continue
+                if not line:
+                    continue
+                if line == STATS_COMMAND:
+                    await replies.put(STATS_COMMAND)
+                else:
+                    await replies.put(asyncio.ensure_future(self.coalesce(line)))
+            await replies.put(None)
+            await writer_task
+        except (ConnectionError, asyncio.CancelledError):
+            # (cancelled by close(); the connection is just dropped)
+            writer_task.cancel()
+        finally:
+            self.__clients.discard(asyncio.current_task())
+            writer.close()
+
+    # start listening on a TCP host/port (port 0 picks a free port) or on a Unix socket path
+    async def start(self, host='127.0.0.1', port=0, unix_path=None):
+        if self.__queue is None:
+            self.__start_batcher()
+        if unix_path is not None:
+            self.__server = await asyncio.start_unix_server(self.__handle_client, path=unix_path)
+        else:
+            self.__server = await asyncio.start_server(self.__handle_client, host=host, port=port)
+        return self.server
+
+    # stop listening, drop the open connections & stop the batcher
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for client in list(self.__clients):
+            client.cancel()
+        await asyncio.gather(*self.__clients, return_exceptions=True)
+        if self.server is not None:
+            await self.server.wait_closed()
+        if self.__batcher_task is not None:
+            self.__batcher_task.cancel()
+            try:
+                await self.__batcher_task
+            except asyncio.CancelledError:
+                pass
+        if self.__subnet_cache is not None:
+            self.__subnet_cache.close()
+
+
+# ---------------------------------------------
+##################
+##  Entrypoint  ##
+##################
+def parse_args(argv):
+    argparser = argparse.ArgumentParser(prog='service.py', description="Serve 'id:subnets' coalescing requests over a local socket.")
+    argparser.add_argument('--host', default='127.0.0.1', help="TCP host to listen on (default: 127.0.0.1)")
+    argparser.add_argument('--port', type=int, default=8765, help="TCP port to listen on (default: 8765)")
+    argparser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    argparser.add_argument('--batch-size', type=int, default=BATCH_SIZE, metavar='N',
+                           help=f"max # of requests formatted per batch (default: {BATCH_SIZE})")
+    argparser.add_argument('--batch-wait', type=float, default=BATCH_WAIT, metavar='SECONDS',
+                           help=f"seconds a batch waits for concurrent requests (default: {BATCH_WAIT})")
+    argparser.add_argument('--memo-size', type=int, default=coalescence.MEMO_SIZE, metavar='N',
+                           help=f"max # of distinct subnet lists whose output is memoized (default: {coalescence.MEMO_SIZE})")
+    argparser.add_argument('--cache', metavar='PATH', help="persistent SQLite cache file (see main.py --cache)")
+    argparser.add_argument('--mode', choices=coalescence.MODES, default=coalescence.MODE_COALESCE,
+                           help="coalescing mode (see main.py --mode; default: coalesce)")
+    argparser.add_argument('--engine', choices=tuple(engines.ENGINES), default=engines.REFERENCE,
+                           help=f"coalescing engine (see main.py --engine; default: {engines.REFERENCE})")
+    return argparser.parse_args(argv)
+
+async def serve(args):
+    subnet_cache = cache.SubnetCache(args.cache, coalescence.COALESCE_VERSION) if args.cache else None
+    service = CoalescingService(args.batch_size, args.batch_wait, args.memo_size, subnet_cache, args.mode, args.engine)
+    server = await service.start(args.host, args.port, args.unix)
+    print(f"...Coalescing service listening on {args.unix or '%s:%d' % server.sockets[0].getsockname()[:2]}")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
@@ -2,11 +2,30 @@
 
 import pytest as pt
 import os
+import io
+import csv
 # local modules
 import main
 import dataparser
 import coalescence
+import aggregate
 import common
+import vectorized
+import benchmark
+import metrics
+import delta
+import cache
+import service
+import api
+import index
+import records
+import engines
+import crosscheck
+import quarantine
+import checkpoint
+import progress
+import asyncio
+import json
 
 
 # Instantiate Main class
@@ -183,6 +202,57 @@ def test_is_valid_mask_and_cidr_2ndOct_greaterthan_1stOct():
     # should return a tuple w/ False (bool) and 'N/A' (str... cidr# not available)
     assert common.is_valid_mask_and_cidr(mask) == (False, 'N/A')
 
+def test_is_valid_mask_and_cidr_matches_calc():
+    for mask in [0, 1, 255, 4294967040, 4294902015, 4294967295, 4294967296, -1]:
+        assert common.is_valid_mask_and_cidr(mask) == common.calc_mask_and_cidr(mask)
+
+# Lookup tables
+def test_mask_lookup_tables():
+    assert len(common.MASK_TO_CIDR) == 33
+    assert common.CIDR_TO_MASK[24] == 4294967040
+    assert common.MASK_TO_CIDR[4294967040] == 24
+
+def test_octet_lookup_table():
+    assert common.OCTET_STR[0] == '0' and common.OCTET_STR[255] == '255'
+
+def test_ipv4_cache_is_bounded():
+    for num in range(common.IPV4_CACHE_SIZE + 10):
+        common.int_to_ipv4(num)
+    assert common._int_to_ipv4_cached.cache_info().currsize <= common.IPV4_CACHE_SIZE
+
+# Functions: open_output, open_input, detect_compression
+def test_compressed_io_round_trip(tmp_path):
+    for ext in ('.csv', '.csv.gz', '.csv.bz2', '.csv.xz'):
+        filepath = str(tmp_path / ('out' + ext))
+        with common.open_output(filepath, buffer_size=64) as f:
+            f.write('1,Any\r\n2,10.0.0.1\r\n')
+        assert (common.detect_compression(filepath) is None) == (ext == '.csv')
+        # input compression is detected from the content, not the extension
+        os.rename(filepath, filepath + '.data')
+        with common.open_input(filepath + '.data') as f:
+            assert f.read() == '1,Any\r\n2,10.0.0.1\r\n'
+
+# Functions: open_input, is_plain_file (a FIFO, like '<(zcat f.gz)', can only be read once)
+def test_open_input_fifo(tmp_path):
+    import gzip
+    import threading
+    with open(m.input_file, 'rb') as f:
+        content = f.read()
+    expected = full_run_output(m.input_file, str(tmp_path / 'full.csv'))
+    fifo = str(tmp_path / 'input.fifo')
+    os.mkfifo(fifo)
+    for data in (content, gzip.compress(content)):
+        def feed():
+            with open(fifo, 'wb') as f:
+                f.write(data)
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        assert not common.is_plain_file(fifo)
+        main.Main([fifo, str(tmp_path / 'out.csv'), '--mmap', '--workers', '2', '--progress']).run()
+        writer.join()
+        with open(tmp_path / 'out.csv', 'rb') as f:
+            assert f.read() == expected
+
 # Function: ipv4_to_int
 def test_ipv4_to_int_minval():
     assert common.ipv4_to_int('0.0.0.0') == 0
@@ -194,6 +264,10 @@ def test_ipv4_to_int_badval():
     # passing an invalid ipv4 format will return the original arg value unchanged
     assert common.ipv4_to_int('256.255.255.255') == '256.255.255.255'
 
+def test_ipv4_to_int_type_error():
+    with pt.raises(TypeError):
+        common.ipv4_to_int(10)
+
 # Function: int_to_ipv4
 def test_int_to_ipv4():
     assert common.int_to_ipv4(1) == '0.0.0.1'
@@ -212,6 +286,10 @@ def test_int_to_ipv4_over32bits():
     with pt.raises(ValueError):
         common.int_to_ipv4(4294967296)
 
+def test_int_to_ipv4_type_error():
+    with pt.raises(TypeError):
+        common.int_to_ipv4('10.0.0.1')
+
 # Function: convert_cidr_to_str
 def test_convert_cidr_to_str32():
     assert common.convert_cidr_to_str(32) == ''
@@ -223,6 +301,40 @@ def test_convert_cidr_to_str0():
     assert common.convert_cidr_to_str(0) == '/0'
 
 
+# ---------------------------------------------
+################################
+##  Vectorized (NumPy) Tests  ##
+################################
+def test_vectorized_ipv4_to_int_list():
+    pt.importorskip('numpy')
+    ipv4_list = ['0.0.0.0', '255.255.255.255', '10.200.1.0', '1.2.3', '1.2.3.4.5', '1.a.3.4', '1.256.3.4',
+                 '1..3.4', '.1.2.3', '01.002.0003.00004', '0000010.1.1.1', '1.2.3.\u0663', '']
+    assert vectorized.ipv4_to_int_list(ipv4_list) == [common.ipv4_to_int(ipv4) for ipv4 in ipv4_list]
+
+def test_vectorized_mask_to_cidr():
+    pt.importorskip('numpy')
+    masks = [0, 4294967040, 4294967295, 553648128, 256, 4294902015, 16711680, 4294967296]
+    valid, cidrs = vectorized.mask_to_cidr(masks)
+    act = [(True, cidr) if is_valid else (False, 'N/A') for is_valid, cidr in zip(valid.tolist(), cidrs.tolist())]
+    assert act == [common.is_valid_mask_and_cidr(mask) for mask in masks]
+
+def test_vectorized_uint32_to_ipv4():
+    pt.importorskip('numpy')
+    nums = [0, 1, 4294967295, common.ipv4_to_int('10.200.1.150')]
+    assert vectorized.uint32_to_ipv4(nums) == [common.int_to_ipv4(num) for num in nums]
+
+def test_vectorized_uint32_to_ipv4_over32bits():
+    pt.importorskip('numpy')
+    with pt.raises(ValueError):
+        vectorized.uint32_to_ipv4([4294967296])
+
+def test_vectorized_not_available(monkeypatch):
+    monkeypatch.setattr(vectorized, 'np', None)
+    assert vectorized.is_available() is False
+    with pt.raises(ImportError):
+        vectorized.ipv4_to_int_list(['10.0.0.1'])
+
+
 # ---------------------------------------------
 # Note: m = main.Main()
 
@@ -260,6 +372,158 @@ def test_data_length_equivalence(input_data_numlines, parser_obj):
 def test_parsed_data_isnot_none(parser_obj):
     assert parser_obj.parsed_data is not None
 
+def test_parser_stream_is_lazy():
+    obj = dataparser.Parser(m.input_file, stream=True)
+    assert obj.parsed_data is None
+
+def test_parser_stream_rows(input_data_numlines, parser_obj):
+    rows = list(dataparser.Parser(m.input_file, stream=True).rows())
+    assert len(rows) == input_data_numlines
+    assert sorted(rows) == parser_obj.parsed_data
+
+def test_parser_compact(parser_obj):
+    obj = dataparser.Parser(m.input_file, compact=True)
+    assert isinstance(obj.parsed_data, dataparser.CompactData)
+    assert len(obj.parsed_data) == len(parser_obj.parsed_data)
+    id, subs, masks, invalid = obj.parsed_data[0]
+    assert id == parser_obj.parsed_data[0][0]
+    assert [[sub, mask] for sub, mask in zip(subs, masks)] == parser_obj.parsed_data[0][1]
+
+def test_parse_line_compact():
+    line = '7:10.0.0.2/255.255.255.255,10.0.0.300/255.255.255.255,10.0.0.1/255.255.255.255'
+    id, pairs, invalid = dataparser.parse_line_compact(line)
+    assert id == '7'
+    assert pairs == [(common.ipv4_to_int('10.0.0.1'), 4294967295), (common.ipv4_to_int('10.0.0.2'), 4294967295)]
+    assert invalid == ['10.0.0.300/255.255.255.255']
+
+def test_parser_vectorized(parser_obj):
+    pt.importorskip('numpy')
+    obj = dataparser.Parser(m.input_file, vectorized=True)
+    assert obj.parsed_data == parser_obj.parsed_data
+
+def test_parser_vectorized_without_numpy(monkeypatch, parser_obj):
+    monkeypatch.setattr(vectorized, 'np', None)
+    obj = dataparser.Parser(m.input_file, vectorized=True)
+    assert obj.parsed_data == parser_obj.parsed_data
+
+def test_parse_line():
+    line = '7:10.0.0.2/255.255.255.255,10.0.0.1/255.255.255.255'
+    exp = ['7', [[common.ipv4_to_int('10.0.0.1'), 4294967295], [common.ipv4_to_int('10.0.0.2'), 4294967295]]]
+    assert dataparser.parse_line(line) == exp
+
+
+def test_parser_stdin(monkeypatch, parser_obj):
+    with open(m.input_file, newline='') as f:
+        monkeypatch.setattr('sys.stdin', io.StringIO(f.read()))
+    assert dataparser.Parser('-', use_mmap=True).parsed_data == parser_obj.parsed_data
+
+def test_parser_mmap(parser_obj):
+    obj = dataparser.Parser(m.input_file, use_mmap=True)
+    assert obj.parsed_data == parser_obj.parsed_data
+    assert obj.num_invalid_subnets == parser_obj.num_invalid_subnets
+
+def test_parser_mmap_empty_file(tmp_path):
+    empty = tmp_path / 'empty.csv'
+    empty.write_bytes(b'')
+    assert dataparser.Parser(str(empty), use_mmap=True).parsed_data == []
+
+def test_parser_mmap_line_breaks(tmp_path):
+    # '\r\n', '\n' & lone '\r' line breaks, trailing whitespace, leading zeros, invalid & non-ascii tokens
+    raw = ('2:10.0.0.2/255.255.255.255,010.0.0.1/255.255.255.255 \r\n1:10.0.0.256/255.0.0.0\r'
+           '3:x/y\n4:\u00e9.0.0.1/255.0.0.0\x1c')
+    input_file = tmp_path / 'input.csv'
+    input_file.write_bytes(raw.encode(dataparser.INPUT_ENCODING))
+    obj = dataparser.Parser(str(input_file), use_mmap=True)
+    assert obj.parsed_data == dataparser.Parser(str(input_file)).parsed_data
+    assert obj.num_lines == 4
+
+def test_parser_compressed(tmp_path, parser_obj):
+    input_file = str(tmp_path / 'input.csv.gz')
+    with open(m.input_file, newline='') as src, common.open_output(input_file) as dst:
+        dst.write(src.read())
+    for use_mmap in (False, True):
+        obj = dataparser.Parser(input_file, use_mmap=use_mmap, buffer_size=4096)
+        assert obj.parsed_data == parser_obj.parsed_data
+
+def test_sort_rows():
+    # string order ('0, 1, 10, 100, 2'), non-numeric ids, and duplicate ids ordered by their pairs
+    rows = [['2', [[5, 1]]], ['10', []], ['a', [[1, 1]]], ['1', [[3, 1]]], ['100', []], ['1', [[2, 1]]], ['0', []], ['', []]]
+    assert dataparser.sort_rows(rows) == sorted(rows)
+    assert dataparser.sort_rows(sorted(rows)) == sorted(rows)
+    # presorted rows with a few out of place go through the same index array
+    presorted = [[str(id), [[id, 1]]] for id in range(1000, 2000)] + [['1500', [[1, 1]]], ['0', []]]
+    assert dataparser.sort_rows(presorted) == sorted(presorted)
+    assert dataparser.id_order(['b', 'a', 'b'], lambda idx: -idx) == [1, 2, 0]
+
+def test_sort_rows_duplicate_ids_invalid(monkeypatch, tmp_path):
+    # rows of the same id mixing invalid ('str') & valid ('int') values are ordered without comparing them
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text('1:10.0.0.256/255.255.255.255,10.0.0.1/255.255.255.255\n1:10.0.0.1/255.255.255.255\n'
+                          '2:10.0.0.1/255.255.255.256\n2:10.0.0.1/255.255.255.255\n')
+    expected = [['1', [[0x0A000001, 0xFFFFFFFF]]], ['1', [['10.0.0.256', 0xFFFFFFFF], [0x0A000001, 0xFFFFFFFF]]],
+                ['2', [[0x0A000001, '255.255.255.256']]], ['2', [[0x0A000001, 0xFFFFFFFF]]]]
+    monkeypatch.setattr(dataparser, 'MIN_SHARD_SIZE', 1)
+    for kwargs in ({}, {'vectorized': True}, {'use_mmap': True}, {'workers': 2}):
+        assert dataparser.Parser(str(input_file), **kwargs).parsed_data == expected
+    assert dataparser.pairs_key(expected[1][1]) == ([[0x0A000001, 0xFFFFFFFF]], ['10.0.0.256/255.255.255.255'])
+
+def test_shard_bounds(monkeypatch, tmp_path):
+    input_file = tmp_path / 'input.csv'
+    input_file.write_bytes(b'1:a\n22:b\r\n333:c\n4444:d')
+    # files smaller than MIN_SHARD_SIZE per shard get fewer shards
+    assert dataparser.shard_bounds(str(input_file), 4) == [(0, 22)]
+    monkeypatch.setattr(dataparser, 'MIN_SHARD_SIZE', 1)
+    bounds = dataparser.shard_bounds(str(input_file), 4)
+    # each shard starts on a line (just past a b'\n') & they cover the whole file
+    assert bounds == [(0, 10), (10, 16), (16, 22)]
+    assert dataparser.shard_bounds(str(input_file), 100) == [(0, 4), (4, 10), (10, 16), (16, 22)]
+    input_file.write_bytes(b'')
+    assert dataparser.shard_bounds(str(input_file), 4) == []
+
+def test_parser_workers(monkeypatch, tmp_path, parser_obj):
+    monkeypatch.setattr(dataparser, 'MIN_SHARD_SIZE', 64)
+    obj = dataparser.Parser(m.input_file, workers=3)
+    assert obj.parsed_data == parser_obj.parsed_data
+    assert (obj.num_lines, obj.num_subnets, obj.num_invalid_subnets) == \
+           (parser_obj.num_lines, parser_obj.num_subnets, parser_obj.num_invalid_subnets)
+    compact, serial = dataparser.Parser(m.input_file, compact=True, workers=3), dataparser.Parser(m.input_file, compact=True)
+    assert list(compact.parsed_data) == list(serial.parsed_data)
+    # line breaks, invalid & non-ascii tokens, duplicate ids across shards
+    raw = ('2:10.0.0.2/255.255.255.255,010.0.0.1/255.255.255.255 \r\n1:10.0.0.256/255.0.0.0\r'
+           '3:x/y\n4:é.0.0.1/255.0.0.0\x1c\n' + '2:10.0.0.1/255.0.0.0\n' * 20)
+    input_file = tmp_path / 'input.csv'
+    input_file.write_bytes(raw.encode(dataparser.INPUT_ENCODING))
+    obj = dataparser.Parser(str(input_file), workers=2)
+    assert obj.parsed_data == dataparser.Parser(str(input_file)).parsed_data
+    assert obj.num_lines == 24
+
+def test_sort_pairs():
+    pairs = [[5, 1], ['x', 'y'], [2, 1], ['10.0.0.300', 4294967295]]
+    dataparser.sort_pairs(pairs)
+    assert pairs == [['x', 'y'], ['10.0.0.300', 4294967295], [2, 1], [5, 1]]
+    line = '9:10.0.0.2/255.255.255.255,10.0.0.300/255.255.255.255,10.0.0.1/255.255.255.255'
+    assert dataparser.parse_line(line)[1][0] == ['10.0.0.300', 4294967295]
+    assert dataparser.parse_bytes_line(line.encode()) == dataparser._parse_line(line)
+    # a valid address with an invalid mask compares without error, but is listed first too
+    pairs = [[5, 1], [2, 1], [7, '255.255.255.256']]
+    dataparser.sort_pairs(pairs)
+    assert pairs == [[7, '255.255.255.256'], [2, 1], [5, 1]]
+
+def test_sort_pairs_compact(tmp_path):
+    # the list-based & compact parsers list invalid tokens first, so they coalesce to the same rows
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text('1:10.0.0.5/255.255.255.256,10.0.0.1/255.255.255.255\n'
+                          '2:10.0.0.2/255.255.255.255,10.0.0.300/255.255.255.255,10.0.0.1/255.255.255.255\n')
+    for mode in (coalescence.MODE_COALESCE, coalescence.MODE_AGGREGATE):
+        datatables = [coalescence.Coalescer(dataparser.Parser(str(input_file), **kwargs).parsed_data, mode=mode).datatable
+                      for kwargs in ({}, {'compact': True}, {'use_mmap': True}, {'vectorized': True})]
+        assert all(datatable == datatables[1] for datatable in datatables)
+    assert datatables[0][0] == ['1', '10.0.0.5/255.255.255.256;10.0.0.1']
+
+def test_parse_bytes_line():
+    for line in ('7:10.0.0.2/255.255.255.255,10.0.0.1/255.255.255.255', '8:10.0.0.300/255.255.255.255'):
+        assert dataparser.parse_bytes_line(line.encode()) == dataparser._parse_line(line)
+
 
 # ---------------------------------------------
 # Note: m = main.Main()
@@ -278,6 +542,51 @@ def test_coalescer_ctor_error():
     with pt.raises(common.ConstructionError):
         ctor = coalescence.Coalescer('string') # arg must be type 'list'
 
+def test_coalescer_stream_rows(parser_obj, coalescer_obj):
+    rows = dataparser.Parser(m.input_file, stream=True).rows()
+    obj = coalescence.Coalescer(rows, stream=True)
+    assert obj.datatable is None
+    assert sorted(obj.rows()) == sorted(coalescer_obj.datatable)
+
+def test_coalescer_compact(coalescer_obj):
+    obj = coalescence.Coalescer(dataparser.Parser(m.input_file, compact=True).parsed_data)
+    assert obj.datatable == coalescer_obj.datatable
+
+def test_coalescer_compact_invalid_subnet():
+    data = dataparser.CompactData()
+    data.append('5', [(common.ipv4_to_int('10.0.0.1'), 4294967295), (common.ipv4_to_int('10.0.0.2'), 4294967295)],
+                ['10.0.0.300/255.255.255.255'])
+    obj = coalescence.Coalescer(data)
+    exp = [['5', '10.0.0.300/255.255.255.255;10.0.0.1-10.0.0.2']]
+    assert obj.datatable == exp
+
+def test_coalescer_workers(coalescer_obj):
+    obj = coalescence.Coalescer(coalescer_obj.parsed_data, workers=2)
+    assert obj.datatable == coalescer_obj.datatable
+
+def test_coalescer_workers_compact(coalescer_obj):
+    obj = coalescence.Coalescer(dataparser.Parser(m.input_file, compact=True).parsed_data, workers=2)
+    assert obj.datatable == coalescer_obj.datatable
+
+def test_coalescer_memo_hits():
+    subs = [[common.ipv4_to_int('10.100.52.0'), common.ipv4_to_int('255.255.255.0')],
+            [common.ipv4_to_int('10.100.54.0'), common.ipv4_to_int('255.255.255.0')]]
+    obj = coalescence.Coalescer([['2026', subs], ['251', [list(pair) for pair in subs]]])
+    exp = [['2026', '10.100.52.0/24;10.100.54.0/24'], ['251', '10.100.52.0/24;10.100.54.0/24']]
+    assert obj.datatable == exp
+    assert (obj.memo_hits, obj.memo_misses) == (1, 1)
+
+def test_coalescer_memo_disabled(coalescer_obj):
+    obj = coalescence.Coalescer(coalescer_obj.parsed_data, memo_size=0)
+    assert obj.datatable == coalescer_obj.datatable
+    assert (obj.memo_hits, obj.memo_misses) == (0, 0)
+
+def test_coalescer_memo_bounded(coalescer_obj):
+    obj = coalescence.Coalescer(coalescer_obj.parsed_data, memo_size=10)
+    assert obj.datatable == coalescer_obj.datatable
+    assert obj.memo_hits + obj.memo_misses == len(coalescer_obj.parsed_data)
+    assert obj.memo_misses > coalescer_obj.memo_misses
+
 def test_setter_datatable(coalescer_obj):
     with pt.raises(TypeError):
         coalescer_obj.datatable = 'string' # datatable must be type 'list'
@@ -299,6 +608,18 @@ def test_coalescer_format_invalid_mask2():
     act = obj.datatable
     assert exp == act
 
+def test_coalescer_format_invalid_subnets():
+    # invalid subs are written as-is (each one as a whole token), and runs stop before invalid pairs
+    host = common.ipv4_to_int('255.255.255.255')
+    arg = [('1', [['10.0.0.300', host], ['x', 'y']]),
+           ('2', [[common.ipv4_to_int('10.0.0.1'), 'y']]),
+           ('3', [[common.ipv4_to_int('10.0.0.%d' % i), host if i != 3 else 5] for i in range(1, 6)])]
+    obj = coalescence.Coalescer(arg, memo_size=0)
+    exp = [['1', '10.0.0.300/255.255.255.255;x/y'], ['2', '10.0.0.1/y'],
+           ['3', '10.0.0.1-10.0.0.2;10.0.0.3/0.0.0.5;10.0.0.4/31']]
+    assert obj.datatable == exp
+    assert obj.num_invalid_masks == 1
+
 def test_coalescer_format_any():
     arg = [('0', [[0, 0]])]
     obj = coalescence.Coalescer(arg)
@@ -424,6 +745,198 @@ def test_coalesce_ips_no_coalescence():
     act = obj.datatable
     assert exp == act
 
+def test_coalesce_ips_no_recursion_limit():
+    base = common.ipv4_to_int('10.0.0.1')
+    arg = [('42', [[base + i, common.ipv4_to_int('255.255.255.255')] for i in range(5000)])]
+    obj = coalescence.Coalescer(arg)
+    exp = [['42', '10.0.0.1-10.0.19.136']]
+    act = obj.datatable
+    assert exp == act
+
+
+# ---------------------------------------------
+#######################
+##  Aggregate Tests  ##
+#######################
+def aggregate_row(id, pairs):
+    arg = [(id, sorted([common.ipv4_to_int(sub), common.ipv4_to_int(mask)] for sub, mask in pairs))]
+    return coalescence.Coalescer(arg, mode=coalescence.MODE_AGGREGATE).datatable
+
+def test_merge_intervals():
+    assert aggregate.merge_intervals([(10, 20), (0, 4), (5, 6), (12, 15), (22, 30)]) == [[0, 6], [10, 20], [22, 30]]
+
+def test_range_to_prefixes():
+    assert aggregate.range_to_prefixes(0, 0xFFFFFFFF) == [(0, 0)]
+    assert aggregate.range_to_prefixes(1, 6) == [(1, 32), (2, 31), (4, 31), (6, 32)]
+
+def test_aggregate_containment():
+    exp = [['1', '10.0.0.0/16;10.2.0.0/24']]
+    assert aggregate_row('1', [('10.0.0.0', '255.255.0.0'), ('10.0.5.0', '255.255.255.0'), ('10.0.9.9', '255.255.255.255'),
+                               ('10.2.0.0', '255.255.255.0')]) == exp
+
+def test_aggregate_host_run():
+    exp = [['2', '10.0.0.1;10.0.0.2/31;10.0.0.4/30;10.0.0.8/29;10.0.0.16/28;10.0.0.32/27;10.0.0.64/26;10.0.0.128/25']]
+    assert aggregate_row('2', [('10.0.0.%d' % host, '255.255.255.255') for host in range(1, 256)]) == exp
+
+def test_aggregate_invalid_and_any():
+    exp = [['3', '10.0.0.0/255.0.0.192;10.0.0.0/23']]
+    assert aggregate_row('3', [('10.0.1.0', '255.255.255.0'), ('10.0.0.7', '255.255.255.0'), ('10.0.0.0', '255.0.0.192')]) == exp
+    assert aggregate_row('4', [('0.0.0.0', '0.0.0.0'), ('1.1.1.1', '255.255.255.255')]) == [['4', 'Any']]
+
+def test_aggregate_counters():
+    obj = coalescence.Coalescer([('5', [[1, 4294967295], [2, 4294967294], [3, 4294967295]])], mode=coalescence.MODE_AGGREGATE)
+    assert obj.datatable == [['5', '0.0.0.1;0.0.0.2/31']]
+    assert obj.num_coalesced == 1
+
+def test_aggregate_large_line():
+    base = common.ipv4_to_int('10.0.0.0')
+    arg = [('6', [[base + 2 * i, common.ipv4_to_int('255.255.255.255')] for i in range(30000)])]
+    obj = coalescence.Coalescer(arg, mode=coalescence.MODE_AGGREGATE)
+    assert obj.datatable[0][1].count(';') == 29999
+    arg = [('7', [[base + i, common.ipv4_to_int('255.255.255.255')] for i in range(65536)])]
+    assert coalescence.Coalescer(arg, mode=coalescence.MODE_AGGREGATE).datatable == [['7', '10.0.0.0/16']]
+
+def test_aggregate_invalid_mode():
+    with pt.raises(common.ConstructionError):
+        coalescence.Coalescer([], mode='bogus')
+
+
+# ---------------------------------------------
+########################
+##  Quarantine Tests  ##
+########################
+MALFORMED_INPUT = ('2:10.0.0.2/255.255.255.255,10.0.0.1/255.255.255.255\nbadline\n3:1.2.3.4/5/6\n'
+                   '1:10.0.0.300/255.255.255.255,10.0.0.9/255.255.255.255\n4:x/y,10.0.0.1/255.255.255.0\n')
+
+def read_quarantine(filepath):
+    with open(filepath, newline='') as f:
+        return list(csv.reader(f))
+
+def test_parser_quarantine(monkeypatch, tmp_path):
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text(MALFORMED_INPUT)
+    exp = [quarantine.QUARANTINE_HEADER, ['2', "no ':' after the id", 'badline'],
+           ['3', "malformed subnet '1.2.3.4/5/6'", '3:1.2.3.4/5/6']]
+    # (small shards, so that the quarantined lines are numbered across shards)
+    monkeypatch.setattr(dataparser, 'MIN_SHARD_SIZE', 16)
+    for kwargs in ({}, {'use_mmap': True}, {'compact': True}, {'vectorized': True}, {'workers': 3},
+                   {'workers': 3, 'compact': True}):
+        quarantine_file = str(tmp_path / 'quarantine.csv')
+        with quarantine.Quarantine(quarantine_file) as lines:
+            obj = dataparser.Parser(str(input_file), quarantine=lines, **kwargs)
+        assert read_quarantine(quarantine_file) == exp, kwargs
+        assert (obj.num_lines, lines.num_lines) == (3, 2)
+    with pt.raises(IndexError):
+        dataparser.Parser(str(input_file))
+
+def test_quarantine_error_budget(tmp_path):
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text(MALFORMED_INPUT)
+    with quarantine.Quarantine(str(tmp_path / 'quarantine.csv'), error_budget=1) as lines:
+        rows = dataparser.Parser(str(input_file), stream=True, quarantine=lines).rows()
+        assert next(rows)[0] == '2'
+        with pt.raises(quarantine.ErrorBudgetExceeded):
+            next(rows)
+    with pt.raises(common.ConstructionError):
+        quarantine.Quarantine(str(tmp_path / 'quarantine.csv'), error_budget=-1)
+
+def test_main_quarantine(tmp_path):
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text(MALFORMED_INPUT)
+    output_file, quarantine_file, metrics_file = (str(tmp_path / name) for name in ('out.csv', 'q.csv.gz', 'metrics.json'))
+    for stream in ([], ['--stream']):
+        main.Main([str(input_file), output_file, '--quarantine', quarantine_file, '--metrics', metrics_file] + stream).run()
+        with open(output_file, newline='') as f:
+            assert sorted(csv.reader(f)) == [['1', '10.0.0.300/255.255.255.255;10.0.0.9'], ['2', '10.0.0.1-10.0.0.2'],
+                                             ['4', 'x/y;10.0.0.1/24']]
+        with common.open_input(quarantine_file) as f:
+            assert len(list(csv.reader(f))) == 3
+        with open(metrics_file) as f:
+            assert json.load(f)['quarantined'] == 2
+    with pt.raises(quarantine.ErrorBudgetExceeded):
+        main.Main([str(input_file), output_file, '--quarantine', quarantine_file, '--error-budget', '1']).run()
+    for argv in (['--error-budget', '1'], ['--quarantine', quarantine_file, '--delta']):
+        with pt.raises(SystemExit):
+            main.Main([str(input_file), output_file] + argv)
+
+
+# ---------------------------------------------
+####################
+##  Engine Tests  ##
+####################
+def random_parsed_rows(num_rows, seed=7):
+    import random
+    rand = random.Random(seed)
+    rows = list()
+    for idx in range(num_rows):
+        base = rand.choice([common.ipv4_to_int('10.0.0.0'), common.ipv4_to_int('192.168.0.0')])
+        cidrs = [32, 32, 31, 30, 25, 24, 8, 1] + ([0] if idx % 50 == 0 else [])
+        pairs = [[base + rand.randint(0, 600), common.CIDR_TO_MASK[rand.choice(cidrs)]] for _ in range(rand.randint(1, 6))]
+        rows.append([str(idx), sorted(pairs)])
+    return rows
+
+def test_engines_match_reference():
+    rows = random_parsed_rows(5000)
+    reference = coalescence.Coalescer(rows, memo_size=0).datatable
+    for engine in ('fast', 'vectorized'):
+        assert coalescence.Coalescer(rows, memo_size=0, engine=engine).datatable == reference
+
+def test_engine_fast_lines():
+    host = common.CIDR_TO_MASK[32]
+    subs = [common.ipv4_to_int(addr) for addr in ('10.0.0.1', '10.0.0.5', '10.0.1.0')]
+    assert engines.format_independent('1', subs, [host, host, common.CIDR_TO_MASK[24]]) == (['1', '10.0.0.1;10.0.0.5;10.0.1.0/24'], 0, 0)
+    # contiguous subs, supernettable networks & invalid subs/masks are left to the reference
+    assert engines.format_independent('2', subs[:1] + [subs[0] + 1], [host, host]) is None
+    assert engines.format_independent('3', [subs[0] - 1, subs[0] + 1], [common.CIDR_TO_MASK[31]] * 2) is None
+    assert engines.format_independent('4', ['10.0.0.300'], [host]) is None
+    assert engines.format_independent('5', subs[:1], [5]) is None
+
+def test_engine_vectorized_long_line():
+    pt.importorskip('numpy')
+    base, host = common.ipv4_to_int('10.0.0.0'), common.CIDR_TO_MASK[32]
+    subs = [base + 3 * i for i in range(1, engines.VECTORIZED_MIN_SUBNETS + 10)]
+    masks = [host] * len(subs)
+    assert engines.format_independent_vectorized('6', subs, masks) == engines.format_independent('6', subs, masks)
+    assert engines.format_independent_vectorized('6', subs + [subs[-1] + 1], masks + [host]) is None
+
+def test_engine_errors():
+    with pt.raises(common.ConstructionError):
+        coalescence.Coalescer([], engine='bogus')
+    with pt.raises(common.ConstructionError):
+        coalescence.Coalescer([], mode=coalescence.MODE_AGGREGATE, engine='fast')
+    with pt.raises(ValueError):
+        engines.register_engine(engines.REFERENCE, None)
+    with pt.raises(SystemExit):
+        main.Main(["in.csv", "out.csv", "--engine", "fast", "--mode", "aggregate"])
+
+def test_cross_check_mismatches(monkeypatch):
+    # a faulty engine that drops the last subnet of every line with more than one
+    def drop_last(id, subs, masks):
+        return ([id, common.int_to_ipv4(subs[0])], 0, 0) if len(subs) > 1 else None
+    monkeypatch.setitem(engines.ENGINES, 'faulty', drop_last)
+    rows = random_parsed_rows(100)
+    cross_check = crosscheck.CrossCheck('faulty', 0.1)
+    cross_check.check(cross_check.sample(rows))
+    assert cross_check.num_rows == 10
+    assert 0 < len(cross_check.mismatches) <= 10
+    good_check = crosscheck.CrossCheck('fast', 0.5)
+    good_check.check(good_check.sample(dataparser.Parser(m.input_file, compact=True).parsed_data))
+    assert good_check.num_rows > 0 and good_check.mismatches == []
+    with pt.raises(common.ConstructionError):
+        crosscheck.CrossCheck('fast', 0)
+
+def test_main_engine_cross_check(tmp_path):
+    for stream in ([], ['--stream']):
+        output_file, metrics_file = str(tmp_path / 'out.csv'), str(tmp_path / 'metrics.json')
+        main.Main([m.input_file, output_file, '--engine', 'fast', '--cross-check', '0.2', '--metrics', metrics_file] + stream).run()
+        reference_file = str(tmp_path / 'reference.csv')
+        main.Main([m.input_file, reference_file] + stream).run()
+        with open(output_file, newline='') as f, open(reference_file, newline='') as ref:
+            assert f.read() == ref.read()
+        with open(metrics_file) as f:
+            run_metrics = json.load(f)
+        assert run_metrics['cross_check_lines'] > 0 and run_metrics['cross_check_mismatches'] == 0
+
 
 # ---------------------------------------------
 # Note: m = main.Main()
@@ -463,6 +976,29 @@ def test_write_file(writefile_obj):
     assert os.path.getsize(writefile_obj.outfile) > 0
     os.remove(writefile_obj.outfile)
 
+def test_write_file_stream():
+    outfile = 'thisisatestfiletobewrittenanddeleted'
+    wf = main.FileWriter(outfile, (row for row in [['1', 'Any'], ['2', '10.0.0.1']]), stream=True)
+    wf.write_file()
+    with open(outfile, newline='') as f:
+        assert f.read() == '1,Any\r\n2,10.0.0.1\r\n'
+    os.remove(outfile)
+
+def test_write_file_stdout():
+    stdout = io.StringIO()
+    wf = main.FileWriter('-', (row for row in [['1', 'Any'], ['2', '10.0.0.1']]), stream=True, stdout=stdout)
+    wf.write_file()
+    assert stdout.getvalue() == '1,Any\r\n2,10.0.0.1\r\n'
+    assert wf.bytes_written == len(stdout.getvalue())
+
+def test_write_file_compressed(tmp_path):
+    outfile = str(tmp_path / 'out.csv.xz')
+    wf = main.FileWriter(outfile, [['1', 'Any'], ['2', '10.0.0.1']], buffer_size=16)
+    wf.write_file()
+    assert wf.bytes_written == os.path.getsize(outfile)
+    with common.open_input(outfile) as f:
+        assert f.read() == '1,Any\r\n2,10.0.0.1\r\n'
+
 
 # ---------------------------------------------
 # Note: m = main.Main()
@@ -473,6 +1009,609 @@ def test_write_file(writefile_obj):
 def test_input_filepath():
     assert os.path.exists(m.input_file)
 
+def test_main_stream_flag():
+    assert m.stream is False
+    assert main.Main(["in.csv", "out.csv", "--stream"]).stream is True
+
+def test_main_mmap_flag():
+    assert main.Main([m.input_file, m.output_file, '--mmap']).args.mmap
+    assert not m.args.mmap
+
+def test_main_stdin_stdout(monkeypatch, capsys):
+    with open(m.input_file, newline='') as f:
+        monkeypatch.setattr('sys.stdin', io.StringIO(f.read()))
+    obj = main.Main(['-', '-'])
+    assert obj.stream
+    obj.run()
+    out, err = capsys.readouterr()
+    assert len(out.splitlines()) == 7275
+    assert '...' not in out and '...Parsing data from stdin' in err
+
+def test_main_mode_aggregate(tmp_path):
+    output_file = str(tmp_path / 'out.csv')
+    obj = main.Main([m.input_file, output_file, '--mode', 'aggregate'])
+    assert obj.args.mode == coalescence.MODE_AGGREGATE and m.args.mode == coalescence.MODE_COALESCE
+    obj.run()
+    with open(output_file, newline='') as f:
+        assert len(f.read().splitlines()) == 7275
+
+def test_main_compact_invalid_tokens(tmp_path):
+    # invalid tokens are formatted the same way with & without --compact (a valid half in its canonical form)
+    input_file = str(tmp_path / 'input.csv')
+    benchmark.InputGenerator(500, invalid_octet_share=0.3, seed=5).write_file(input_file)
+    with open(input_file, 'a', newline='') as f:
+        f.write('9999:10.0.0.256/255.255.255.000,10.0.0.1/255.255.255.255\n')
+    for mode in (coalescence.MODE_COALESCE, coalescence.MODE_AGGREGATE):
+        outputs = list()
+        for flags in ([], ['--compact']):
+            output_file = str(tmp_path / f'out{len(outputs)}.csv')
+            main.Main([input_file, output_file, '--mode', mode] + flags).run()
+            with open(output_file, 'rb') as f:
+                outputs.append(f.read())
+        assert outputs[0] == outputs[1]
+        assert b'9999,10.0.0.256/255.255.255.0;10.0.0.1' in outputs[0]
+
+def test_main_delta_stream_error():
+    with pt.raises(SystemExit):
+        main.Main(["in.csv", "out.csv", "--delta", "--stream"])
+
+
+# ---------------------------------------------
+#####################
+##  Metrics Tests  ##
+#####################
+def test_metrics_stage_and_counters():
+    run_metrics = metrics.Metrics()
+    with run_metrics.stage('parse'):
+        pass
+    run_metrics.count('lines', 10)
+    run_metrics.count('lines', 5)
+    result = run_metrics.to_dict()
+    assert set(result['stages']['parse']) == {'wall_seconds', 'cpu_seconds'}
+    assert result['lines'] == 15
+
+def test_metrics_profile(tmp_path):
+    run_metrics = metrics.Metrics(profile_dir=str(tmp_path))
+    with run_metrics.stage('coalesce'):
+        common.int_to_ipv4(1)
+    assert os.path.exists(tmp_path / 'coalesce.prof')
+    assert 'int_to_ipv4' in (tmp_path / 'coalesce.txt').read_text()
+
+def test_main_metrics_file(tmp_path):
+    metrics_file = str(tmp_path / 'metrics.json')
+    main.Main([m.input_file, str(tmp_path / 'out.csv'), '--metrics', metrics_file]).run()
+    with open(metrics_file) as f:
+        result = json.load(f)
+    assert list(result['stages']) == ['parse', 'coalesce', 'write']
+    assert result['lines'] == 7275
+    assert result['invalid_masks'] > 0 and result['coalesced'] > 0
+    assert result['output_bytes'] == os.path.getsize(tmp_path / 'out.csv')
+
+
+# ---------------------------------------------
+###################
+##  Delta Tests  ##
+###################
+def full_run_output(input_file, output_file):
+    main.Main([input_file, output_file]).run()
+    with open(output_file, 'rb') as f:
+        return f.read()
+
+def test_delta_first_run_matches_full_run(tmp_path):
+    output_file = str(tmp_path / 'out.csv')
+    delta_run = delta.DeltaRun(m.input_file, output_file)
+    delta_run.run()
+    assert delta_run.num_changed == delta_run.num_ids
+    assert os.path.exists(delta.state_path(output_file))
+    with open(output_file, 'rb') as f:
+        assert f.read() == full_run_output(m.input_file, str(tmp_path / 'full.csv'))
+
+def test_delta_changed_lines(tmp_path):
+    with open(m.input_file, newline='') as f:
+        lines = f.read().splitlines()
+    input_file, output_file = str(tmp_path / 'in.csv'), str(tmp_path / 'out.csv')
+    with open(input_file, 'w', newline='') as f:
+        f.write('\r\n'.join(lines) + '\r\n')
+    delta.DeltaRun(input_file, output_file).run()
+    # change 1 line, remove 1 line & add a new id
+    lines[5] = lines[5].split(':')[0] + ':10.0.0.1/255.255.255.255,10.0.0.0/255.255.255.255'
+    del lines[10]
+    lines.append('new:10.1.0.0/255.255.255.0')
+    with open(input_file, 'w', newline='') as f:
+        f.write('\r\n'.join(reversed(lines)) + '\r\n')
+    delta_run = delta.DeltaRun(input_file, output_file)
+    delta_run.run()
+    assert delta_run.num_changed == 2
+    assert delta_run.num_removed == 1
+    with open(output_file, 'rb') as f:
+        assert f.read() == full_run_output(input_file, str(tmp_path / 'full.csv'))
+
+def test_delta_stale_state(tmp_path):
+    output_file = str(tmp_path / 'out.csv')
+    delta.DeltaRun(m.input_file, output_file).run()
+    # an output file that was rewritten since the last delta run invalidates the state
+    with open(output_file, 'a') as f:
+        f.write('extra\r\n')
+    delta_run = delta.DeltaRun(m.input_file, output_file)
+    delta_run.run()
+    assert delta_run.num_changed == delta_run.num_ids
+
+def test_delta_compressed_output(tmp_path):
+    output_file = str(tmp_path / 'out.csv.gz')
+    delta.DeltaRun(m.input_file, output_file).run()
+    delta_run = delta.DeltaRun(m.input_file, output_file)
+    delta_run.run()
+    assert delta_run.num_changed == 0
+    with common.open_input(output_file) as f:
+        assert f.read().encode() == full_run_output(m.input_file, str(tmp_path / 'full.csv'))
+
+def test_delta_mode_change(tmp_path):
+    output_file = str(tmp_path / 'out.csv')
+    delta.DeltaRun(m.input_file, output_file).run()
+    # rows coalesced in another mode aren't reused
+    delta_run = delta.DeltaRun(m.input_file, output_file, mode=coalescence.MODE_AGGREGATE)
+    delta_run.run()
+    assert delta_run.num_changed == delta_run.num_ids
+
+def test_main_delta_metrics(tmp_path):
+    output_file, metrics_file = str(tmp_path / 'out.csv'), str(tmp_path / 'metrics.json')
+    for _ in range(2):
+        main.Main([m.input_file, output_file, '--delta', '--metrics', metrics_file]).run()
+    with open(metrics_file) as f:
+        result = json.load(f)
+    assert list(result['stages']) == ['delta']
+    assert result['lines'] == 7275
+    assert result['ids_changed'] == 0
+
+
+# ---------------------------------------------
+########################
+##  Checkpoint Tests  ##
+########################
+class Interrupted(Exception):
+    pass
+
+# make every row a checkpoint candidate & interrupt the run right after its 'num_saves'-th checkpoint
+def interrupt_after_saves(monkeypatch, num_saves):
+    save = checkpoint.Checkpoint.save
+    def save_then_interrupt(self, position):
+        save(self, position)
+        if self.num_saves == num_saves:
+            raise Interrupted()
+    monkeypatch.setattr(checkpoint, 'CHECK_EVERY_ROWS', 1)
+    monkeypatch.setattr(checkpoint, 'CHUNK_ROWS', 1000)
+    monkeypatch.setattr(checkpoint.Checkpoint, 'save', save_then_interrupt)
+
+def test_checkpoint_resume(tmp_path):
+    input_file = m.input_file
+    rows = [[str(idx), f'10.0.0.{idx}'] for idx in range(3000)]
+    for output_name in ('out.csv', 'out.csv.gz', 'out.csv.bz2', 'out.csv.xz'):
+        output_file = str(tmp_path / output_name)
+        # write 2048 rows, checkpoint, then write some more & crash
+        run_checkpoint = checkpoint.Checkpoint(output_file, input_file, {}, interval=1e-9)
+        with pt.raises(Interrupted), run_checkpoint.open_part() as f:
+            for idx, row in enumerate(run_checkpoint.track(rows, lambda: {'rows': 'seen'})):
+                if idx == 2100:
+                    raise Interrupted()
+                csv.writer(f).writerow(row)
+        assert run_checkpoint.num_saves == 2
+        # a compressed output's part file is compressed too
+        assert (common.detect_compression(run_checkpoint.part_file) is not None) == (output_name != 'out.csv')
+        # the rows written after the last checkpoint are dropped from the part file
+        resumed = checkpoint.Checkpoint(output_file, input_file, {}, resume=True)
+        assert resumed.resumed and resumed.rows_done == 2048 and resumed.position == {'rows': 'seen'}
+        with resumed.open_part() as f:
+            csv.writer(f).writerows(resumed.track(rows[resumed.rows_done:]))
+        resumed.finish()
+        assert not os.path.exists(resumed.part_file) and not os.path.exists(resumed.state_file)
+        with common.open_input(output_file) as f:
+            assert list(csv.reader(f)) == rows
+    # a checkpoint of other run settings isn't used
+    assert not checkpoint.Checkpoint(output_file, input_file, {'mode': 'other'}, resume=True).resumed
+
+def test_main_checkpoint_resume(tmp_path, monkeypatch):
+    # (malformed lines all along the input, so that lines are quarantined before & after the checkpoint)
+    with open(m.input_file) as f:
+        lines = f.read().splitlines()
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text('\n'.join(line if idx % 1000 else 'badline' for idx, line in enumerate(lines)) + '\n')
+    for mode in ([], ['--stream'], ['--workers', '2']):
+        argv = [str(input_file), str(tmp_path / 'full.csv'), '--quarantine', str(tmp_path / 'full_q.csv')] + mode
+        main.Main(argv).run()
+        argv = [str(input_file), str(tmp_path / 'out.csv'), '--quarantine', str(tmp_path / 'q.csv')] + mode
+        with monkeypatch.context() as patch:
+            interrupt_after_saves(patch, 3)
+            with pt.raises(Interrupted):
+                main.Main(argv + ['--checkpoint', '1e-9']).run()
+        assert not os.path.exists(tmp_path / 'out.csv')
+        main.Main(argv + ['--resume', '--metrics', str(tmp_path / 'metrics.json')]).run()
+        for output, expected in (('out.csv', 'full.csv'), ('q.csv', 'full_q.csv')):
+            assert (tmp_path / output).read_bytes() == (tmp_path / expected).read_bytes()
+        with open(tmp_path / 'metrics.json') as f:
+            assert json.load(f)['rows_resumed'] == 3
+        os.remove(tmp_path / 'out.csv')
+
+def test_main_checkpoint_compressed(tmp_path, monkeypatch):
+    main.Main([m.input_file, str(tmp_path / 'full.csv')]).run()
+    argv = [m.input_file, str(tmp_path / 'out.csv.gz')]
+    with monkeypatch.context() as patch:
+        interrupt_after_saves(patch, 3)
+        with pt.raises(Interrupted):
+            main.Main(argv + ['--checkpoint', '1e-9']).run()
+    # the part file is never held decompressed on disk
+    assert common.detect_compression(checkpoint.part_path(str(tmp_path / 'out.csv.gz'))) is not None
+    main.Main(argv + ['--resume']).run()
+    with common.open_input(str(tmp_path / 'out.csv.gz')) as f, open(tmp_path / 'full.csv', newline='') as expected:
+        assert f.read() == expected.read()
+
+def test_main_checkpoint_args(tmp_path):
+    output_file = str(tmp_path / 'out.csv')
+    for argv in (['--checkpoint', '0'], ['--resume', '--delta'], ['--stream', '--resume', '--quarantine', 'q.csv.gz']):
+        with pt.raises(SystemExit):
+            main.Main([m.input_file, output_file] + argv)
+    with pt.raises(SystemExit):
+        main.Main([m.input_file, '-', '--checkpoint', '10'])
+
+
+# ---------------------------------------------
+######################
+##  Progress Tests  ##
+######################
+def read_reports(text):
+    return [json.loads(line) for line in text.splitlines() if line.startswith('{')]
+
+def test_progress_report():
+    output = io.StringIO()
+    reporter = progress.Progress(progress.FORMAT_JSON, interval=3600, output=output)
+    reporter.start('parse', total_bytes=400)
+    reporter.update(10, 100)
+    reporter.report(10, 100)
+    reporter.finish(40, 400)
+    first, last = read_reports(output.getvalue())
+    assert reporter.num_reports == 2
+    assert (first['phase'], first['lines'], first['bytes'], first['percent'], first['final']) == ('parse', 10, 100, 25.0, False)
+    assert first['eta_seconds'] is not None and first['rss_bytes'] > 0
+    assert (last['lines'], last['percent'], last['eta_seconds'], last['final']) == (40, 100.0, 0.0, True)
+    output = io.StringIO()
+    reporter = progress.Progress(interval=0, output=output)
+    reporter.start('coalesce', unit='rows', total=8)
+    reporter.update(2)
+    assert output.getvalue().startswith("...Progress [coalesce]: 2 rows of 8 (25.0%), ")
+    assert 'ETA 0:00:00' in output.getvalue() and 'RSS ' in output.getvalue()
+    for args in (('xml',), (progress.FORMAT_TEXT, -1)):
+        with pt.raises(common.ConstructionError):
+            progress.Progress(*args)
+
+def test_parser_progress():
+    for kwargs in ({}, {'use_mmap': True}, {'compact': True}):
+        output = io.StringIO()
+        reporter = progress.Progress(progress.FORMAT_JSON, interval=0, output=output)
+        input_parser = dataparser.Parser(m.input_file, stream=True, progress=reporter, **kwargs)
+        assert len(list(input_parser.rows())) == 7275
+        reports = read_reports(output.getvalue())
+        # (one report per block of PROGRESS_EVERY lines, and the final one)
+        assert len(reports) == 7275 // progress.PROGRESS_EVERY + 1
+        assert (reports[-1]['lines'], reports[-1]['bytes'], reports[-1]['final']) == (7275, os.path.getsize(m.input_file), True)
+
+def test_main_progress(tmp_path, capsys):
+    output_file = str(tmp_path / 'out.csv')
+    for argv in ([], ['--workers', '2']):
+        main.Main([m.input_file, output_file, '--progress', 'json'] + argv).run()
+        reports = read_reports(capsys.readouterr().err)
+        assert [report['phase'] for report in reports if report['final']] == ['parse', 'coalesce']
+        assert reports[-1]['rows'] == reports[-1]['total'] == 7275
+    main.Main([m.input_file, output_file, '--progress', '--stream']).run()
+    assert capsys.readouterr().err.startswith("...Progress [parse]: 7275 lines, ")
+    for argv in (['--progress', 'xml'], ['--progress-interval', '0']):
+        with pt.raises(SystemExit):
+            main.Main([m.input_file, output_file] + argv)
+
+
+# ---------------------------------------------
+###################
+##  Cache Tests  ##
+###################
+def test_cache_make_key():
+    key = cache.make_key('pairs', ((1, 2), ('10.0.0.300', '255.255.255.255')))
+    assert len(key) == 16
+    assert key == cache.make_key('pairs', ((1, 2), ('10.0.0.' + '300', '255.255.255.255')))
+    assert key != cache.make_key('compact', ((1, 2), ('10.0.0.300', '255.255.255.255')))
+
+def test_cache_persists_across_runs(tmp_path):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    subnet_cache = cache.SubnetCache(cache_file, 1)
+    subnet_cache.put(b'key', 'value')
+    assert subnet_cache.get(b'key') == 'value'
+    subnet_cache.close()
+    subnet_cache = cache.SubnetCache(cache_file, 1)
+    subnet_cache.prefetch([b'key', b'other'])
+    assert subnet_cache.get(b'key') == 'value'
+    assert subnet_cache.get(b'other') is None
+    subnet_cache.close()
+    # another coalescing version --> stale entries are dropped
+    subnet_cache = cache.SubnetCache(cache_file, 2)
+    assert subnet_cache.get(b'key') is None
+    subnet_cache.close()
+
+def test_cache_eviction(tmp_path):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    subnet_cache = cache.SubnetCache(cache_file, 1, max_entries=2)
+    subnet_cache.put(b'a', 'value')
+    subnet_cache.put(b'b', 'value')
+    subnet_cache.close()
+    # 'a' is used by the next run, so the least recently used entry is 'b'
+    subnet_cache = cache.SubnetCache(cache_file, 1, max_entries=2)
+    assert subnet_cache.get(b'a') == 'value'
+    subnet_cache.put(b'c', 'value')
+    subnet_cache.close()
+    subnet_cache = cache.SubnetCache(cache_file, 1, max_entries=2)
+    assert len(subnet_cache) == 2
+    assert subnet_cache.get(b'b') is None
+    assert subnet_cache.get(b'a') == 'value' and subnet_cache.get(b'c') == 'value'
+    subnet_cache.close()
+
+def test_coalescer_cache(tmp_path, parser_obj, coalescer_obj):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    for expected_hits in (0, coalescer_obj.memo_misses):
+        subnet_cache = cache.SubnetCache(cache_file, coalescence.COALESCE_VERSION)
+        obj = coalescence.Coalescer(parser_obj.parsed_data, subnet_cache=subnet_cache)
+        subnet_cache.close()
+        assert obj.datatable == coalescer_obj.datatable
+        assert obj.cache_hits == expected_hits
+        assert obj.counters['coalesced'] == coalescer_obj.num_coalesced
+
+def test_coalescer_cache_compact(tmp_path, coalescer_obj):
+    cache_file = str(tmp_path / 'cache.sqlite')
+    compact_data = dataparser.Parser(m.input_file, compact=True).parsed_data
+    for _ in range(2):
+        subnet_cache = cache.SubnetCache(cache_file, coalescence.COALESCE_VERSION)
+        obj = coalescence.Coalescer(compact_data, memo_size=0, subnet_cache=subnet_cache)
+        subnet_cache.close()
+        assert obj.datatable == coalescer_obj.datatable
+    assert obj.cache_misses == 0
+
+def test_main_cache(tmp_path):
+    output_file, metrics_file = str(tmp_path / 'out.csv'), str(tmp_path / 'metrics.json')
+    cache_file = str(tmp_path / 'cache' / 'coalesce_cache.sqlite')
+    for _ in range(2):
+        main.Main([m.input_file, output_file, '--cache', cache_file, '--metrics', metrics_file]).run()
+    with open(metrics_file) as f:
+        result = json.load(f)
+    assert result['cache_misses'] == 0 and result['cache_hits'] == result['memo_misses']
+
+
+# ---------------------------------------------
+##########################
+##  Lookup Index Tests  ##
+##########################
+def test_index_token_interval():
+    assert index.token_interval('Any') == (0, 0xFFFFFFFF)
+    assert index.token_interval('10.0.0.5') == (common.ipv4_to_int('10.0.0.5'),) * 2
+    assert index.token_interval('10.0.0.5/24') == (common.ipv4_to_int('10.0.0.0'), common.ipv4_to_int('10.0.0.255'))
+    assert index.token_interval('10.0.0.3-10.0.0.9') == (common.ipv4_to_int('10.0.0.3'), common.ipv4_to_int('10.0.0.9'))
+    assert index.token_interval('10.0.0.3-10.0.1.0/24') == (common.ipv4_to_int('10.0.0.3'), common.ipv4_to_int('10.0.1.255'))
+    assert index.token_interval('10.0.0.128/255.0.0.192') is None
+    assert index.token_interval('10.0.0') is None
+
+def test_index_lookup():
+    ip_index = index.IPIndex([['1', '10.0.0.0/24;10.0.5.1-10.0.5.3'], ['2', '10.0.0.7'], ['2', '10.0.0.0/16'], ['3', 'Any']])
+    assert ip_index.lookup('10.0.0.7') == ['1', '2', '3']
+    assert ip_index.lookup('10.0.5.2') == ['1', '2', '3']
+    assert ip_index.lookup_many(['10.0.5.4', common.ipv4_to_int('11.0.0.1')]) == [['2', '3'], ['3']]
+    with pt.raises(ValueError):
+        ip_index.lookup('10.0.0.256')
+
+def test_index_save_load(tmp_path):
+    output_file, index_file = str(tmp_path / 'out.csv'), str(tmp_path / 'out.idx')
+    main.Main([m.input_file, output_file, '--index', index_file]).run()
+    ip_index = index.IPIndex.load(index_file)
+    assert ip_index.num_prefixes == index.IPIndex.from_csv(output_file).num_prefixes
+    with open(output_file, newline='') as f:
+        exp = sorted({row[0] for row in csv.reader(f) if row[1] == 'Any' or row[1].startswith('71.129.45.34')})
+    assert set(exp) <= set(ip_index.lookup('71.129.45.34'))
+
+def test_index_stream(tmp_path):
+    output_file, index_file = str(tmp_path / 'out.csv'), str(tmp_path / 'out.idx')
+    main.Main([m.input_file, output_file, '--stream', '--index', index_file]).run()
+    exp = index.IPIndex.from_csv(output_file)
+    act = index.IPIndex.load(index_file)
+    assert act.num_prefixes == exp.num_prefixes
+    for addr in ('10.0.0.129', '71.129.45.34', '1.2.3.4'):
+        assert act.lookup(addr) == exp.lookup(addr)
+
+def test_index_empty_rows(tmp_path):
+    # a line with no subnets ('5:') is written as an empty row
+    input_file, output_file, index_file = (str(tmp_path / name) for name in ('in.csv', 'out.csv', 'out.idx'))
+    with open(input_file, 'w') as f:
+        f.write('5:\n1:10.0.0.1/255.255.255.255\n')
+    for stream in ([], ['--stream']):
+        main.Main([input_file, output_file, '--index', index_file] + stream).run()
+        for ip_index in (index.IPIndex.load(index_file), index.IPIndex.from_csv(output_file)):
+            assert ip_index.num_rows == 1
+            assert ip_index.lookup('10.0.0.1') == ['1']
+
+
+# ---------------------------------------------
+############################
+##  Binary Records Tests  ##
+############################
+def test_records_parse_token():
+    assert records.parse_token('Any') == (records.KIND_ANY, 0, 0, 0xFFFFFFFF)
+    assert records.parse_token('10.0.0.5/24') == (records.KIND_PREFIX, common.ipv4_to_int('10.0.0.5'), 4294967040,
+                                                  common.ipv4_to_int('10.0.0.255'))
+    assert records.parse_token('10.0.0.3-10.0.1.0/24') == (records.KIND_RANGE, common.ipv4_to_int('10.0.0.3'), 0,
+                                                           common.ipv4_to_int('10.0.1.255'))
+    assert records.parse_token('10.0.0.128/255.0.0.192') == (records.KIND_INVALID, common.ipv4_to_int('10.0.0.128'),
+                                                             common.ipv4_to_int('255.0.0.192'), 0)
+    assert records.parse_token('10.0.0/x') == (records.KIND_INVALID_TEXT, '10.0.0/x')
+
+def test_records_round_trip(tmp_path):
+    record_file = str(tmp_path / 'out.bin')
+    rows = [['1', 'Any'], ['2', '10.0.0.1;10.0.0.5/24'], ['2', 'x/y;10.0.0.3-10.0.0.9'], ['\u00e9', '1.2.3.4']]
+    assert records.RecordWriter.write(record_file, rows).num_records == 6
+    with records.RecordFile(record_file) as rf:
+        assert len(rf) == 6 and rf.records.nbytes == 6 * 20
+        assert list(rf)[:3] == [('1', records.KIND_ANY, 0, 0, 0xFFFFFFFF),
+                                ('2', records.KIND_PREFIX, common.ipv4_to_int('10.0.0.1'), 0xFFFFFFFF, common.ipv4_to_int('10.0.0.1')),
+                                ('2', records.KIND_PREFIX, common.ipv4_to_int('10.0.0.5'), 4294967040, common.ipv4_to_int('10.0.0.255'))]
+        id, kind, addr, _, _ = rf.record(3)
+        assert kind == records.KIND_INVALID_TEXT and rf.string(addr) == 'x/y'
+        assert rf.record(5)[0] == '\u00e9'
+
+def test_records_bad_file(tmp_path):
+    bad_file = tmp_path / 'bad.bin'
+    bad_file.write_bytes(b'x' * 64)
+    with pt.raises(ValueError):
+        records.RecordFile(str(bad_file))
+
+def test_main_binary(tmp_path):
+    output_file, record_file = str(tmp_path / 'out.csv'), str(tmp_path / 'out.bin')
+    main.Main([m.input_file, output_file, '--binary', record_file]).run()
+    with open(output_file, newline='') as f:
+        exp = [(row[0], token) for row in csv.reader(f) for token in row[1].split(';')]
+    with records.RecordFile(record_file) as rf:
+        assert [record[0] for record in rf] == [id for id, _ in exp]
+
+def test_main_binary_empty_rows(tmp_path):
+    # a line with no subnets ('5:') is written as an empty row
+    input_file, output_file, record_file = (str(tmp_path / name) for name in ('in.csv', 'out.csv', 'out.bin'))
+    with open(input_file, 'w') as f:
+        f.write('5:\n1:10.0.0.1/255.255.255.255\n')
+    for stream in ([], ['--stream']):
+        main.Main([input_file, output_file, '--binary', record_file] + stream).run()
+        with records.RecordFile(record_file) as rf:
+            assert list(rf) == [('1', records.KIND_PREFIX, common.ipv4_to_int('10.0.0.1'), 0xFFFFFFFF,
+                                 common.ipv4_to_int('10.0.0.1'))]
+        assert records.RecordWriter.from_csv(record_file, output_file).num_records == 1
+
+
+# ---------------------------------------------
+#########################
+##  Library API Tests  ##
+#########################
+def test_api_coalesce_lines(capsys, parser_obj):
+    expected = coalescence.Coalescer(parser_obj.parsed_data).datatable
+    capsys.readouterr()
+    with open(m.input_file, newline='') as f:
+        rows = list(api.coalesce_lines(f))
+    assert capsys.readouterr().out == ''
+    assert sorted(rows) == expected
+
+def test_api_coalesce_lines_is_lazy():
+    rows = api.coalesce_lines(['1:10.0.0.0/255.255.255.255,10.0.0.1/255.255.255.255', 'bad line'])
+    assert next(rows) == ['1', '10.0.0.0/31']
+    with pt.raises(IndexError):
+        next(rows)
+
+def test_api_coalesce_pairs(capsys):
+    row = api.coalesce_pairs('7', [('10.0.0.1', '255.255.255.255'), (common.ipv4_to_int('10.0.0.0'), 4294967295)])
+    assert row == ['7', '10.0.0.0/31']
+    assert api.coalesce_pairs('8', [('10.0.0.0', '255.0.0.192')]) == ['8', '10.0.0.0/255.0.0.192']
+    # mixed valid & invalid pairs are formatted like the same line parsed from a file
+    pairs = [('bad', '255.255.255.0'), ('10.0.0.2', '255.255.255.255'), ('10.0.0.1', '255.255.255.255')]
+    line = '9:' + ','.join(f'{addr}/{mask}' for addr, mask in pairs)
+    assert api.coalesce_pairs('9', pairs) == next(api.coalesce_lines([line]))
+    assert capsys.readouterr().out == ''
+
+
+# ---------------------------------------------
+#####################
+##  Service Tests  ##
+#####################
+async def service_requests(lines, unix_path=None, clients=4):
+    svc = service.CoalescingService()
+    server = await svc.start(unix_path=unix_path)
+
+    async def client(chunk):
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(''.join(line + '\n' for line in chunk + [service.STATS_COMMAND]).encode())
+        await writer.drain()
+        replies = [(await reader.readline()).decode().rstrip('\n') for _ in range(len(chunk) + 1)]
+        writer.close()
+        return replies
+
+    results = await asyncio.gather(*(client(lines[idx::clients]) for idx in range(clients)))
+    await svc.close()
+    return results
+
+def test_service_matches_batch_cli(tmp_path, coalescer_obj):
+    with open(m.input_file, newline='') as f:
+        lines = f.read().splitlines()[:1000]
+    results = asyncio.run(service_requests(lines))
+    replies = [reply for result in results for reply in result[:-1]]
+    expected = [service.format_reply(coalescence.Coalescer([dataparser.parse_line(line)]).datatable[0]) for line in lines]
+    assert sorted(replies) == sorted(expected)
+    stats = json.loads(results[-1][-1])
+    assert set(stats) >= {'queue_depth', 'p50_ms', 'p99_ms', 'batches', 'memo_hits'}
+
+def test_service_unix_socket_and_errors(tmp_path):
+    results = asyncio.run(service_requests(['1:10.0.0.0/255.255.255.255,10.0.0.1/255.255.255.255', 'bad line'],
+                                           unix_path=str(tmp_path / 'svc.sock'), clients=1))
+    replies = results[0]
+    assert replies[0] == '1,10.0.0.0/31'
+    assert replies[1].startswith('ERROR')
+    assert json.loads(replies[2])['errors'] == 1
+
+def test_service_non_utf8_request(tmp_path):
+    async def requests():
+        svc = service.CoalescingService()
+        server = await svc.start()
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(b'1:10.0.0.\xff/255.255.255.255\n1:10.0.0.1/255.255.255.255\n' + service.STATS_COMMAND.encode() + b'\n')
+        await writer.drain()
+        replies = [(await reader.readline()).decode().rstrip('\n') for _ in range(3)]
+        writer.close()
+        await svc.close()
+        return replies
+    replies = asyncio.run(requests())
+    assert replies[0].startswith('ERROR UnicodeDecodeError')
+    assert replies[1] == '1,10.0.0.1'
+    assert json.loads(replies[2])['errors'] == 1
+
+def test_percentile():
+    assert service.percentile([], 50) == 0.0
+    assert service.percentile(list(range(1, 101)), 50) == 50
+    assert service.percentile(list(range(1, 101)), 99) == 99
+
+
+# ---------------------------------------------
+#######################
+##  Benchmark Tests  ##
+#######################
+def test_input_generator_format():
+    gen = benchmark.InputGenerator(200, subnets_per_line=4, seed=1)
+    lines = list(gen.generate())
+    assert len(lines) == 200
+    rows = [dataparser.parse_line(line) for line in lines]
+    assert all(len(row[1]) in (1, 4) for row in rows)
+
+def test_input_generator_coalesces():
+    gen = benchmark.InputGenerator(50, subnets_per_line=8, host_run_share=1.0, contiguous_share=0.0,
+                                   duplicate_share=0.0, invalid_mask_share=0.0)
+    data = [dataparser.parse_line(line) for line in gen.generate()]
+    obj = coalescence.Coalescer(data)
+    assert all(';' not in row[1] for row in obj.datatable)
+
+def test_find_regressions():
+    baseline = {'10k': {'stages': {'parser': {'lines_per_sec': 1000.0}}, 'peak_rss_mb': 40.0}}
+    results = {'10k': {'stages': {'parser': {'lines_per_sec': 850.0}}, 'peak_rss_mb': 41.0}}
+    assert len(benchmark.find_regressions(results, baseline)) == 1
+    assert benchmark.find_regressions(baseline, baseline) == []
+    # peak memory is compared per tier, not per stage
+    results = {'10k': {'stages': {'parser': {'lines_per_sec': 1000.0}}, 'peak_rss_mb': 50.0}}
+    assert benchmark.find_regressions(results, baseline) == ['10k: peak memory 40.0 -> 50.0 MB']
+
+def test_run_stages(tmp_path):
+    input_file = str(tmp_path / 'input.csv')
+    benchmark.InputGenerator(100, seed=2).write_file(input_file)
+    results = benchmark.run_stages(input_file, str(tmp_path / 'out.csv'))
+    assert list(results['stages']) == ['parser', 'coalescer', 'filewriter']
+    assert all('peak_rss_mb' not in stage for stage in results['stages'].values())
+    assert results['peak_rss_mb'] > 0
+
 
 # ---------------------------------------------
 ##################
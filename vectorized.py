@@ -0,0 +1,115 @@
+import common
+
+# NumPy is optional: the scalar functions in 'common' are used wherever it is not installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+##########################
+##  Vectorized (NumPy)  ##
+##########################
+
+# ---------------------------------------------
+# Batch versions of the scalar IPv4/Mask/CIDR conversions in 'common'.
+# Every function works on a whole column (list/array) at once and returns exactly what the scalar
+# function would return for each element.
+
+# the longest valid-looking ipv4 string handled by the vectorized path ('255.255.255.255');
+# longer strings (e.g. octets with leading zeros) are rare and go through the scalar path
+MAX_IPV4_LEN = 15
+
+# function to check if the vectorized engine can be used
+def is_available() -> bool:
+    return np is not None
+
+# function to raise a helpful error if NumPy is not installed
+def check_available():
+    if np is None:
+        raise ImportError("The vectorized engine requires NumPy ('pip install numpy').")
+
+# the 33 valid masks, ascending (cidr# == index into the table)
+def _valid_masks():
+    return np.array([(0xFFFFFFFF << (32 - cidr)) & 0xFFFFFFFF for cidr in range(33)], dtype=np.int64)
+
+# function to convert a column of IPv4 strings to uint32
+#   returns tuple: (uint32 array of addresses & bool array of valid flags); invalid addresses are 0
+def ipv4_to_uint32(ipv4_list: list):
+    check_available()
+    count = len(ipv4_list)
+    addrs = np.zeros(count, dtype=np.uint32)
+    valid = np.zeros(count, dtype=bool)
+    if count == 0:
+        return (addrs, valid)
+    # split the column into short strings (vectorized) and long strings (scalar fallback)
+    lengths = np.fromiter(map(len, ipv4_list), dtype=np.int64, count=count)
+    short = lengths <= MAX_IPV4_LEN
+    short_idx = np.flatnonzero(short)
+    # view the fixed-width unicode array as a matrix of code points (one row per string)
+    chars = np.array([ipv4_list[i] for i in short_idx], dtype=f'U{MAX_IPV4_LEN}')
+    chars = chars.view(np.uint32).reshape(len(short_idx), MAX_IPV4_LEN).astype(np.int64)
+    lengths_short = lengths[short_idx]
+    inside = np.arange(MAX_IPV4_LEN) < lengths_short[:, None]
+    is_digit = (chars >= 48) & (chars <= 57) & inside
+    is_dot = (chars == 46) & inside
+    # non-ascii strings may hold other unicode decimals (str.isdecimal), so they use the scalar path
+    non_ascii = ((chars > 127) & inside).any(axis=1)
+    # the format must be 4 non-empty decimal octets separated by 3 dots
+    fmt_ok = ~(inside & ~is_digit & ~is_dot).any(axis=1)
+    fmt_ok &= is_dot.sum(axis=1) == 3
+    fmt_ok &= ~is_dot[:, 0]
+    fmt_ok &= ~is_dot[np.arange(len(short_idx)), np.maximum(lengths_short - 1, 0)]
+    fmt_ok &= ~(is_dot[:, 1:] & is_dot[:, :-1]).any(axis=1)
+    # accumulate each octet's value one column at a time (all rows at once)
+    field = np.minimum(np.cumsum(is_dot, axis=1), 3)
+    octets = np.zeros((len(short_idx), 4), dtype=np.int64)
+    for col in range(MAX_IPV4_LEN):
+        rows = np.flatnonzero(is_digit[:, col])
+        fields = field[rows, col]
+        octets[rows, fields] = octets[rows, fields] * 10 + (chars[rows, col] - 48)
+    fmt_ok &= (octets <= 255).all(axis=1)
+    octets = np.where(fmt_ok[:, None], octets, 0)
+    addrs[short_idx] = (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+    valid[short_idx] = fmt_ok
+    # scalar fallback for the long & non-ascii strings
+    for i in np.concatenate((np.flatnonzero(~short), short_idx[non_ascii])):
+        result = common.ipv4_to_int(ipv4_list[i])
+        if not isinstance(result, str):
+            addrs[i], valid[i] = result, True
+        else:
+            addrs[i], valid[i] = 0, False
+    return (addrs, valid)
+
+# function to convert a column of IPv4 strings like common.ipv4_to_int()
+#   returns list: 'int' for each valid IPv4, the original string for each invalid one
+def ipv4_to_int_list(ipv4_list: list) -> list:
+    addrs, valid = ipv4_to_uint32(ipv4_list)
+    return [addr if is_valid else ipv4 for addr, is_valid, ipv4 in zip(addrs.tolist(), valid.tolist(), ipv4_list)]
+
+# function to validate a column of mask values and get their cidr #'s
+#   returns tuple: (bool array of valid flags & int8 array of cidr #'s; -1 where the mask is invalid)
+def mask_to_cidr(masks):
+    check_available()
+    masks = np.asarray(masks, dtype=np.int64)
+    table = _valid_masks()
+    idx = np.minimum(np.searchsorted(table, masks), 32)
+    valid = table[idx] == masks
+    cidrs = np.where(valid, idx, -1).astype(np.int8)
+    return (valid, cidrs)
+
+# function to convert a column of integers to IPv4 strings like common.int_to_ipv4()
+def uint32_to_ipv4(nums) -> list:
+    check_available()
+    nums = np.asarray(nums, dtype=np.int64)
+    # IPv4 format must be non-negative and between 0 -> 32 bits
+    if nums.size and (nums.min() < 0 or nums.max() > 0xFFFFFFFF):
+        raise ValueError("uint32_to_ipv4() values must be non-negative and 32bits or less.")
+    octet_strs = np.array([str(octet) for octet in range(256)])
+    ipv4 = octet_strs[(nums >> 24) & 0xFF]
+    for shift in (16, 8, 0):
+        ipv4 = np.char.add(np.char.add(ipv4, '.'), octet_strs[(nums >> shift) & 0xFF])
+    return ipv4.tolist()
+
+
+# ---------------------------------------------